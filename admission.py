@@ -0,0 +1,160 @@
+"""
+Admission control for /process-bill.
+
+Instead of queueing every upload no matter how deep the backlog is, each
+request is checked against the live depth and recent throughput of the
+vision queue and against a per-user in-flight limit tracked in Redis.
+Admitted requests get an estimated start time; the rest are told when to
+retry.
+"""
+
+import math
+import os
+import time
+from typing import Optional
+
+from task_queues import VISION_QUEUE, queue_depths, queue_throughput
+
+
+# ============================================================================
+# CONFIGURATION
+# ============================================================================
+
+# Reject when the estimated wait before a worker starts the task exceeds this
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "120"))
+
+# Maximum bills a single user may have queued or processing at once
+ADMISSION_MAX_INFLIGHT_PER_USER = int(os.getenv("ADMISSION_MAX_INFLIGHT_PER_USER", "3"))
+
+# Throughput assumed while there is no completion history yet (tasks/second)
+ADMISSION_DEFAULT_THROUGHPUT = float(os.getenv("ADMISSION_DEFAULT_THROUGHPUT", "0.5"))
+
+# How long a broker depth reading is reused before asking RabbitMQ again
+ADMISSION_DEPTH_CACHE_SECONDS = float(os.getenv("ADMISSION_DEPTH_CACHE_SECONDS", "2"))
+
+# In-flight entries older than this are treated as lost (crashed tasks)
+INFLIGHT_TTL_SECONDS = int(os.getenv("ADMISSION_INFLIGHT_TTL_SECONDS", "900"))
+
+# Retry-After sent when a user hits their in-flight limit
+INFLIGHT_RETRY_AFTER_SECONDS = 15
+
+
+class AdmissionDecision:
+    """Outcome of an admission check"""
+    def __init__(self, admitted: bool, estimated_start_seconds: float,
+                 queue_depth: Optional[int], throughput: float,
+                 reason: Optional[str] = None, retry_after: Optional[int] = None):
+        self.admitted = admitted
+        self.estimated_start_seconds = estimated_start_seconds
+        self.queue_depth = queue_depth
+        self.throughput = throughput
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def to_dict(self) -> dict:
+        return {
+            "estimated_start_seconds": round(self.estimated_start_seconds, 1),
+            "queue_depth": self.queue_depth,
+            "throughput_per_second": round(self.throughput, 3),
+        }
+
+
+class AdmissionController:
+    """Decides whether a new bill may be queued, and tracks per-user in-flight bills"""
+
+    def __init__(self, celery_app, redis_client,
+                 max_wait_seconds: float = ADMISSION_MAX_WAIT_SECONDS,
+                 max_inflight_per_user: int = ADMISSION_MAX_INFLIGHT_PER_USER):
+        self.celery_app = celery_app
+        self.redis = redis_client
+        self.max_wait_seconds = max_wait_seconds
+        self.max_inflight_per_user = max_inflight_per_user
+        self._depth = None
+        self._depth_read_at = 0.0
+
+    # ---- queue backlog -----------------------------------------------------
+
+    def vision_queue_depth(self) -> Optional[int]:
+        """Live vision queue depth, cached briefly so spikes don't hammer the broker"""
+        now = time.monotonic()
+        if now - self._depth_read_at > ADMISSION_DEPTH_CACHE_SECONDS:
+            try:
+                self._depth = queue_depths(self.celery_app)[VISION_QUEUE]["depth"]
+            except Exception as e:
+                print(f"⚠️ Admission could not read queue depth: {e}")
+                self._depth = None
+            self._depth_read_at = now
+        return self._depth
+
+    def estimate_start_seconds(self, depth: Optional[int], throughput: float) -> float:
+        """Seconds until a newly queued task would be picked up by a worker"""
+        if not depth:
+            return 0.0
+        rate = throughput if throughput > 0 else ADMISSION_DEFAULT_THROUGHPUT
+        return depth / rate
+
+    def check(self, owner: str) -> AdmissionDecision:
+        """Check the backlog bound and the owner's in-flight limit"""
+        depth = self.vision_queue_depth()
+        throughput = queue_throughput(self.redis, VISION_QUEUE)
+        estimate = self.estimate_start_seconds(depth, throughput)
+
+        if estimate > self.max_wait_seconds:
+            return AdmissionDecision(
+                False, estimate, depth, throughput,
+                reason="Processing queue is full, please retry later",
+                retry_after=max(1, math.ceil(estimate - self.max_wait_seconds)),
+            )
+
+        if self.inflight_count(owner) >= self.max_inflight_per_user:
+            return AdmissionDecision(
+                False, estimate, depth, throughput,
+                reason=f"Too many bills in progress (limit {self.max_inflight_per_user})",
+                retry_after=INFLIGHT_RETRY_AFTER_SECONDS,
+            )
+
+        return AdmissionDecision(True, estimate, depth, throughput)
+
+    # ---- per-user in-flight tracking ---------------------------------------
+
+    def _inflight_key(self, owner: str) -> str:
+        return f"inflight:{owner}"
+
+    def inflight_count(self, owner: str) -> int:
+        """Bills currently queued or processing for this owner"""
+        key = self._inflight_key(owner)
+        self.redis.zremrangebyscore(key, 0, time.time() - INFLIGHT_TTL_SECONDS)
+        return self.redis.zcard(key)
+
+    def acquire(self, owner: str, bill_id: str) -> bool:
+        """
+        Reserve an in-flight slot for bill_id. Returns False (and reserves
+        nothing) if a concurrent request already took the last slot.
+        """
+        key = self._inflight_key(owner)
+        pipe = self.redis.pipeline()
+        pipe.zadd(key, {bill_id: time.time()})
+        pipe.zcard(key)
+        pipe.expire(key, INFLIGHT_TTL_SECONDS)
+        pipe.set(f"inflight_owner:{bill_id}", owner, ex=INFLIGHT_TTL_SECONDS)
+        _, count, _, _ = pipe.execute()
+
+        if count > self.max_inflight_per_user:
+            self.release(bill_id)
+            return False
+        return True
+
+    def release(self, bill_id: str):
+        """Free the in-flight slot held by bill_id, if any"""
+        release_inflight(self.redis, bill_id)
+
+
+def release_inflight(redis_client, bill_id: str):
+    """Free a bill's in-flight slot (called by workers when a bill finishes or fails)"""
+    owner_key = f"inflight_owner:{bill_id}"
+    owner = redis_client.get(owner_key)
+    if owner:
+        pipe = redis_client.pipeline()
+        pipe.zrem(f"inflight:{owner}", bill_id)
+        pipe.delete(owner_key)
+        pipe.execute()
@@ -5,6 +5,8 @@ import supabase
 from supabase import create_client, Client
 import os
 from redis import Redis
+from redis.exceptions import RedisError
+import asyncio
 import jwt
 from pydantic import BaseModel
 from datetime import datetime, timedelta
@@ -56,6 +58,7 @@ def cache_user_session(email: str, user_data: dict, access_token: str):
         "email": email,
         "name": user_data.get("name", ""),
         "google_id": user_data.get("google_id", ""),
+        "user_id": user_data.get("user_id"),
         "access_token": access_token,
         "last_activity": datetime.utcnow().isoformat(),
         "created_at": datetime.utcnow().isoformat()
@@ -191,14 +194,17 @@ async def verify_token(data: TokenData):
                 new_user = User(email=email, name=name, google_id=google_id)
                 session.add(new_user)
                 await session.commit()
+                user_id = new_user.id
                 print(f"✅ New user created: {email}")
             else:
+                user_id = existing_user.id
                 print(f"✅ Existing user found: {email}")
         
         # Cache the session in Redis
         user_data = {
             "name": name,
-            "google_id": google_id
+            "google_id": google_id,
+            "user_id": user_id
         }
         cache_user_session(email, user_data, access_token)
         
@@ -337,4 +343,52 @@ async def get_current_user(authorization: Optional[str] = Header(None)) -> dict:
         "email": session_data["email"],
         "name": session_data["name"],
         "google_id": session_data["google_id"]
-    }
\ No newline at end of file
+    }
+
+
+async def get_optional_user(authorization: Optional[str] = Header(None)) -> Optional[str]:
+    """
+    Dependency returning the caller's email if they sent a valid session token,
+    or None for anonymous requests. Never raises: if the session store can't
+    be reached the request is treated as anonymous.
+    """
+    if not authorization or not authorization.startswith("Bearer "):
+        return None
+
+    access_token = authorization.replace("Bearer ", "")
+    try:
+        return await asyncio.to_thread(get_user_from_token, access_token)
+    except RedisError as e:
+        print(f"⚠️ Session lookup failed, treating request as anonymous: {e}")
+        return None
+
+
+async def resolve_user_id(email: Optional[str]) -> Optional[int]:
+    """
+    users.id for an email: from the cached session when it has one,
+    otherwise from the database (sessions created before user_id was cached).
+    """
+    if not email:
+        return None
+
+    try:
+        session_data = await asyncio.to_thread(get_cached_session, email)
+    except RedisError as e:
+        print(f"⚠️ Session lookup failed, resolving user from the database: {e}")
+        session_data = None
+    if session_data and session_data.get("user_id"):
+        return session_data["user_id"]
+
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(User.id).where(User.email == email))
+        user_id = result.scalar_one_or_none()
+
+    if user_id and session_data:
+        session_data["user_id"] = user_id
+        try:
+            await asyncio.to_thread(
+                redis_client.set, f"session:{email}", json.dumps(session_data), keepttl=True
+            )
+        except RedisError as e:
+            print(f"⚠️ Could not cache user_id in the session: {e}")
+    return user_id
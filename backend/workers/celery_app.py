@@ -15,6 +15,8 @@ celery_app.conf.update(
     result_serializer='json',
     timezone='UTC',
     enable_utc=True,
-    worker_pool='solo',  
-    
+    # Pool and concurrency are chosen per queue on the command line
+    # (see task_queues.py and docker-compose.yml)
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
 )
\ No newline at end of file
@@ -0,0 +1,199 @@
+"""
+Backfill bill_items / bill_shares (and bill_data for sample files) with COPY.
+
+Sources:
+  - existing bill_data rows, streamed through a server-side cursor
+  - the JSON documents in data/processed_bills (or a bill_archive.py
+    archive of them), which are first loaded into bill_data (through a COPY
+    into a staging table) when they aren't there yet
+
+Each batch replaces the normalized rows of its bills in one transaction, so
+the job is safe to re-run.
+
+Usage:
+    python backfill_items.py                    # database rows + data/processed_bills
+    python backfill_items.py --missing-only     # only bills without any bill_items yet
+    python backfill_items.py --skip-db --files path/to/json/dir
+    python backfill_items.py --files data/processed_bills.bpack
+"""
+
+import argparse
+import csv
+import glob
+import io
+import json
+import os
+import time
+from typing import Dict, Iterator, List, Tuple
+
+import psycopg2
+from dotenv import load_dotenv
+
+from bill_archive import iter_bills
+from bill_items import ITEM_COLUMNS, SHARE_COLUMNS, item_rows, share_rows
+from bill_summary import summarize
+from worker_db import sync_database_url
+
+load_dotenv()
+
+DEFAULT_FILES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "processed_bills")
+
+STAGING_COLUMNS = ("bill_id", "file_name", "bill_json", "merchant", "total", "bill_date", "item_count", "search_text")
+
+
+def pg_array(values: List[str]) -> str:
+    """Postgres array literal for a text[] column in COPY input"""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"') for v in values)
+    return "{" + ",".join(f'"{v}"' for v in escaped) + "}"
+
+
+def copy_rows(cur, table: str, columns: Tuple[str, ...], rows, not_null: Tuple[str, ...] = ()):
+    """COPY rows into a table as CSV (None becomes NULL)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(pg_array(v) if isinstance(v, list) else v for v in row)
+    buffer.seek(0)
+
+    options = "FORMAT csv"
+    if not_null:
+        # Empty strings in these columns stay empty strings instead of NULL
+        options += f", FORCE_NOT_NULL ({', '.join(not_null)})"
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH ({options})", buffer)
+
+
+def load_normalized(conn, bills: List[Tuple[str, Dict]]) -> Tuple[int, int]:
+    """Replace bill_items/bill_shares for a batch of bills; returns (items, shares) written"""
+    items = [row for bill_id, bill_json in bills for row in item_rows(bill_id, bill_json)]
+    shares = [row for bill_id, bill_json in bills for row in share_rows(bill_id, bill_json)]
+
+    with conn.cursor() as cur:
+        bill_ids = [bill_id for bill_id, _ in bills]
+        cur.execute("DELETE FROM bill_items WHERE bill_id = ANY(%s)", (bill_ids,))
+        cur.execute("DELETE FROM bill_shares WHERE bill_id = ANY(%s)", (bill_ids,))
+        copy_rows(cur, "bill_items", ITEM_COLUMNS, items, not_null=("name",))
+        copy_rows(cur, "bill_shares", SHARE_COLUMNS, shares, not_null=("person",))
+    conn.commit()
+    return len(items), len(shares)
+
+
+def load_bill_files(conn, documents: List[Dict]) -> Tuple[int, List[Tuple[str, Dict]]]:
+    """
+    Insert sample documents into bill_data unless their bill_id exists.
+    Returns the rows inserted and (bill_id, bill_json) as stored for every
+    document's bill_id, which for an existing id is the row already there,
+    not the file.
+    """
+    staging = []
+    for doc in documents:
+        bill_json = {"bill_data": doc.get("bill_data"), "split_result": doc.get("split_result")}
+        summary = summarize(bill_json)
+        staging.append((
+            doc["bill_id"], doc.get("file_name") or "", json.dumps(bill_json),
+            summary["merchant"], summary["total"], summary["bill_date"], summary["item_count"],
+            summary["search_text"],
+        ))
+
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TEMP TABLE staging_bills (
+                bill_id TEXT, file_name TEXT, bill_json JSONB, merchant VARCHAR(255),
+                total NUMERIC(12, 2), bill_date DATE, item_count INTEGER, search_text TEXT
+            ) ON COMMIT DROP
+        """)
+        copy_rows(cur, "staging_bills", STAGING_COLUMNS, staging, not_null=("file_name",))
+        cur.execute(f"""
+            INSERT INTO bill_data ({', '.join(STAGING_COLUMNS)})
+            SELECT {', '.join(STAGING_COLUMNS)} FROM staging_bills
+            ON CONFLICT (bill_id) DO NOTHING
+        """)
+        inserted = cur.rowcount
+        cur.execute("""
+            SELECT b.bill_id, b.bill_json FROM bill_data b
+            WHERE b.bill_id IN (SELECT bill_id FROM staging_bills)
+        """)
+        stored = cur.fetchall()
+    conn.commit()
+    return inserted, stored
+
+
+def database_bills(conn, batch_size: int, missing_only: bool) -> Iterator[List[Tuple[str, Dict]]]:
+    """Batches of (bill_id, bill_json) from bill_data via a server-side cursor"""
+    query = "SELECT bill_id, bill_json FROM bill_data b"
+    if missing_only:
+        query += " WHERE NOT EXISTS (SELECT 1 FROM bill_items i WHERE i.bill_id = b.bill_id)"
+
+    with conn.cursor(name="backfill_bills") as cur:
+        cur.itersize = batch_size
+        cur.execute(query)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [(bill_id, bill_json) for bill_id, bill_json in rows]
+
+
+def bill_files(files: str) -> Iterator[Dict]:
+    """Documents from a directory of JSON files, or from a bill archive"""
+    if os.path.isfile(files):
+        yield from iter_bills(files)
+        return
+    for path in sorted(glob.glob(os.path.join(files, "*.json"))):
+        with open(path) as f:
+            yield json.load(f)
+
+
+def file_batches(files: str, batch_size: int) -> Iterator[List[Dict]]:
+    batch = []
+    for doc in bill_files(files):
+        if doc.get("bill_id"):
+            batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", default=DEFAULT_FILES_DIR, help="Directory of processed bill JSON files, or an archive")
+    parser.add_argument("--skip-files", action="store_true")
+    parser.add_argument("--skip-db", action="store_true", help="Don't re-normalize existing bill_data rows")
+    parser.add_argument("--missing-only", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    bills = items = shares = inserted = 0
+
+    writer = psycopg2.connect(sync_database_url())
+    try:
+        if not args.skip_files and os.path.exists(args.files):
+            for documents in file_batches(args.files, args.batch_size):
+                added, batch = load_bill_files(writer, documents)
+                inserted += added
+                if args.skip_db:
+                    # Normalize what bill_data holds, even where a file lost to an existing row
+                    i, s = load_normalized(writer, batch)
+                    bills, items, shares = bills + len(batch), items + i, shares + s
+            print(f"✅ Loaded {inserted} new bills from {args.files}")
+
+        if not args.skip_db:
+            reader = psycopg2.connect(sync_database_url())
+            try:
+                for batch in database_bills(reader, args.batch_size, args.missing_only):
+                    i, s = load_normalized(writer, batch)
+                    bills, items, shares = bills + len(batch), items + i, shares + s
+                    print(f"   {bills} bills normalized...")
+            finally:
+                reader.close()
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ {bills} bills -> {items} items, {shares} shares in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
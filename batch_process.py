@@ -0,0 +1,436 @@
+"""
+Offline batch processing of a directory (or zip/tar archive) of receipts.
+
+For expense reports with hundreds of receipts, instead of pushing each one
+through /process-bill and the queue:
+
+  1. images are read and hashed (sha256 of the original bytes, the same
+     content_hash the API uses) and duplicates are dropped: repeats within
+     the run, bills finished by an earlier run (checkpoint) and bills
+     already in bill_data for the same instruction and user
+  2. decoding, EXIF rotation, downscaling and JPEG re-encoding run in a
+     ProcessPoolExecutor
+  3. receipts are extracted several per vision call (batch size tuned
+     from observed latency and validation failures, with single-image
+     fallback), then split, on a thread pool paced by the shared Gemini
+     rate limiter
+  4. results go to bill_data through the batched writer (multi-row upserts,
+     items/shares and spend aggregates in the same transaction) and to
+     data/processed_bills-style JSON files
+
+Every finished, duplicate or failed image is appended to a checkpoint file,
+so an interrupted run picks up where it stopped (failed images are retried).
+
+Usage:
+    python batch_process.py receipts/ --instruction "Split equally between Ann and Bo"
+    python batch_process.py expenses.zip --user-id 42 --workers 4 --concurrency 8
+    python batch_process.py receipts/ --no-db --output out/
+    python batch_process.py receipts/ --batch-size 1     # one receipt per vision call
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import tarfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from PIL import Image, ImageOps
+
+from bill_cache import CachedBill, bill_payload
+from rate_limiter import gemini_limiter
+from receipt_tiling import is_tall
+from upload_stream import SNIFF_BYTES, sniff_image_type
+from worker_db import close_worker_db, get_bill_writer, get_worker_pool
+
+load_dotenv()
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+DEFAULT_OUTPUT_DIR = os.path.join(DATA_DIR, "processed_bills")
+CHECKPOINT_DIR = os.path.join(DATA_DIR, "batch_checkpoints")
+
+DEFAULT_INSTRUCTION = "Split equally"
+
+# Longest side sent to the vision model; receipts stay legible well below phone camera sizes
+BATCH_MAX_IMAGE_SIDE = int(os.getenv("BATCH_MAX_IMAGE_SIDE", "2048"))
+BATCH_JPEG_QUALITY = int(os.getenv("BATCH_JPEG_QUALITY", "90"))
+
+EXIF_ORIENTATION = 0x0112
+
+# Checkpoint statuses that mean "don't process this image again"
+FINISHED = ("done", "duplicate")
+
+
+# ============================================================================
+# SOURCES
+# ============================================================================
+
+def iter_images(source: str) -> Iterator[Tuple[str, bytes]]:
+    """(name, bytes) for every image in a directory tree, zip or tar archive"""
+    if os.path.isdir(source):
+        for root, _, files in os.walk(source):
+            for filename in sorted(files):
+                path = os.path.join(root, filename)
+                with open(path, "rb") as f:
+                    content = f.read()
+                if sniff_image_type(content[:SNIFF_BYTES]):
+                    yield os.path.relpath(path, source), content
+    elif zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                content = archive.read(info)
+                if sniff_image_type(content[:SNIFF_BYTES]):
+                    yield info.filename, content
+    elif tarfile.is_tarfile(source):
+        with tarfile.open(source) as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue
+                content = archive.extractfile(member).read()
+                if sniff_image_type(content[:SNIFF_BYTES]):
+                    yield member.name, content
+    else:
+        raise ValueError(f"{source} is not a directory, zip or tar archive")
+
+
+def size_limit(size: Tuple[int, int], max_side: int) -> Tuple[int, int]:
+    """Box an image is shrunk to fit; receipts that will be tiled are limited in width only"""
+    width, height = size
+    if is_tall(size):
+        return max_side, max(max_side, height * max_side // width)
+    return max_side, max_side
+
+
+def prepare_image(content: bytes, max_side: int = BATCH_MAX_IMAGE_SIDE,
+                  quality: int = BATCH_JPEG_QUALITY) -> bytes:
+    """
+    Upright, downscaled JPEG for the vision model (runs in a pool process).
+    Long receipts that will be tiled are only limited in width, so their
+    bands stay legible. Images already small enough and in JPEG are passed
+    through untouched.
+    """
+    with Image.open(io.BytesIO(content)) as img:
+        rotated = img.getexif().get(EXIF_ORIENTATION, 1) != 1
+        if img.format == "JPEG" and not rotated:
+            limit = size_limit(img.size, max_side)
+            if img.width <= limit[0] and img.height <= limit[1]:
+                return content
+        upright = ImageOps.exif_transpose(img)
+        upright.thumbnail(size_limit(upright.size, max_side))
+        out = io.BytesIO()
+        upright.convert("RGB").save(out, format="JPEG", quality=quality, optimize=True)
+        return out.getvalue()
+
+
+# ============================================================================
+# CHECKPOINT
+# ============================================================================
+
+class Checkpoint:
+    """Append-only JSON-lines log of what happened to each image, by content hash"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.finished: Dict[str, Dict] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line from an interrupted run
+                    if entry.get("status") in FINISHED:
+                        self.finished[entry["content_hash"]] = entry
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "a")
+        self._lock = threading.Lock()
+
+    def record(self, content_hash: str, name: str, status: str, **extra):
+        entry = {"content_hash": content_hash, "name": name, "status": status, **extra}
+        with self._lock:
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+            if status in FINISHED:
+                self.finished[content_hash] = entry
+
+    def close(self):
+        self._file.close()
+
+
+def default_checkpoint_path(source: str, instruction: str, user_id: Optional[int]) -> str:
+    key = hashlib.sha256(f"{os.path.abspath(source)}|{instruction}|{user_id}".encode()).hexdigest()[:12]
+    return os.path.join(CHECKPOINT_DIR, f"{os.path.basename(source.rstrip(os.sep))}-{key}.jsonl")
+
+
+# ============================================================================
+# BATCH RUN
+# ============================================================================
+
+class BatchStats:
+    """Counters and stage timings for the final report"""
+
+    def __init__(self):
+        self.counts = {"images": 0, "done": 0, "failed": 0, "dup_run": 0, "dup_checkpoint": 0, "dup_db": 0}
+        self.timings: Dict[str, List[float]] = {"prepare": [], "vision": [], "split": [], "db_write": []}
+        self.bytes_in = 0
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def count(self, key: str):
+        with self._lock:
+            self.counts[key] += 1
+
+    def time(self, stage: str, seconds: float):
+        with self._lock:
+            self.timings[stage].append(seconds)
+
+    def report(self, rate_wait: float, usage: Optional[Dict] = None) -> str:
+        elapsed = time.perf_counter() - self.started
+        c = self.counts
+        lines = [
+            f"{c['images']} images ({self.bytes_in / 1e6:.1f} MB) in {elapsed:.1f}s",
+            f"  processed  {c['done']}  ({c['done'] / elapsed * 60:.1f} bills/min)",
+            f"  duplicates {c['dup_run'] + c['dup_checkpoint'] + c['dup_db']} "
+            f"(in run {c['dup_run']}, earlier run {c['dup_checkpoint']}, database {c['dup_db']})",
+            f"  failed     {c['failed']}",
+            f"  rate limiter wait {rate_wait:.1f}s",
+        ]
+        if usage:
+            lines.append(f"  vision calls {usage['calls']} ({usage['fallbacks']} single-image fallbacks), "
+                         f"{usage['prompt_tokens']} prompt + {usage['output_tokens']} output tokens")
+        for stage, samples in self.timings.items():
+            if samples:
+                samples = sorted(samples)
+                p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+                lines.append(f"  {stage:<9} avg {sum(samples) / len(samples):6.2f}s  p95 {p95:6.2f}s")
+        return "\n".join(lines)
+
+
+def find_stored_bill(content_hash: str, instruction: str, user_id: Optional[int]) -> Optional[str]:
+    """bill_id of a bill already processed from this image with this instruction"""
+    def lookup(conn):
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT bill_id FROM bill_data WHERE content_hash = %s AND instruction = %s "
+                "AND user_id IS NOT DISTINCT FROM %s LIMIT 1",
+                (content_hash, instruction, user_id),
+            )
+            row = cur.fetchone()
+            return row[0] if row else None
+    return get_worker_pool().run(lookup)
+
+
+class BatchRun:
+    def __init__(self, system, instruction: str, user_id: Optional[int], output_dir: Optional[str],
+                 checkpoint: Checkpoint, use_db: bool, workers: int, concurrency: int, batch_size: int = 0):
+        self.system = system
+        self.instruction = instruction
+        self.user_id = user_id
+        self.output_dir = output_dir
+        self.checkpoint = checkpoint
+        self.use_db = use_db
+        self.stats = BatchStats()
+        # spawn: the DB writer's flusher thread may already be running, and forking threads is unsafe
+        self.prepare_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        self.call_pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch-vision")
+        self.processor = system.bill_processor
+        if hasattr(self.processor, "limiter"):
+            self.processor.limiter = gemini_limiter
+        # The split agent makes one model call per step, each paced on its own
+        if hasattr(system.expense_splitter, "limiter"):
+            system.expense_splitter.limiter = gemini_limiter
+        # 0: let the processor's tuner pick (processors without one get 1)
+        self.batch_size = batch_size
+        max_batch = batch_size or getattr(getattr(self.processor, "batch_tuner", None), "max_size", 1)
+        # Images read but not finished; bounds memory for large sources (and fits a full batch)
+        self._window = threading.BoundedSemaphore(max(concurrency * 2 + workers, max_batch * 2))
+        self._seen = set()
+        self._ready: List[Tuple[str, str, bytes]] = []
+        self._ready_lock = threading.Lock()
+        self._outstanding = []
+
+    def submit(self, name: str, content: bytes):
+        self.stats.count("images")
+        self.stats.bytes_in += len(content)
+        content_hash = hashlib.sha256(content).hexdigest()
+
+        if content_hash in self._seen:
+            self.stats.count("dup_run")
+            return
+        self._seen.add(content_hash)
+        if content_hash in self.checkpoint.finished:
+            self.stats.count("dup_checkpoint")
+            return
+        if self.use_db:
+            existing = find_stored_bill(content_hash, self.instruction, self.user_id)
+            if existing:
+                self.stats.count("dup_db")
+                self.checkpoint.record(content_hash, name, "duplicate", bill_id=existing)
+                return
+
+        self._window.acquire()
+        started = time.perf_counter()
+        prepared = self.prepare_pool.submit(prepare_image, content)
+        prepared.add_done_callback(lambda f: self._prepared(f, name, content_hash, started))
+
+    def _prepared(self, future, name: str, content_hash: str, started: float):
+        self.stats.time("prepare", time.perf_counter() - started)
+        try:
+            image = future.result()
+        except Exception as e:
+            self._failed(name, content_hash, f"unreadable image: {e}")
+            self._window.release()
+            return
+        with self._ready_lock:
+            self._ready.append((name, content_hash, image))
+        self._dispatch()
+
+    def _current_batch_size(self) -> int:
+        if self.batch_size:
+            return self.batch_size
+        tuner = getattr(self.processor, "batch_tuner", None)
+        return tuner.size if tuner else 1
+
+    def _dispatch(self, flush: bool = False):
+        """Send ready images to the vision stage in batches (flush: the remainder too)"""
+        with self._ready_lock:
+            while self._ready:
+                size = self._current_batch_size()
+                if len(self._ready) < size and not flush:
+                    break
+                batch, self._ready = self._ready[:size], self._ready[size:]
+                self._outstanding.append(self.call_pool.submit(self._extract, batch))
+
+    def _extract(self, batch: List[Tuple[str, str, bytes]]):
+        bill_ids = [str(uuid.uuid4()) for _ in batch]
+        filenames = [f"{bill_id}_{os.path.splitext(os.path.basename(name))[0]}.jpg"
+                     for bill_id, (name, _, _) in zip(bill_ids, batch)]
+        try:
+            start = time.perf_counter()
+            bills = self.processor.process_batch([image for _, _, image in batch], filenames,
+                                                 content_hashes=[content_hash for _, content_hash, _ in batch])
+            self.stats.time("vision", time.perf_counter() - start)
+        except Exception as e:
+            for name, content_hash, _ in batch:
+                self._failed(name, content_hash, str(e))
+                self._window.release()
+            return
+        for bill_id, (name, content_hash, _), bill_data in zip(bill_ids, batch, bills):
+            if isinstance(bill_data, Exception):
+                # Only this receipt failed; the rest of the batch goes on
+                self._failed(name, content_hash, str(bill_data))
+                self._window.release()
+                continue
+            self._outstanding.append(self.call_pool.submit(self._finish, name, content_hash, bill_id, bill_data))
+
+    def _finish(self, name: str, content_hash: str, bill_id: str, bill_data):
+        """Split, store and checkpoint one extracted bill"""
+        try:
+            start = time.perf_counter()
+            split_result = self.system.expense_splitter.split(bill_data, self.instruction)
+            self.stats.time("split", time.perf_counter() - start)
+
+            file_name = bill_data.gcs_uri or name
+            bill_json = {"bill_data": bill_data.raw_data, "split_result": split_result.raw_data}
+
+            if self.use_db:
+                response = CachedBill.from_payload(bill_payload(bill_id, file_name, bill_json))
+                latency = get_bill_writer().write(
+                    bill_id, file_name, bill_json, content_hash, self.instruction,
+                    response_body=response.body, user_id=self.user_id,
+                )
+                self.stats.time("db_write", latency)
+
+            if self.output_dir:
+                with open(os.path.join(self.output_dir, f"{bill_id}.json"), "w") as f:
+                    json.dump({"bill_id": bill_id, "file_name": file_name, "content_hash": content_hash,
+                               **bill_json}, f, indent=2)
+
+            self.checkpoint.record(content_hash, name, "done", bill_id=bill_id)
+            self.stats.count("done")
+            print(f"✅ {name} -> {bill_id}")
+        except Exception as e:
+            self._failed(name, content_hash, str(e))
+        finally:
+            self._window.release()
+
+    def _failed(self, name: str, content_hash: str, error: str):
+        self.checkpoint.record(content_hash, name, "failed", error=error)
+        self.stats.count("failed")
+        print(f"❌ {name}: {error}")
+
+    def wait(self):
+        """Wait for everything submitted so far"""
+        self.prepare_pool.shutdown(wait=True)
+        self._dispatch(flush=True)
+        while self._outstanding:
+            self._outstanding.pop().result()
+        self.call_pool.shutdown(wait=True)
+
+    def abort(self):
+        self.prepare_pool.shutdown(wait=False, cancel_futures=True)
+        self.call_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def main():
+    # Imported here so the spawned preprocessing processes don't load the model clients
+    from bill_splitting_agent import BillSplitSystem
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="Directory, .zip or .tar(.gz) of receipt images")
+    parser.add_argument("--instruction", default=DEFAULT_INSTRUCTION, help="Split instruction for every receipt")
+    parser.add_argument("--user-id", type=int, help="users.id the bills belong to")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Image preprocessing processes")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent vision/split calls")
+    parser.add_argument("--batch-size", type=int, default=0,
+                        help="Receipts per vision call (default: tuned automatically)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_DIR, help="Directory for bill JSON files")
+    parser.add_argument("--no-output", action="store_true", help="Don't write JSON files")
+    parser.add_argument("--no-db", action="store_true", help="Don't write to bill_data")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: per source/instruction/user)")
+    args = parser.parse_args()
+
+    output_dir = None if args.no_output else args.output
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    checkpoint = Checkpoint(args.checkpoint or default_checkpoint_path(args.source, args.instruction, args.user_id))
+    if checkpoint.finished:
+        print(f"↩️  Resuming: {len(checkpoint.finished)} images already finished ({checkpoint.path})")
+
+    system = BillSplitSystem(
+        api_key=os.getenv("GEMINI_API_KEY"),
+        gcs_credentials_path='gcloud-key/bill_upload_bucket_key.json',
+        gcs_bucket_name='uploaded_bills'
+    )
+
+    run = BatchRun(system, args.instruction, args.user_id, output_dir, checkpoint,
+                   use_db=not args.no_db, workers=args.workers, concurrency=args.concurrency,
+                   batch_size=args.batch_size)
+    try:
+        for name, content in iter_images(args.source):
+            run.submit(name, content)
+        run.wait()
+    except KeyboardInterrupt:
+        print("\n⏸️  Interrupted; finished images are checkpointed, re-run to resume")
+        run.abort()
+    finally:
+        if not args.no_db:
+            close_worker_db()  # flushes the last partial batch
+        checkpoint.close()
+
+    print(run.stats.report(gemini_limiter.waited, getattr(system.bill_processor, "usage", None)))
+
+
+if __name__ == "__main__":
+    main()
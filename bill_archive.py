@@ -0,0 +1,218 @@
+"""
+Packed archive of processed bill documents.
+
+data/processed_bills holds one pretty-printed JSON file per bill; loading
+the corpus means one open() and one full JSON parse per bill. The archive
+packs the same documents into a single append-only file:
+
+    b"BILLPAK1" | uint32 length | msgpack document | uint32 length | ...
+
+plus a sidecar index (<archive>.idx, msgpack) mapping bill_id to the
+(offset, length) of its latest record and the archive size it covers.
+Readers mmap the archive: looking up one bill is a dict lookup and a
+memoryview slice (no copy) handed to msgpack, and iteration is a lazy
+generator over the records. A stale or missing index is rebuilt by
+scanning the records after the part it covers, and a torn final record
+(interrupted append) is ignored.
+
+Usage:
+    python bill_archive.py pack                     # data/processed_bills -> data/processed_bills.bpack
+    python bill_archive.py pack --dir path/to/json --archive bills.bpack
+    python bill_archive.py get <bill_id>
+    python bill_archive.py stat
+"""
+
+import argparse
+import glob
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+import msgpack
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+DEFAULT_BILLS_DIR = os.path.join(DATA_DIR, "processed_bills")
+DEFAULT_ARCHIVE = os.path.join(DATA_DIR, "processed_bills.bpack")
+
+MAGIC = b"BILLPAK1"
+LENGTH = struct.Struct("<I")
+
+
+def index_path(archive_path: str) -> str:
+    return archive_path + ".idx"
+
+
+def scan_records(buffer, start: int, end: int) -> Iterator[Tuple[int, int]]:
+    """(offset, length) of each complete record payload in buffer[start:end]"""
+    offset = start
+    while offset + LENGTH.size <= end:
+        (length,) = LENGTH.unpack_from(buffer, offset)
+        payload = offset + LENGTH.size
+        if payload + length > end:
+            break  # torn final record
+        yield payload, length
+        offset = payload + length
+
+
+def record_bill_id(payload) -> Optional[str]:
+    doc = msgpack.unpackb(payload)
+    return doc.get("bill_id") if isinstance(doc, dict) else None
+
+
+class BillArchive:
+    """Read-only, mmap-backed view of an archive"""
+
+    def __init__(self, path: str = DEFAULT_ARCHIVE):
+        self.path = path
+        self._file = open(path, "rb")
+        self.size = os.fstat(self._file.fileno()).st_size
+        if self.size < len(MAGIC):
+            self._file.close()
+            raise ValueError(f"{path} is not a bill archive")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        if self._view[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a bill archive")
+        self.index, self.end = self._load_index()
+
+    def _load_index(self) -> Tuple[Dict[str, Tuple[int, int]], int]:
+        """bill_id -> (offset, length), and where the last complete record ends"""
+        index, covered = {}, len(MAGIC)
+        try:
+            with open(index_path(self.path), "rb") as f:
+                stored = msgpack.unpackb(f.read(), strict_map_key=False)
+            if len(MAGIC) <= stored["size"] <= self.size:
+                index = {bill_id: tuple(entry) for bill_id, entry in stored["bills"].items()}
+                covered = stored["size"]
+        except (OSError, ValueError, KeyError, TypeError, msgpack.UnpackException):
+            pass
+
+        end = covered
+        for offset, length in scan_records(self._view, covered, self.size):
+            bill_id = record_bill_id(self._view[offset:offset + length])
+            if bill_id:
+                index[bill_id] = (offset, length)
+            end = offset + length
+        return index, end
+
+    def close(self):
+        self._view.release()
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, bill_id: str) -> bool:
+        return bill_id in self.index
+
+    def raw(self, bill_id: str) -> memoryview:
+        """The msgpack bytes of a bill, as a view into the mapped file"""
+        offset, length = self.index[bill_id]
+        return self._view[offset:offset + length]
+
+    def get(self, bill_id: str) -> Optional[Dict]:
+        """One bill document, or None if it isn't in the archive"""
+        if bill_id not in self.index:
+            return None
+        return msgpack.unpackb(self.raw(bill_id))
+
+    def __iter__(self) -> Iterator[Dict]:
+        """Every bill (latest record per bill_id), decoded one at a time in archive order"""
+        for offset, length in sorted(self.index.values()):
+            yield msgpack.unpackb(self._view[offset:offset + length])
+
+    def write_index(self):
+        """Persist the index (atomically) so the next open needn't rescan"""
+        tmp = index_path(self.path) + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(msgpack.packb({"size": self.end, "bills": self.index}))
+        os.replace(tmp, index_path(self.path))
+
+
+def iter_bills(path: str = DEFAULT_ARCHIVE) -> Iterator[Dict]:
+    """Lazily yield every bill in an archive"""
+    with BillArchive(path) as archive:
+        yield from archive
+
+
+def pack(bills_dir: str = DEFAULT_BILLS_DIR, archive_path: str = DEFAULT_ARCHIVE, update: bool = False) -> int:
+    """
+    Append the JSON documents in bills_dir to the archive (created if
+    needed). Bills already archived are skipped unless update is set, in
+    which case a changed document gets a new record. Returns records added.
+    """
+    if not os.path.exists(archive_path):
+        with open(archive_path, "wb") as f:
+            f.write(MAGIC)
+
+    with BillArchive(archive_path) as archive:
+        existing, end = archive.index, archive.end
+        current = {bill_id: bytes(archive.raw(bill_id)) for bill_id in existing} if update else {}
+
+    added = {}
+    with open(archive_path, "r+b") as out:
+        out.truncate(end)  # drop a torn final record, if any
+        out.seek(end)
+        for path in sorted(glob.glob(os.path.join(bills_dir, "*.json"))):
+            with open(path) as f:
+                doc = json.load(f)
+            bill_id = doc.get("bill_id")
+            if not bill_id or bill_id in added:
+                continue
+            if bill_id in existing and not update:
+                continue
+            payload = msgpack.packb(doc)
+            if current.get(bill_id) == payload:
+                continue
+            out.write(LENGTH.pack(len(payload)))
+            added[bill_id] = (out.tell(), len(payload))
+            out.write(payload)
+        out.flush()
+        os.fsync(out.fileno())
+
+    with BillArchive(archive_path) as archive:
+        archive.write_index()
+    return len(added)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("pack", "get", "stat"))
+    parser.add_argument("bill_id", nargs="?")
+    parser.add_argument("--dir", default=DEFAULT_BILLS_DIR, help="Directory of processed bill JSON files")
+    parser.add_argument("--archive", default=DEFAULT_ARCHIVE)
+    parser.add_argument("--update", action="store_true", help="Re-pack bills whose JSON changed")
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        start = time.perf_counter()
+        added = pack(args.dir, args.archive, args.update)
+        print(f"✅ Packed {added} bills into {args.archive} in {time.perf_counter() - start:.2f}s")
+    elif args.command == "get":
+        if not args.bill_id:
+            parser.error("get needs a bill_id")
+        with BillArchive(args.archive) as archive:
+            doc = archive.get(args.bill_id)
+        if doc is None:
+            sys.exit(f"❌ {args.bill_id} is not in {args.archive}")
+        print(json.dumps(doc, indent=2))
+    else:
+        with BillArchive(args.archive) as archive:
+            print(f"{args.archive}: {len(archive)} bills, {archive.size / 1024:.1f} KB "
+                  f"({archive.size - archive.end} bytes torn)")
+
+
+if __name__ == "__main__":
+    main()
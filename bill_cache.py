@@ -0,0 +1,180 @@
+"""
+Read-through cache for GET /bill/{bill_id}.
+
+Finished bills are cached as ready-to-send JSON bodies with a strong ETag,
+in two tiers: a small in-process LRU (entries live BILL_CACHE_LOCAL_TTL_SECONDS,
+which bounds how stale another API process can be after an invalidation)
+and Redis, shared by every API process. The Celery worker fills Redis as
+soon as it persists a bill, so the frontend's first poll after completion
+is already a hit; a re-split invalidates both tiers before it is queued.
+
+Bodies are serialized once, by the worker, and stored both here and in
+bill_data.response_body, so even a cache miss usually skips serialization.
+Read-path fills use SET NX and worker fills always overwrite, so a slow
+reader can never replace a newer result written by the worker.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from json_codec import dumps_str
+from metrics import get_counters, incr_counter
+
+
+BILL_CACHE_TTL_SECONDS = int(os.getenv("BILL_CACHE_TTL_SECONDS", str(60 * 60)))
+BILL_CACHE_LOCAL_SIZE = int(os.getenv("BILL_CACHE_LOCAL_SIZE", "512"))
+BILL_CACHE_LOCAL_TTL_SECONDS = float(os.getenv("BILL_CACHE_LOCAL_TTL_SECONDS", "5"))
+
+# Hit/miss counts are batched in-process and flushed to Redis at most this often
+METRICS_FLUSH_SECONDS = 10
+
+BILL_CACHE_CONTROL = "private, no-cache"
+
+
+def bill_payload(bill_id: str, file_name: Optional[str], bill_json: Dict) -> Dict:
+    """Public JSON shape of a stored bill"""
+    return {
+        "bill_id": bill_id,
+        "file_name": file_name,
+        "bill_data": bill_json.get("bill_data"),
+        "split_result": bill_json.get("split_result")
+    }
+
+
+class CachedBill:
+    """Serialized bill body plus its strong ETag"""
+
+    def __init__(self, body: str, etag: str, expires_at: float = 0):
+        self.body = body
+        self.etag = etag
+        self.expires_at = expires_at
+
+    @classmethod
+    def from_payload(cls, payload: Dict) -> "CachedBill":
+        return cls.from_body(dumps_str(payload))
+
+    @classmethod
+    def from_body(cls, body: str) -> "CachedBill":
+        """Wrap an already serialized body (e.g. bill_data.response_body)"""
+        etag = '"' + hashlib.sha256(body.encode("utf-8")).hexdigest()[:32] + '"'
+        return cls(body, etag)
+
+    def encode(self) -> str:
+        """Redis value: ETag and body in one string, so reads are a single GET"""
+        return f"{self.etag}\n{self.body}"
+
+    @classmethod
+    def decode(cls, value: str) -> "CachedBill":
+        etag, _, body = value.partition("\n")
+        return cls(body, etag)
+
+
+class BillCache:
+    """In-process LRU in front of a Redis cache of bill bodies"""
+
+    def __init__(self, redis_client, local_size: int = BILL_CACHE_LOCAL_SIZE,
+                 local_ttl: float = BILL_CACHE_LOCAL_TTL_SECONDS):
+        self.redis = redis_client
+        self.local_size = local_size
+        self.local_ttl = local_ttl
+        self._local: "OrderedDict[str, CachedBill]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = {"bill_cache_local_hits": 0, "bill_cache_redis_hits": 0, "bill_cache_misses": 0}
+        self._last_flush = time.monotonic()
+
+    def _key(self, bill_id: str) -> str:
+        return f"bill_cache:{bill_id}"
+
+    # ---- reads ---------------------------------------------------------------
+
+    def get(self, bill_id: str) -> Optional[CachedBill]:
+        """Cached bill from the local LRU or Redis, or None on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._local.get(bill_id)
+            fresh = entry is not None and entry.expires_at > now
+            if fresh:
+                self._local.move_to_end(bill_id)
+            elif entry:
+                del self._local[bill_id]
+        if fresh:
+            self._count("bill_cache_local_hits")
+            return entry
+
+        stored = self.redis.get(self._key(bill_id))
+        if stored:
+            entry = CachedBill.decode(stored)
+            self._remember(bill_id, entry)
+            self._count("bill_cache_redis_hits")
+            return entry
+
+        self._count("bill_cache_misses")
+        return None
+
+    # ---- writes --------------------------------------------------------------
+
+    def fill(self, bill_id: str, entry: CachedBill, overwrite: bool = False) -> CachedBill:
+        """
+        Cache a bill. The worker passes overwrite=True; read-through fills
+        don't, so they never clobber a newer worker result.
+        """
+        key = self._key(bill_id)
+
+        stored = self.redis.set(key, entry.encode(), ex=BILL_CACHE_TTL_SECONDS, nx=not overwrite)
+        if not stored:
+            # Someone filled it first; keep serving what's in Redis
+            current = self.redis.get(key)
+            if current:
+                entry = CachedBill.decode(current)
+
+        self._remember(bill_id, entry)
+        return entry
+
+    def invalidate(self, bill_id: str):
+        """Drop a bill from both tiers (before a re-split or edit)"""
+        with self._lock:
+            self._local.pop(bill_id, None)
+        self.redis.delete(self._key(bill_id))
+
+    def _remember(self, bill_id: str, entry: CachedBill):
+        local = CachedBill(entry.body, entry.etag, time.monotonic() + self.local_ttl)
+        with self._lock:
+            self._local[bill_id] = local
+            self._local.move_to_end(bill_id)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+
+    # ---- metrics -------------------------------------------------------------
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counts[name] += 1
+            if time.monotonic() - self._last_flush < METRICS_FLUSH_SECONDS:
+                return
+            counts = self._counts
+            self._counts = dict.fromkeys(counts, 0)
+            self._last_flush = time.monotonic()
+
+        for counter, amount in counts.items():
+            if amount:
+                incr_counter(self.redis, counter, amount)
+
+    def stats(self) -> Dict:
+        counters = get_counters(self.redis)
+        local_hits = counters.get("bill_cache_local_hits", 0)
+        redis_hits = counters.get("bill_cache_redis_hits", 0)
+        misses = counters.get("bill_cache_misses", 0)
+        lookups = local_hits + redis_hits + misses
+        return {
+            "lookups": lookups,
+            "local_hits": local_hits,
+            "redis_hits": redis_hits,
+            "misses": misses,
+            "hit_rate": round((local_hits + redis_hits) / lookups, 4) if lookups else None,
+            # Every hit is a SELECT that didn't reach Postgres
+            "db_queries_saved": local_hits + redis_hits,
+        }
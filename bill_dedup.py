@@ -0,0 +1,61 @@
+"""
+Whole-pipeline deduplication of uploads.
+
+When a receipt's bytes exactly match one that was already processed with
+the same instruction by the same user, /process-bill returns the stored result instead of
+queueing a task. The content-hash -> bill_id index lives in Redis and is
+backed by the content_hash/instruction columns on bill_data, so it
+survives Redis restarts and key expiry.
+
+Matches are scoped to the uploading user (anonymous uploads share one
+scope). Sharing hits between members of a group would need group
+membership between user accounts, which this app doesn't have: spend
+groups are sets of people's names taken from splits, not users.id values.
+"""
+
+from typing import Optional
+
+from metrics import incr_counter, get_counters
+from task_registry import idempotency_key
+
+
+# Redis index entries are refreshed on every hit and rebuilt from Postgres on a miss
+DEDUP_INDEX_TTL_SECONDS = 60 * 60 * 24 * 30
+
+
+class BillDedupIndex:
+    """Redis index of (content hash, instruction) -> processed bill_id"""
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+
+    def _key(self, content_hash: str, instruction: str, user_id: Optional[int]) -> str:
+        return f"dedup:{idempotency_key(content_hash, instruction, user_id)}"
+
+    def lookup(self, content_hash: str, instruction: str, user_id: Optional[int] = None) -> Optional[str]:
+        """bill_id of the user's completed bill with the same content and instruction, if indexed"""
+        return self.redis.get(self._key(content_hash, instruction, user_id))
+
+    def remember(self, content_hash: str, instruction: str, bill_id: str, user_id: Optional[int] = None):
+        """Index a completed bill"""
+        self.redis.set(self._key(content_hash, instruction, user_id), bill_id, ex=DEDUP_INDEX_TTL_SECONDS)
+
+    def forget(self, content_hash: str, instruction: str, user_id: Optional[int] = None):
+        """Drop a stale index entry"""
+        self.redis.delete(self._key(content_hash, instruction, user_id))
+
+    def record_check(self, hit: bool):
+        """Count a dedup lookup towards the hit rate"""
+        incr_counter(self.redis, "dedup_checks")
+        if hit:
+            incr_counter(self.redis, "dedup_hits")
+
+    def stats(self) -> dict:
+        counters = get_counters(self.redis)
+        checks = counters.get("dedup_checks", 0)
+        hits = counters.get("dedup_hits", 0)
+        return {
+            "checks": checks,
+            "hits": hits,
+            "hit_rate": round(hits / checks, 4) if checks else None,
+        }
@@ -0,0 +1,207 @@
+"""
+Bulk export of processed bills as NDJSON or CSV.
+
+Rows are read from bill_data through a server-side cursor and encoded one
+batch at a time, so memory stays flat no matter how many bills match. Used
+by GET /export/bills (asyncpg, streamed) and by this module's CLI
+(psycopg2, written to a file or stdout). Optionally gzip-compressed on the
+fly.
+
+NDJSON: one object per bill, with the stored bill document under "bill"
+(spliced in as the text Postgres returns, never re-parsed).
+CSV: one line per bill, with the split flattened to "person: amount; ..."
+from bill_shares (the document itself isn't fetched).
+
+Usage:
+    python bill_export.py --from 2026-09-01 --to 2026-09-30 -o september.ndjson
+    python bill_export.py --format csv --user 42 --gzip -o bills.csv.gz
+    python bill_export.py --group <group_key> > group.ndjson
+"""
+
+import argparse
+import csv
+import io
+import os
+import sys
+import time
+import zlib
+from datetime import date
+from typing import Iterable, Optional, Sequence, Tuple
+
+import psycopg2
+from dotenv import load_dotenv
+
+from json_codec import dumps
+from spend_analytics import BILL_DAY, GROUP_KEY
+from worker_db import sync_database_url
+
+load_dotenv()
+
+EXPORT_FORMATS = ("ndjson", "csv")
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+# Rows fetched from the server-side cursor (and encoded) per round trip
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "2000"))
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+
+# Signed-in users listed here may export any user's bills (or everyone's)
+EXPORT_ADMIN_EMAILS = {
+    email.strip().lower() for email in os.getenv("EXPORT_ADMIN_EMAILS", "").split(",") if email.strip()
+}
+
+# Selected for every format, followed by one format-specific column
+EXPORT_COLUMNS = ("bill_id", "created_at", "bill_date", "merchant", "total", "item_count", "user_id", "file_name")
+CSV_COLUMNS = EXPORT_COLUMNS + ("splits",)
+
+LAST_COLUMN = {
+    "ndjson": "b.bill_json::text",
+    "csv": """(
+        SELECT string_agg(s.person || ': ' || COALESCE(s.total::text, ''), '; ' ORDER BY s.position)
+        FROM bill_shares s WHERE s.bill_id = b.bill_id AND s.person <> ''
+    )""",
+}
+
+
+def is_export_admin(email: Optional[str]) -> bool:
+    return bool(email) and email.lower() in EXPORT_ADMIN_EMAILS
+
+
+def export_query(fmt: str = "ndjson", date_from: Optional[date] = None, date_to: Optional[date] = None,
+                 user_id: Optional[int] = None, group_key: Optional[str] = None,
+                 paramstyle: str = "pyformat") -> Tuple[str, dict]:
+    """
+    SQL and parameters selecting the bills to export, in id order. Dates
+    filter on the receipt date (upload date when unknown); group_key is a
+    spend_groups key. paramstyle is "pyformat" (psycopg2) or "named"
+    (SQLAlchemy text()).
+    """
+    def param(name):
+        return f":{name}" if paramstyle == "named" else f"%({name})s"
+
+    conditions, params = [], {}
+    if date_from:
+        conditions.append(f"{BILL_DAY} >= {param('date_from')}")
+        params["date_from"] = date_from
+    if date_to:
+        conditions.append(f"{BILL_DAY} <= {param('date_to')}")
+        params["date_to"] = date_to
+    if user_id is not None:
+        conditions.append(f"b.user_id = {param('user_id')}")
+        params["user_id"] = user_id
+    if group_key:
+        conditions.append(f"""b.bill_id IN (
+            SELECT s.bill_id FROM bill_shares s WHERE s.person <> ''
+            GROUP BY s.bill_id HAVING {GROUP_KEY} = {param('group_key')}
+        )""")
+        params["group_key"] = group_key
+
+    sql = f"SELECT {', '.join('b.' + c for c in EXPORT_COLUMNS)}, {LAST_COLUMN[fmt]} FROM bill_data b"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    return sql + " ORDER BY b.id", params
+
+
+class ExportEncoder:
+    """
+    Turns batches of export_query() rows into output chunks. Feed it
+    header(), then encode(rows) per batch, then finish().
+    """
+
+    def __init__(self, fmt: str = "ndjson", compress: bool = False):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {fmt}")
+        self.fmt = fmt
+        self.rows = 0
+        self.raw_bytes = 0
+        # wbits=31: gzip container, so the output is a regular .gz file
+        self._gzip = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31) if compress else None
+        self._buffer = io.StringIO()
+        self._csv = csv.writer(self._buffer)
+
+    def _out(self, data: bytes) -> bytes:
+        self.raw_bytes += len(data)
+        return self._gzip.compress(data) if self._gzip else data
+
+    def header(self) -> bytes:
+        if self.fmt != "csv":
+            return b""
+        self._csv.writerow(CSV_COLUMNS)
+        return self._out(self._take())
+
+    def encode(self, rows: Sequence[Sequence]) -> bytes:
+        self.rows += len(rows)
+        if self.fmt == "ndjson":
+            lines = []
+            for row in rows:
+                meta = dumps(dict(zip(EXPORT_COLUMNS, row)))
+                lines.append(meta[:-1] + b',"bill":' + row[-1].encode("utf-8") + b"}\n")
+            return self._out(b"".join(lines))
+
+        self._csv.writerows(rows)
+        return self._out(self._take())
+
+    def finish(self) -> bytes:
+        return self._gzip.flush() if self._gzip else b""
+
+    def _take(self) -> bytes:
+        data = self._buffer.getvalue().encode("utf-8")
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
+
+
+def export_chunks(batches: Iterable[Sequence[Sequence]], encoder: ExportEncoder):
+    """Encoded output for an iterable of row batches"""
+    yield encoder.header()
+    for rows in batches:
+        yield encoder.encode(rows)
+    yield encoder.finish()
+
+
+def database_batches(conn, sql: str, params: dict, batch_size: int = EXPORT_BATCH_ROWS):
+    """Row batches from a psycopg2 server-side cursor"""
+    with conn.cursor(name="export_bills") as cur:
+        cur.itersize = batch_size
+        cur.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="ndjson")
+    parser.add_argument("--from", dest="date_from", type=date.fromisoformat)
+    parser.add_argument("--to", dest="date_to", type=date.fromisoformat)
+    parser.add_argument("--user", type=int, help="users.id")
+    parser.add_argument("--group", help="spend_groups group_key")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("-o", "--output", help="Output file (default: stdout)")
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_ROWS)
+    args = parser.parse_args()
+
+    sql, params = export_query(args.format, args.date_from, args.date_to, args.user, args.group)
+    encoder = ExportEncoder(args.format, compress=args.gzip)
+
+    start = time.perf_counter()
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    conn = psycopg2.connect(sync_database_url())
+    written = 0
+    try:
+        for chunk in export_chunks(database_batches(conn, sql, params, args.batch_size), encoder):
+            out.write(chunk)
+            written += len(chunk)
+    finally:
+        conn.close()
+        if args.output:
+            out.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ Exported {encoder.rows} bills ({written / 1e6:.1f} MB) in {elapsed:.1f}s "
+          f"({encoder.rows / max(elapsed, 1e-9):,.0f} rows/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
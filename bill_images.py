@@ -0,0 +1,296 @@
+"""
+Bill image delivery from Google Cloud Storage.
+
+The API process shares one storage client whose HTTP session keeps a
+connection pool sized to GCS_IO_THREADS, and every blocking GCS call runs on
+a bounded thread pool so image transfers never stall the event loop. Missing
+objects are detected from the download itself (NotFound) rather than with a
+separate exists() round trip.
+
+Images are streamed to clients in chunks (no temp files, no whole-image
+buffers) with support for single byte ranges and conditional requests: the
+ETag is derived from the object's generation, so a client that already has
+the current version gets a 304.
+
+Set STORAGE_EMULATOR_HOST (e.g. http://localhost:4443 for fake-gcs-server)
+to point the client at a local emulator.
+"""
+
+import asyncio
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import AsyncIterator, BinaryIO, Optional, Tuple
+
+from google.cloud import storage
+from requests.adapters import HTTPAdapter
+from starlette.responses import Response, StreamingResponse
+
+
+# Upper bound on concurrent GCS calls from one API process
+GCS_IO_THREADS = int(os.getenv("GCS_IO_THREADS", "32"))
+
+# Size of each ranged read while streaming an image to the client
+GCS_STREAM_CHUNK_BYTES = int(os.getenv("GCS_STREAM_CHUNK_BYTES", str(1024 * 1024)))
+
+# Images never change under a given generation, so browsers may reuse them for a while
+IMAGE_CACHE_CONTROL = os.getenv("IMAGE_CACHE_CONTROL", "private, max-age=3600")
+
+GCS_URI_PATTERN = re.compile(r"(?:gs://|https://storage\.googleapis\.com/)([^/]+)/(.+)")
+
+_client: Optional[storage.Client] = None
+_client_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=GCS_IO_THREADS, thread_name_prefix="gcs-io")
+
+
+def parse_gcs_uri(gcs_uri: str) -> Optional[Tuple[str, str]]:
+    """(bucket, blob name) for a gs:// or storage.googleapis.com URI, or None"""
+    match = GCS_URI_PATTERN.match(gcs_uri or "")
+    return match.groups() if match else None
+
+
+def get_storage_client() -> storage.Client:
+    """Process-wide storage client with a connection pool sized for the I/O threads"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                client = storage.Client()
+                # requests' default pool keeps only 10 connections per host
+                adapter = HTTPAdapter(pool_connections=GCS_IO_THREADS, pool_maxsize=GCS_IO_THREADS)
+                client._http.mount("https://", adapter)
+                client._http.mount("http://", adapter)
+                _client = client
+    return _client
+
+
+def get_blob(bucket_name: str, blob_name: str) -> storage.Blob:
+    """Blob handle on the shared client (no API call)"""
+    return get_storage_client().bucket(bucket_name).blob(blob_name)
+
+
+async def run_gcs(fn, *args):
+    """Run a blocking GCS call on the bounded I/O pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, fn, *args)
+
+
+def _download(blob: storage.Blob) -> Tuple[bytes, str]:
+    content = blob.download_as_bytes()
+    # Content type is filled in from the download response headers
+    return content, blob.content_type or "image/jpeg"
+
+
+async def fetch_image(bucket_name: str, blob_name: str) -> Tuple[bytes, str]:
+    """
+    Download a bill image without blocking the event loop.
+    Raises google.api_core.exceptions.NotFound if the object doesn't exist.
+    """
+    return await run_gcs(_download, get_blob(bucket_name, blob_name))
+
+
+# ============================================================================
+# STREAMING WITH RANGE / CONDITIONAL REQUESTS
+# ============================================================================
+
+class RangeNotSatisfiable(Exception):
+    """Range header that doesn't overlap the object"""
+
+
+class ImageInfo:
+    """
+    Metadata of one stored bill image, pinned to a single generation. The
+    bytes come either from GCS (blob) or from a local cache file (path),
+    which is held open (file) so eviction can't remove it mid-response.
+    """
+
+    def __init__(self, name: str, generation: Optional[int], size: int, content_type: Optional[str],
+                 md5_hash: Optional[str] = None, last_modified: Optional[str] = None,
+                 blob: Optional[storage.Blob] = None, path: Optional[str] = None,
+                 etag: Optional[str] = None, filename: Optional[str] = None,
+                 file: Optional[BinaryIO] = None):
+        self.name = name
+        self.filename = filename or name.split("/")[-1]
+        self.generation = generation
+        self.size = size or 0
+        self.content_type = content_type or "image/jpeg"
+        self.md5_hash = md5_hash
+        self.last_modified = last_modified
+        self.blob = blob
+        self.path = path
+        self.file = file
+        # Strong validator: changes whenever the object is overwritten
+        self.etag = etag or f'"{generation or md5_hash}"'
+
+    @classmethod
+    def from_blob(cls, blob: storage.Blob) -> "ImageInfo":
+        return cls(
+            name=blob.name,
+            generation=blob.generation,
+            size=blob.size,
+            content_type=blob.content_type,
+            md5_hash=blob.md5_hash,
+            last_modified=blob.updated.strftime("%a, %d %b %Y %H:%M:%S GMT") if blob.updated else None,
+            blob=blob,
+        )
+
+    def close(self):
+        """Release the held cache file, if any"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def to_dict(self) -> dict:
+        """Everything needed to serve the image again without asking GCS"""
+        return {
+            "name": self.name,
+            "filename": self.filename,
+            "generation": self.generation,
+            "size": self.size,
+            "content_type": self.content_type,
+            "md5_hash": self.md5_hash,
+            "last_modified": self.last_modified,
+            "etag": self.etag,
+        }
+
+
+async def stat_image(bucket_name: str, blob_name: str) -> ImageInfo:
+    """
+    Load an image's metadata (one GCS call).
+    Raises google.api_core.exceptions.NotFound if the object doesn't exist.
+    """
+    blob = get_blob(bucket_name, blob_name)
+    await run_gcs(blob.reload)
+    return ImageInfo.from_blob(blob)
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Inclusive (start, end) for a single "bytes=" range, or None to send the
+    whole object. Multi-range requests are answered with the whole object.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        elif last:
+            # Suffix range: the final N bytes
+            start = max(size - int(last), 0)
+            end = size - 1
+        else:
+            return None
+    except ValueError:
+        return None
+
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """If-None-Match / If-Range comparison (weak comparison, as RFC 9110 allows for If-None-Match)"""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return etag in candidates
+
+
+async def iter_image(info: ImageInfo, start: int, end: int,
+                     chunk_size: int = GCS_STREAM_CHUNK_BYTES) -> AsyncIterator[bytes]:
+    """Yield bytes start..end (inclusive) of the pinned generation, one ranged read per chunk"""
+    if info.file:
+        try:
+            async for chunk in iter_open_file(info.file, start, end, chunk_size):
+                yield chunk
+        finally:
+            info.close()
+        return
+    if info.path:
+        async for chunk in iter_file(info.path, start, end, chunk_size):
+            yield chunk
+        return
+
+    blob = info.blob
+    position = start
+    while position <= end:
+        stop = min(position + chunk_size - 1, end)
+        yield await run_gcs(partial(
+            blob.download_as_bytes,
+            start=position,
+            end=stop,
+            if_generation_match=info.generation,
+        ))
+        position = stop + 1
+
+
+async def iter_file(path: str, start: int, end: int, chunk_size: int) -> AsyncIterator[bytes]:
+    """Yield bytes start..end (inclusive) of a local file, reading off the event loop"""
+    with open(path, "rb") as f:
+        async for chunk in iter_open_file(f, start, end, chunk_size):
+            yield chunk
+
+
+async def iter_open_file(f: BinaryIO, start: int, end: int, chunk_size: int) -> AsyncIterator[bytes]:
+    """Yield bytes start..end (inclusive) of an open file, reading off the event loop"""
+    f.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        chunk = await asyncio.to_thread(f.read, min(chunk_size, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+def image_response(info: ImageInfo, request_headers, disposition: str = "inline") -> Response:
+    """
+    200/206/304/416 response for an image, honouring Range, If-Range and
+    If-None-Match from the request headers.
+    """
+    headers = {
+        "ETag": info.etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": IMAGE_CACHE_CONTROL,
+    }
+    if info.last_modified:
+        headers["Last-Modified"] = info.last_modified
+
+    if etag_matches(request_headers.get("if-none-match"), info.etag):
+        info.close()
+        return Response(status_code=304, headers=headers)
+
+    byte_range = None
+    if_range = request_headers.get("if-range")
+    # A stale If-Range means the client's partial copy is outdated: send everything
+    if not if_range or etag_matches(if_range, info.etag):
+        try:
+            byte_range = parse_range(request_headers.get("range"), info.size)
+        except RangeNotSatisfiable:
+            headers["Content-Range"] = f"bytes */{info.size}"
+            info.close()
+            return Response(status_code=416, headers=headers)
+
+    headers["Content-Disposition"] = f'{disposition}; filename="{info.filename}"'
+
+    if byte_range is None:
+        start, end, status_code = 0, info.size - 1, 200
+    else:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{info.size}"
+    headers["Content-Length"] = str(max(end - start + 1, 0))
+
+    return StreamingResponse(
+        iter_image(info, start, end),
+        status_code=status_code,
+        media_type=info.content_type,
+        headers=headers,
+    )
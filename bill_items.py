@@ -0,0 +1,87 @@
+"""
+Normalized line items and per-person shares.
+
+bill_json stays the source of truth, but every write also flattens it into
+bill_items (one row per receipt line) and bill_shares (one row per person in
+the split), so item- and person-level reporting runs on indexed columns
+instead of traversing JSONB. Rows for a bill are replaced wholesale on every
+write, inside the same transaction as the bill_data upsert.
+"""
+
+from typing import Dict, Iterable, List, Tuple
+
+from psycopg2.extras import execute_values
+
+from bill_summary import parse_amount
+
+
+ITEM_COLUMNS = ("bill_id", "position", "name", "quantity", "unit_price", "total")
+SHARE_COLUMNS = ("bill_id", "position", "person", "items", "subtotal", "tax_share", "total")
+
+DELETE_ITEMS_SQL = "DELETE FROM bill_items WHERE bill_id = ANY(%s)"
+DELETE_SHARES_SQL = "DELETE FROM bill_shares WHERE bill_id = ANY(%s)"
+INSERT_ITEMS_SQL = f"INSERT INTO bill_items ({', '.join(ITEM_COLUMNS)}) VALUES %s"
+INSERT_SHARES_SQL = f"INSERT INTO bill_shares ({', '.join(SHARE_COLUMNS)}) VALUES %s"
+
+
+def item_rows(bill_id: str, bill_json: Dict) -> List[Tuple]:
+    """bill_items rows for one bill, in receipt order"""
+    items = ((bill_json or {}).get("bill_data") or {}).get("items")
+    if not isinstance(items, list):
+        return []
+
+    rows = []
+    for position, item in enumerate(items):
+        if not isinstance(item, dict):
+            continue
+        name = str(item.get("name") or "").strip()[:255]
+        rows.append((
+            bill_id, position, name,
+            parse_amount(item.get("quantity"), places=3),
+            parse_amount(item.get("unit_price")),
+            parse_amount(item.get("total")),
+        ))
+    return rows
+
+
+def share_rows(bill_id: str, bill_json: Dict) -> List[Tuple]:
+    """bill_shares rows for one bill, in split order"""
+    breakdown = ((bill_json or {}).get("split_result") or {}).get("breakdown")
+    if not isinstance(breakdown, list):
+        return []
+
+    rows = []
+    for position, share in enumerate(breakdown):
+        if not isinstance(share, dict):
+            continue
+        items = share.get("items")
+        rows.append((
+            bill_id, position,
+            str(share.get("person") or "").strip()[:255],
+            [str(name) for name in items] if isinstance(items, list) else [],
+            parse_amount(share.get("subtotal")),
+            parse_amount(share.get("tax_share")),
+            parse_amount(share.get("total")),
+        ))
+    return rows
+
+
+def replace_normalized(cur, bills: Iterable[Tuple[str, Dict]]):
+    """
+    Replace the bill_items/bill_shares rows of (bill_id, bill_json) pairs.
+    Runs on the caller's cursor, so it commits with the bill_data upsert.
+    """
+    bills = list(bills)
+    if not bills:
+        return
+
+    bill_ids = [bill_id for bill_id, _ in bills]
+    items = [row for bill_id, bill_json in bills for row in item_rows(bill_id, bill_json)]
+    shares = [row for bill_id, bill_json in bills for row in share_rows(bill_id, bill_json)]
+
+    cur.execute(DELETE_ITEMS_SQL, (bill_ids,))
+    cur.execute(DELETE_SHARES_SQL, (bill_ids,))
+    if items:
+        execute_values(cur, INSERT_ITEMS_SQL, items)
+    if shares:
+        execute_values(cur, INSERT_SHARES_SQL, shares)
@@ -3,19 +3,28 @@ Object-Oriented Bill Splitting System
 A refactored version with proper class hierarchy and separation of concerns
 """
 
+import io
 import json
+import mimetypes
 import os
-from typing import Dict, List, Optional, Any
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Any, Union
 from abc import ABC, abstractmethod
 from datetime import datetime
 from PIL import Image
 import google.generativeai as genai
+from google.api_core.exceptions import NotFound
 from google.cloud import storage
 from langchain.tools import tool
 from langchain.agents import create_react_agent, AgentExecutor
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain import hub
+from langchain_core.prompts import PromptTemplate
+from langchain_core.callbacks import BaseCallbackHandler
 from dotenv import load_dotenv
+from receipt_tiling import is_tall, merge_bands, split_pages, stitch_pages, tile
 
 
 load_dotenv()
@@ -36,6 +45,35 @@ class Config:
         self.temperature = 0
         self.max_agent_iterations = 15
         
+        # Batched extraction: most receipts packed into one vision call, and the
+        # slowest a batched call may take before the batch size is cut back
+        self.vision_batch_max = int(os.getenv("VISION_BATCH_MAX", "8"))
+        self.vision_batch_target_seconds = float(os.getenv("VISION_BATCH_TARGET_SECONDS", "30"))
+        
+        # Long receipts: bands of one receipt extracted at the same time
+        self.vision_band_workers = int(os.getenv("VISION_BAND_WORKERS", "4"))
+        
+        # Extraction backend (gemini, fixture or ocr; see create_bill_processor)
+        # and an optional backend to fall back on when it fails
+        self.vision_backend = os.getenv("VISION_BACKEND", "gemini")
+        self.vision_fallback_backend = os.getenv("VISION_FALLBACK_BACKEND") or None
+        
+        # Fixture backend: saved extractions to replay and the latency to simulate
+        self.fixture_source = os.getenv("FIXTURE_BILLS", "data/processed_bills")
+        self.fixture_latency_ms = float(os.getenv("FIXTURE_LATENCY_MS", "0"))
+        self.fixture_latency_jitter_ms = float(os.getenv("FIXTURE_LATENCY_JITTER_MS", "0"))
+        self.fixture_strict = os.getenv("FIXTURE_STRICT", "false").lower() == "true"
+        
+        # Split stage: gemini (the ReAct agent) or fixture (replays saved splits;
+        # see local_processors.FixtureExpenseSplitter)
+        self.split_backend = os.getenv("SPLIT_BACKEND", "gemini")
+        self.fixture_split_latency_ms = float(os.getenv("FIXTURE_SPLIT_LATENCY_MS", "0"))
+        self.fixture_split_people = int(os.getenv("FIXTURE_SPLIT_PEOPLE", "2"))
+        
+        # OCR backend: Tesseract binary (if not on PATH) and language
+        self.tesseract_cmd = os.getenv("TESSERACT_CMD") or None
+        self.ocr_lang = os.getenv("OCR_LANG", "eng")
+        
         # Google Cloud Storage settings
         self.gcs_credentials_path = gcs_credentials_path
         self.gcs_bucket_name = gcs_bucket_name
@@ -103,6 +141,58 @@ class CloudStorageManager:
             print(f"Error uploading to GCS: {str(e)}")
             return None
     
+    def upload_bytes(self, content: bytes, filename: str,
+                     destination_blob_name: Optional[str] = None) -> Optional[str]:
+        """
+        Upload in-memory file content to Google Cloud Storage
+        
+        Args:
+            content: Raw file bytes
+            filename: Original file name (used for the blob name and content type)
+            destination_blob_name: Name for the file in GCS. If None, generates from filename
+            
+        Returns:
+            GCS URI of uploaded file, or None if upload failed/disabled
+        """
+        if not self.config.gcs_enabled:
+            print("GCS upload is disabled. Skipping upload.")
+            return None
+        
+        try:
+            # Generate destination name if not provided
+            if destination_blob_name is None:
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                destination_blob_name = f"bills/{timestamp}_{os.path.basename(filename)}"
+            
+            content_type = mimetypes.guess_type(filename)[0] or "image/jpeg"
+            
+            # Upload to GCS
+            bucket = self.client.bucket(self.config.gcs_bucket_name)
+            blob = bucket.blob(destination_blob_name)
+            blob.upload_from_string(content, content_type=content_type)
+            
+            gcs_uri = f"gs://{self.config.gcs_bucket_name}/{destination_blob_name}"
+            print(f"File uploaded to {gcs_uri}")
+            
+            return gcs_uri
+            
+        except Exception as e:
+            print(f"Error uploading to GCS: {str(e)}")
+            return None
+    
+    def download_bytes(self, gcs_uri: str) -> bytes:
+        """Download an object given its gs:// URI"""
+        bucket_name, blob_name = gcs_uri[len("gs://"):].split("/", 1)
+        return self.client.bucket(bucket_name).blob(blob_name).download_as_bytes()
+
+    def delete(self, gcs_uri: str):
+        """Delete an object given its gs:// URI (no error if it is already gone)"""
+        bucket_name, blob_name = gcs_uri[len("gs://"):].split("/", 1)
+        try:
+            self.client.bucket(bucket_name).blob(blob_name).delete()
+        except NotFound:
+            pass
+    
     def upload_with_metadata(self, source_file_path: str, metadata: Dict[str, str],
                             destination_blob_name: Optional[str] = None) -> Optional[str]:
         """
@@ -201,14 +291,249 @@ class BillData:
         return '\n'.join(lines)
 
 
+def _number(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def extraction_problems(data: Any) -> List[str]:
+    """
+    Reasons an extracted bill can't be trusted (empty list if it looks sound):
+    missing or malformed items, or line items that don't add up to the
+    subtotal (or to total minus tax and tip when there is no subtotal).
+    """
+    if not isinstance(data, dict):
+        return ["not an object"]
+    if data.get("error"):
+        return [f"model reported: {data['error']}"]
+    items = data.get("items")
+    if not isinstance(items, list) or not items:
+        return ["no items"]
+    if any(not isinstance(item, dict) or not item.get("name") for item in items):
+        return ["item without a name"]
+
+    totals = [_number(item.get("total")) for item in items]
+    if None in totals:
+        return ["item without a numeric total"]
+
+    expected = _number(data.get("subtotal"))
+    if not expected:
+        total = _number(data.get("total"))
+        if total:
+            expected = total - (_number(data.get("tax")) or 0) - (_number(data.get("tip")) or 0)
+    if expected:
+        items_sum = sum(totals)
+        if abs(items_sum - expected) > max(1.0, 0.02 * abs(expected)):
+            return [f"items sum to {items_sum:.2f}, expected {expected:.2f}"]
+    return []
+
+
+def attempt(fn, *args, **kwargs):
+    """fn's result, or the exception it raised (one entry of a batch result)"""
+    try:
+        return fn(*args, **kwargs)
+    except Exception as e:
+        return e
+
+
+class BatchSizeTuner:
+    """
+    Chooses how many receipts go into one batched vision call.
+    
+    Grows the batch by one while a bigger batch is still cheaper per bill
+    than the next smaller size, and halves it when a batch is slower than
+    the target or too many of its entries fail validation (each failure
+    costs an extra single-image call). After a cut it holds for a few
+    calls before probing larger sizes again.
+    """
+    def __init__(self, max_size: int = 8, target_seconds: float = 30.0,
+                 max_fallback_rate: float = 0.2, initial_size: int = 2, cooldown_calls: int = 5):
+        self.max_size = max(1, max_size)
+        self.target_seconds = target_seconds
+        self.max_fallback_rate = max_fallback_rate
+        self.size = min(initial_size, self.max_size)
+        self.seconds_per_bill: Dict[int, float] = {}  # EWMA by batch size
+        self.cooldown_calls = cooldown_calls
+        self._cooldown = 0
+        self._lock = threading.Lock()
+    
+    def record(self, size: int, seconds: float, fallbacks: int):
+        """Feed back one batched call: its size, latency and failed entries"""
+        with self._lock:
+            per_bill = seconds / size
+            previous = self.seconds_per_bill.get(size)
+            self.seconds_per_bill[size] = per_bill if previous is None else 0.7 * previous + 0.3 * per_bill
+            
+            if fallbacks / size > self.max_fallback_rate or seconds > self.target_seconds:
+                self.size = max(1, self.size // 2)
+                self._cooldown = self.cooldown_calls
+            elif self._cooldown > 0:
+                self._cooldown -= 1
+            elif size == self.size:
+                smaller = self.seconds_per_bill.get(size - 1)
+                if smaller is None or self.seconds_per_bill[size] <= smaller:
+                    self.size = min(self.max_size, self.size + 1)
+                elif self.seconds_per_bill[size] > smaller * 1.1:
+                    self.size = max(1, self.size - 1)
+
+
 class BillProcessor(ABC):
     """Abstract base class for bill processing"""
     @abstractmethod
     def process(self, image_path: str) -> BillData:
         """Process a bill image and return structured data"""
         pass
+    
+    def process_bytes(self, content: bytes, filename: str, gcs_uri: Optional[str] = None,
+                      page_heights: Optional[List[int]] = None, content_hash: Optional[str] = None) -> BillData:
+        """
+        Process an in-memory bill image. If gcs_uri is given the image is
+        already in storage and must not be uploaded again. page_heights
+        marks an image stitched from several photos (see process_pages).
+        content_hash is the SHA-256 of the original upload, for callers
+        that pass re-encoded bytes; backends that key on the image use it.
+        
+        The default implementation spools to a temp file and calls process().
+        """
+        suffix = os.path.splitext(filename)[1]
+        with tempfile.NamedTemporaryFile(suffix=suffix) as tmp:
+            tmp.write(content)
+            tmp.flush()
+            bill_data = self.process(tmp.name)
+        if gcs_uri:
+            bill_data.gcs_uri = gcs_uri
+        return bill_data
+    
+    def process_batch(self, contents: List[bytes], filenames: List[str],
+                      gcs_uris: Optional[List[Optional[str]]] = None,
+                      content_hashes: Optional[List[str]] = None) -> List[Union[BillData, Exception]]:
+        """
+        Process several in-memory bill images, in order. An image that
+        can't be extracted gets the exception raised for it in its place,
+        so one bad receipt doesn't lose the others. The default
+        implementation handles them one at a time.
+        """
+        gcs_uris = gcs_uris or [None] * len(contents)
+        content_hashes = content_hashes or [None] * len(contents)
+        return [attempt(self.process_bytes, c, f, gcs_uri=u, content_hash=h)
+                for c, f, u, h in zip(contents, filenames, gcs_uris, content_hashes)]
+    
+    def process_pages(self, contents: List[bytes], filename: str, gcs_uri: Optional[str] = None) -> BillData:
+        """
+        Process several photos of one receipt, in order (top first). They are
+        stitched into one image, which is what gets stored.
+        """
+        stitched, page_heights = stitch_pages(contents)
+        return self.process_bytes(stitched, filename, gcs_uri=gcs_uri, page_heights=page_heights)
+    
+    def _parse_response(self, response_text: str) -> Dict:
+        """Parse JSON from model response"""
+        output = response_text
+        if "```json" in output:
+            output = output.split("```json")[1].split("```")[0].strip()
+        elif "```" in output:
+            output = output.split("```")[1].split("```")[0].strip()
+        
+        return json.loads(output)
+
+
+# Backend name -> BillProcessor class, built as cls(config, storage_manager)
+PROCESSOR_BACKENDS: Dict[str, type] = {}
 
 
+def register_processor(name: str):
+    """Class decorator adding a BillProcessor to PROCESSOR_BACKENDS"""
+    def decorator(cls):
+        PROCESSOR_BACKENDS[name] = cls
+        return cls
+    return decorator
+
+
+def create_bill_processor(config: Config, storage_manager: Optional[CloudStorageManager] = None,
+                          backend: Optional[str] = None) -> BillProcessor:
+    """
+    Build the configured backend (config.vision_backend unless given),
+    wrapped with config.vision_fallback_backend if one is set.
+    """
+    name = backend or config.vision_backend
+    if name not in PROCESSOR_BACKENDS:
+        import local_processors  # noqa: F401  registers the fixture and ocr backends
+    if name not in PROCESSOR_BACKENDS:
+        raise ValueError(f"Unknown bill processor backend {name!r}; choose from {sorted(PROCESSOR_BACKENDS)}")
+    
+    processor = PROCESSOR_BACKENDS[name](config, storage_manager)
+    fallback = config.vision_fallback_backend
+    if backend is None and fallback and fallback != name:
+        return FallbackBillProcessor(processor, create_bill_processor(config, storage_manager, fallback))
+    return processor
+
+
+class FallbackBillProcessor(BillProcessor):
+    """
+    Sends every image to the primary backend and, if that raises (e.g. the
+    model API is down), to the fallback instead. Other attributes are read
+    from the primary.
+    """
+    def __init__(self, primary: BillProcessor, fallback: BillProcessor):
+        self.primary = primary
+        self.fallback = fallback
+        self.fallbacks = 0
+    
+    def __getattr__(self, name):
+        if name in ("primary", "fallback"):
+            raise AttributeError(name)
+        return getattr(self.primary, name)
+    
+    @property
+    def limiter(self):
+        return getattr(self.primary, "limiter", None)
+    
+    @limiter.setter
+    def limiter(self, value):
+        self.primary.limiter = value
+    
+    def _call(self, method: str, *args, **kwargs):
+        try:
+            return getattr(self.primary, method)(*args, **kwargs)
+        except Exception as e:
+            self.fallbacks += 1
+            print(f"⚠️  {type(self.primary).__name__}.{method} failed ({e}); using {type(self.fallback).__name__}")
+            return getattr(self.fallback, method)(*args, **kwargs)
+    
+    def process(self, image_path: str) -> BillData:
+        return self._call("process", image_path)
+    
+    def process_bytes(self, content: bytes, filename: str, gcs_uri: Optional[str] = None,
+                      page_heights: Optional[List[int]] = None, content_hash: Optional[str] = None) -> BillData:
+        return self._call("process_bytes", content, filename, gcs_uri=gcs_uri, page_heights=page_heights,
+                          content_hash=content_hash)
+    
+    def process_batch(self, contents: List[bytes], filenames: List[str],
+                      gcs_uris: Optional[List[Optional[str]]] = None,
+                      content_hashes: Optional[List[str]] = None) -> List[Union[BillData, Exception]]:
+        """The primary's results, with the entries it failed on retried by the fallback"""
+        gcs_uris = list(gcs_uris) if gcs_uris else [None] * len(contents)
+        content_hashes = list(content_hashes) if content_hashes else [None] * len(contents)
+        try:
+            results = self.primary.process_batch(contents, filenames, gcs_uris, content_hashes)
+        except Exception as e:
+            self.fallbacks += len(contents)
+            print(f"⚠️  {type(self.primary).__name__}.process_batch failed ({e}); using {type(self.fallback).__name__}")
+            return self.fallback.process_batch(contents, filenames, gcs_uris, content_hashes)
+        failed = [i for i, result in enumerate(results) if isinstance(result, Exception)]
+        if failed:
+            self.fallbacks += len(failed)
+            print(f"⚠️  {type(self.primary).__name__} failed on {len(failed)} receipts; using {type(self.fallback).__name__}")
+            retried = self.fallback.process_batch([contents[i] for i in failed], [filenames[i] for i in failed],
+                                                  [gcs_uris[i] for i in failed], [content_hashes[i] for i in failed])
+            for i, result in zip(failed, retried):
+                results[i] = result
+        return results
+
+
+@register_processor("gemini")
 class VisionBillProcessor(BillProcessor):
     """Process bills using Google Gemini Vision API"""
     
@@ -217,6 +542,10 @@ class VisionBillProcessor(BillProcessor):
         self.config.configure_genai()
         self.model = genai.GenerativeModel(self.config.vision_model)
         self.storage_manager = storage_manager
+        self.batch_tuner = BatchSizeTuner(config.vision_batch_max, config.vision_batch_target_seconds)
+        self.limiter = None  # optional rate_limiter.RateLimiter every model call waits on
+        self.usage = {"calls": 0, "prompt_tokens": 0, "output_tokens": 0, "fallbacks": 0}
+        self._usage_lock = threading.Lock()
         
     def process(self, image_path: str) -> BillData:
         """Process bill image using Gemini Vision and optionally upload to GCS"""
@@ -227,13 +556,183 @@ class VisionBillProcessor(BillProcessor):
         
         # Process the image
         img = Image.open(image_path)
+        return self._extract_pages([img], gcs_uri)
+    
+    def process_bytes(self, content: bytes, filename: str, gcs_uri: Optional[str] = None,
+                      page_heights: Optional[List[int]] = None, content_hash: Optional[str] = None) -> BillData:
+        """Process an in-memory bill image, uploading it to GCS only if it isn't there yet"""
+        if gcs_uri is None and self.storage_manager:
+            gcs_uri = self.storage_manager.upload_bytes(content, filename)
         
+        img = Image.open(io.BytesIO(content))
+        return self._extract_pages(split_pages(img, page_heights), gcs_uri)
+    
+    def _extract_pages(self, pages: List[Image.Image], gcs_uri: Optional[str]) -> BillData:
+        """One call for an ordinary receipt; tall pages and multi-photo receipts go band by band"""
+        bands = tile(pages)
+        if len(bands) == 1:
+            return self._extract(bands[0], gcs_uri)
+        return self._extract_bands(bands, gcs_uri)
+    
+    def _extract(self, img: Image.Image, gcs_uri: Optional[str]) -> BillData:
+        """Run Gemini Vision on an opened image"""
         prompt = self._build_prompt()
-        response = self.model.generate_content([prompt, img])
+        response = self._generate([prompt, img])
         
         raw_data = self._parse_response(response.text)
         return BillData(raw_data, gcs_uri=gcs_uri)
     
+    def _extract_bands(self, bands: List[Image.Image], gcs_uri: Optional[str]) -> BillData:
+        """
+        Extract the bands of one long receipt concurrently and merge them.
+        If the merged items don't add up and de-duplicating the overlaps
+        dropped some, the merge without de-duplication is tried as well (a
+        line can really repeat across a band boundary). Problems that remain
+        are kept under "extraction_warnings".
+        """
+        count = len(bands)
+        workers = max(1, min(self.config.vision_band_workers, count))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            extracted = list(pool.map(lambda i: self._extract_band(bands[i], i, count), range(count)))
+        
+        merged = merge_bands(extracted)
+        problems = extraction_problems(merged)
+        if problems:
+            undeduplicated = merge_bands(extracted, dedupe=False)
+            if (len(undeduplicated["items"]) != len(merged["items"])
+                    and not extraction_problems(undeduplicated)):
+                merged, problems = undeduplicated, []
+        if problems:
+            print(f"⚠️  Merged {count}-band extraction looks wrong: {'; '.join(problems)}")
+            merged["extraction_warnings"] = problems
+        return BillData(merged, gcs_uri=gcs_uri)
+    
+    def _extract_band(self, band: Image.Image, index: int, count: int) -> Dict:
+        """One band of a long receipt; asked again once if the answer isn't valid JSON"""
+        prompt = self._build_band_prompt(index, count)
+        for attempt in range(2):
+            response = self._generate([prompt, band])
+            try:
+                data = self._parse_response(response.text)
+            except ValueError:
+                if attempt:
+                    raise
+                continue
+            return data if isinstance(data, dict) else {}
+    
+    def _generate(self, parts: List):
+        """One model call, paced by the limiter and metered"""
+        if self.limiter is not None:
+            self.limiter.acquire()
+        response = self.model.generate_content(parts)
+        metadata = getattr(response, "usage_metadata", None)
+        with self._usage_lock:
+            self.usage["calls"] += 1
+            self.usage["prompt_tokens"] += getattr(metadata, "prompt_token_count", 0) or 0
+            self.usage["output_tokens"] += getattr(metadata, "candidates_token_count", 0) or 0
+        return response
+    
+    def process_batch(self, contents: List[bytes], filenames: List[str],
+                      gcs_uris: Optional[List[Optional[str]]] = None,
+                      content_hashes: Optional[List[str]] = None) -> List[Union[BillData, Exception]]:
+        """
+        Extract several receipts with one vision call. Entries the batched
+        answer is missing or that fail extraction_problems() are re-extracted
+        one at a time, so a result comes back for every image (in order);
+        an entry whose own extraction fails too gets its exception instead.
+        The latency and failure count feed the batch size tuner. Long
+        receipts that need tiling are left out of the shared call.
+        """
+        gcs_uris = list(gcs_uris) if gcs_uris else [None] * len(contents)
+        results: List[Union[BillData, Exception, None]] = [None] * len(contents)
+        images: List[Optional[Image.Image]] = [None] * len(contents)
+        for i, content in enumerate(contents):
+            try:
+                if gcs_uris[i] is None and self.storage_manager:
+                    gcs_uris[i] = self.storage_manager.upload_bytes(content, filenames[i])
+                images[i] = Image.open(io.BytesIO(content))
+            except Exception as e:
+                results[i] = e
+        
+        # Long receipts are tiled on their own rather than shrunk into a shared call
+        for i, img in enumerate(images):
+            if img is not None and is_tall(img.size):
+                results[i] = attempt(self._extract_pages, [img], gcs_uris[i])
+        pending = [i for i in range(len(images)) if results[i] is None]
+        
+        if len(pending) == 1:
+            i = pending[0]
+            start = time.perf_counter()
+            results[i] = attempt(self._extract, images[i], gcs_uris[i])
+            self.batch_tuner.record(1, time.perf_counter() - start, 0)
+        elif pending:
+            start = time.perf_counter()
+            try:
+                extracted = self._extract_batch([images[i] for i in pending])
+            except Exception as e:
+                print(f"⚠️  Batched extraction of {len(pending)} receipts failed ({e}); extracting one by one")
+                extracted = [None] * len(pending)
+            seconds = time.perf_counter() - start
+            
+            fallbacks = 0
+            for i, raw_data in zip(pending, extracted):
+                if raw_data is None or extraction_problems(raw_data):
+                    fallbacks += 1
+                    results[i] = attempt(self._extract, images[i], gcs_uris[i])
+                else:
+                    results[i] = BillData(raw_data, gcs_uri=gcs_uris[i])
+            
+            with self._usage_lock:
+                self.usage["fallbacks"] += fallbacks
+            self.batch_tuner.record(len(pending), seconds, fallbacks)
+        return results
+    
+    def _extract_batch(self, images: List[Image.Image]) -> List[Optional[Dict]]:
+        """One call for several receipts; None for entries the answer lacks"""
+        parts = [self._build_batch_prompt(len(images))]
+        for i, img in enumerate(images):
+            parts.extend([f"Receipt {i}:", img])
+        response = self._generate(parts)
+        
+        answer = self._parse_response(response.text)
+        if isinstance(answer, dict):
+            answer = answer.get("bills", [])
+        
+        extracted: List[Optional[Dict]] = [None] * len(images)
+        for position, bill in enumerate(answer if isinstance(answer, list) else []):
+            if not isinstance(bill, dict):
+                continue
+            index = bill.pop("index", position)
+            if isinstance(index, int) and 0 <= index < len(images) and extracted[index] is None:
+                extracted[index] = bill
+        return extracted
+    
+    def _build_batch_prompt(self, count: int) -> str:
+        """Prompt for a batched call: the single-receipt fields, as an array keyed by index"""
+        return f"""You are given {count} receipt images, labelled "Receipt 0" to "Receipt {count - 1}".
+      Extract each one independently; never mix items between receipts.
+      
+      {self._build_prompt()}
+      
+      For this request, instead return ONLY a JSON array with exactly {count} objects,
+      one per receipt, each with an "index" field holding its receipt number:
+      [{{"index": 0, "merchant": "...", ...}}, {{"index": 1, ...}}]
+      If an image is unreadable or not a receipt, return {{"index": i, "error": "why"}} for it."""
+    
+    def _build_band_prompt(self, index: int, count: int) -> str:
+        """Prompt for one band of a long receipt cut top to bottom into overlapping parts"""
+        return f"""This image is part {index + 1} of {count} of ONE long receipt, cut into
+      horizontal bands from top to bottom; neighbouring parts overlap slightly.
+      
+      {self._build_prompt()}
+      
+      For this part only (its items won't add up to the receipt total):
+      - List every line item fully visible in this part, in order, including items
+        in the overlap with the neighbouring parts; skip lines cut off at the edges
+      - Give merchant, date, subtotal, tax, tip and total only if they are printed
+        in this part; use null otherwise
+      - If this part has no line items (only a header or footer), return "items": []"""
+    
     def _build_prompt(self) -> str:
         """Build the vision model prompt"""
         return """Analyze this receipt image and extract:
@@ -259,15 +758,6 @@ class VisionBillProcessor(BillProcessor):
         "total": 0.00
       }"""
     
-    def _parse_response(self, response_text: str) -> Dict:
-        """Parse JSON from model response"""
-        output = response_text
-        if "```json" in output:
-            output = output.split("```json")[1].split("```")[0].strip()
-        elif "```" in output:
-            output = output.split("```")[1].split("```")[0].strip()
-        
-        return json.loads(output)
 
 
 # ============================================================================
@@ -372,6 +862,29 @@ class ToolKit:
 # EXPENSE SPLITTING
 # ============================================================================
 
+# Vendored copy of the LangChain Hub "hwchase17/react" prompt, so building an
+# agent never needs a network round trip to the hub
+REACT_AGENT_PROMPT = """Answer the following questions as best you can. You have access to the following tools:
+
+{tools}
+
+Use the following format:
+
+Question: the input question you must answer
+Thought: you should always think about what to do
+Action: the action to take, should be one of [{tool_names}]
+Action Input: the input to the action
+Observation: the result of the action
+... (this Thought/Action/Action Input/Observation can repeat N times)
+Thought: I now know the final answer
+Final Answer: the final answer to the original input question
+
+Begin!
+
+Question: {input}
+Thought:{agent_scratchpad}"""
+
+
 class SplitResult:
     """Data class for expense split results"""
     def __init__(self, data: Dict[str, Any]):
@@ -398,6 +911,19 @@ class SplitResult:
         return abs(sum_total - bill_total) < 0.01
 
 
+class RateLimitCallback(BaseCallbackHandler):
+    """Makes every LLM call of an agent run wait on a rate_limiter.RateLimiter first"""
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.limiter.acquire()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.limiter.acquire()
+
+
 class ExpenseSplitter:
     """Handles expense splitting logic using LangChain agents"""
     
@@ -408,15 +934,18 @@ class ExpenseSplitter:
             google_api_key=self.config.api_key,
             temperature=self.config.temperature
         )
+        self.agent_prompt = PromptTemplate.from_template(REACT_AGENT_PROMPT)
+        # Optional rate_limiter.RateLimiter each agent step's model call waits on
+        self.limiter = None
     
-    def split(self, bill_data: BillData, instruction: str) -> SplitResult:
+    def split(self, bill_data: BillData, instruction: str, llm=None) -> SplitResult:
         """Calculate expense split based on user instruction"""
         
         # Create tools with bill context
         tools = ToolKit.create_langchain_tools(bill_data)
         
-        # Create agent
-        agent = self._create_agent(tools)
+        # Create agent (llm can be swapped, e.g. for a fake model during warm-up)
+        agent = self._create_agent(tools, llm)
         agent_executor = AgentExecutor(
             agent=agent,
             tools=tools,
@@ -427,16 +956,16 @@ class ExpenseSplitter:
         
         # Build and execute prompt
         prompt = self._build_prompt(bill_data, instruction)
-        response = agent_executor.invoke({"input": prompt})
+        callbacks = [RateLimitCallback(self.limiter)] if self.limiter is not None else []
+        response = agent_executor.invoke({"input": prompt}, config={"callbacks": callbacks})
         
         # Parse response
         result_data = self._parse_response(response['output'])
         return SplitResult(result_data)
     
-    def _create_agent(self, tools: List):
+    def _create_agent(self, tools: List, llm=None):
         """Create ReAct agent with tools"""
-        prompt = hub.pull("hwchase17/react")
-        return create_react_agent(self.llm, tools, prompt)
+        return create_react_agent(llm or self.llm, tools, self.agent_prompt)
     
     def _build_prompt(self, bill_data: BillData, instruction: str) -> str:
         """Build agent prompt"""
@@ -505,6 +1034,16 @@ Work step by step using tools, then provide final JSON."""
 # MAIN SYSTEM
 # ============================================================================
 
+def create_expense_splitter(config: Config):
+    """The Gemini ReAct splitter, or the replaying stand-in with SPLIT_BACKEND=fixture"""
+    if config.split_backend == "fixture":
+        from local_processors import FixtureExpenseSplitter
+        return FixtureExpenseSplitter(config)
+    if config.split_backend != "gemini":
+        raise ValueError(f"Unknown split backend {config.split_backend!r}; choose from ['fixture', 'gemini']")
+    return ExpenseSplitter(config)
+
+
 class BillSplitSystem:
     """Main orchestrator for the bill splitting system"""
     
@@ -516,8 +1055,8 @@ class BillSplitSystem:
         self.storage_manager = CloudStorageManager(self.config) if self.config.gcs_enabled else None
         
         # Initialize processors
-        self.bill_processor = VisionBillProcessor(self.config, self.storage_manager)
-        self.expense_splitter = ExpenseSplitter(self.config)
+        self.bill_processor = create_bill_processor(self.config, self.storage_manager)
+        self.expense_splitter = create_expense_splitter(self.config)
     
     def process_and_split(self, image_path: str, instruction: str) -> tuple[BillData, SplitResult]:
         """Process a bill image and split expenses"""
@@ -542,11 +1081,9 @@ class BillSplitSystem:
             gcs_uri = self.storage_manager.upload_with_metadata(image_path, metadata)
             
             # Process without re-uploading
-            img = Image.open(image_path)
-            prompt = self.bill_processor._build_prompt()
-            response = self.bill_processor.model.generate_content([prompt, img])
-            raw_data = self.bill_processor._parse_response(response.text)
-            bill_data = BillData(raw_data, gcs_uri=gcs_uri)
+            with open(image_path, "rb") as f:
+                content = f.read()
+            bill_data = self.bill_processor.process_bytes(content, os.path.basename(image_path), gcs_uri=gcs_uri)
         else:
             bill_data = self.bill_processor.process(image_path)
         
@@ -559,6 +1096,55 @@ class BillSplitSystem:
         
         return bill_data, split_result
     
+    def warm_up(self, synthetic: bool = False) -> Dict[str, float]:
+        """
+        Initialize everything a first request would otherwise pay for lazily.
+        With synthetic=True, also runs a canned bill through the vision parser
+        and the split agent using a fake model (no API calls).
+        
+        Returns:
+            Seconds spent in each warm-up step
+        """
+        timings = {}
+        
+        start = datetime.now()
+        self.config.configure_genai()
+        if self.storage_manager and self.storage_manager.client:
+            self.storage_manager.client.bucket(self.config.gcs_bucket_name)
+        timings["clients"] = (datetime.now() - start).total_seconds()
+        
+        if synthetic:
+            from langchain_core.language_models import FakeListLLM
+            
+            start = datetime.now()
+            sample = {
+                "merchant": "Warm-up Cafe",
+                "date": "2025-01-01",
+                "items": [{"name": "Coffee", "quantity": 2, "unit_price": 2.50, "total": 5.00}],
+                "subtotal": 5.00,
+                "tax": 0.50,
+                "total": 5.50
+            }
+            raw_data = self.bill_processor._parse_response(f"```json\n{json.dumps(sample)}\n```")
+            bill_data = BillData(raw_data)
+            
+            answer = {
+                "split_type": "equal",
+                "breakdown": [
+                    {"person": "A", "items": ["Coffee"], "subtotal": 2.50, "tax_share": 0.25, "total": 2.75},
+                    {"person": "B", "items": ["Coffee"], "subtotal": 2.50, "tax_share": 0.25, "total": 2.75}
+                ],
+                "verification": {"sum": 5.50, "bill_total": 5.50}
+            }
+            fake_llm = FakeListLLM(responses=[
+                "Thought: I now know the final answer\n"
+                f"Final Answer: {json.dumps(answer)}"
+            ])
+            self.expense_splitter.split(bill_data, "Split equally between A and B", llm=fake_llm)
+            timings["synthetic_bill"] = (datetime.now() - start).total_seconds()
+        
+        return timings
+    
     def quick_split(self, image_path: str, instruction: str) -> str:
         """Convenience method that returns formatted JSON result"""
         _, split_result = self.process_and_split(image_path, instruction)
@@ -0,0 +1,95 @@
+"""
+Bill summaries precomputed at write time.
+
+History listings only need merchant, total, date and item count, so these
+are extracted from bill_json when the worker persists a bill and stored in
+their own bill_data columns. Listing a user's bills then never reads the
+JSONB document. search_text (merchant plus item names) feeds the
+full-text and trigram search indexes.
+"""
+
+import os
+import re
+from datetime import date, datetime
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from typing import Dict, Optional
+
+
+# How to read an ambiguous numeric date like 03/04/2024: "mdy" (March 4) or "dmy" (3 April)
+BILL_DATE_ORDER = os.getenv("BILL_DATE_ORDER", "mdy")
+
+MONTH_FIRST_FORMATS = ("%m/%d/%Y", "%m-%d-%Y", "%m/%d/%y", "%m-%d-%y")
+DAY_FIRST_FORMATS = ("%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%d/%m/%y", "%d-%m-%y")
+
+
+def date_formats(order: str = BILL_DATE_ORDER) -> tuple:
+    """Date formats seen on receipts, tried in order: ISO, numeric in the preferred order, then named months"""
+    numeric = (DAY_FIRST_FORMATS + MONTH_FIRST_FORMATS if order == "dmy"
+               else MONTH_FIRST_FORMATS + DAY_FIRST_FORMATS)
+    return ("%Y-%m-%d",) + numeric + ("%d %b %Y", "%d %B %Y", "%b %d, %Y", "%B %d, %Y")
+
+
+DATE_FORMATS = date_formats()
+
+NUMBER_PATTERN = re.compile(r"-?\d+(?:\.\d+)?")
+
+# Precision of the NUMERIC columns amounts are stored in (bill_data.total, bill_items, bill_shares)
+AMOUNT_DIGITS = 12
+
+
+def parse_bill_date(value) -> Optional[date]:
+    """The receipt's date, if it's in a recognisable format"""
+    if not value or not isinstance(value, str):
+        return None
+    value = value.strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_amount(value, places: int = 2) -> Optional[Decimal]:
+    """
+    A money amount as Decimal, tolerating currency symbols and thousands
+    separators, rounded to `places` decimals. None if it can't be read or
+    doesn't fit a NUMERIC(AMOUNT_DIGITS, places) column (OCR noise such as
+    a misread receipt number), so one bad value never fails a bill's write.
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        amount = Decimal(str(value))
+    else:
+        match = NUMBER_PATTERN.search(str(value).replace(",", ""))
+        if not match:
+            return None
+        try:
+            amount = Decimal(match.group())
+        except InvalidOperation:
+            return None
+    limit = Decimal(10) ** (AMOUNT_DIGITS - places)
+    if not amount.is_finite() or abs(amount) >= limit:
+        return None
+    amount = amount.quantize(Decimal(1).scaleb(-places), rounding=ROUND_HALF_UP)
+    return amount if abs(amount) < limit else None
+
+
+def summarize(bill_json: Dict) -> Dict:
+    """merchant / total / bill_date / item_count / search_text for a stored bill document"""
+    bill_data = (bill_json or {}).get("bill_data") or {}
+    items = bill_data.get("items")
+    if not isinstance(items, list):
+        items = []
+    merchant = bill_data.get("merchant")
+    merchant = merchant.strip()[:255] if isinstance(merchant, str) and merchant.strip() else None
+
+    names = [str(item.get("name")).strip() for item in items if isinstance(item, dict) and item.get("name")]
+    return {
+        "merchant": merchant,
+        "total": parse_amount(bill_data.get("total")),
+        "bill_date": parse_bill_date(bill_data.get("date")),
+        "item_count": len(items),
+        "search_text": " ".join(filter(None, [merchant, *names])) or None,
+    }
@@ -0,0 +1,108 @@
+"""
+Loading the processed_bills corpus: JSON directory vs bill_archive.py.
+
+Replicates the samples in data/processed_bills into a temporary directory
+of --bills pretty-printed JSON files (fresh bill_ids), packs it, then
+times a full load of each, opening the archive (index read) and random
+single-bill lookups.
+
+Usage (from the repo root):
+    python "code to test small components/bench_archive.py" --bills 20000
+"""
+
+import argparse
+import glob
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bill_archive import BillArchive, pack  # noqa: E402
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "processed_bills")
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def load_directory(bills_dir: str) -> int:
+    count = 0
+    for path in glob.glob(os.path.join(bills_dir, "*.json")):
+        with open(path) as f:
+            json.load(f)
+        count += 1
+    return count
+
+
+def load_archive(archive_path: str) -> int:
+    with BillArchive(archive_path) as archive:
+        return sum(1 for _ in archive)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bills", type=int, default=20000)
+    parser.add_argument("--lookups", type=int, default=10000)
+    args = parser.parse_args()
+
+    samples = []
+    for path in sorted(glob.glob(os.path.join(SAMPLES_DIR, "*.json"))):
+        with open(path) as f:
+            samples.append(json.load(f))
+    if not samples:
+        sys.exit(f"No samples found in {SAMPLES_DIR}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bills_dir = os.path.join(tmp, "processed_bills")
+        os.makedirs(bills_dir)
+        bill_ids = []
+        for n in range(args.bills):
+            doc = dict(samples[n % len(samples)], bill_id=str(uuid.uuid4()))
+            bill_ids.append(doc["bill_id"])
+            with open(os.path.join(bills_dir, f"{doc['bill_id']}.json"), "w") as f:
+                json.dump(doc, f, indent=2)
+
+        archive_path = os.path.join(tmp, "processed_bills.bpack")
+        _, pack_secs = timed(lambda: pack(bills_dir, archive_path))
+
+        dir_bytes = sum(os.path.getsize(p) for p in glob.glob(os.path.join(bills_dir, "*.json")))
+        print(f"{args.bills} bills: directory {dir_bytes / 1e6:.1f} MB, "
+              f"archive {os.path.getsize(archive_path) / 1e6:.1f} MB (packed in {pack_secs:.2f}s)")
+
+        count, dir_secs = timed(lambda: load_directory(bills_dir))
+        assert count == args.bills
+        count, archive_secs = timed(lambda: load_archive(archive_path))
+        assert count == args.bills
+        print(f"{'full load':<22} directory {dir_secs:>8.3f}s   archive {archive_secs:>8.3f}s   "
+              f"{dir_secs / archive_secs:>5.1f}x")
+
+        archive, open_secs = timed(lambda: BillArchive(archive_path))
+        with archive:
+            picks = [random.choice(bill_ids) for _ in range(args.lookups)]
+
+            def lookup_files():
+                for bill_id in picks:
+                    with open(os.path.join(bills_dir, f"{bill_id}.json")) as f:
+                        json.load(f)
+
+            def lookup_archive():
+                for bill_id in picks:
+                    archive.get(bill_id)
+
+            _, file_secs = timed(lookup_files)
+            _, get_secs = timed(lookup_archive)
+        print(f"{'open archive (index)':<22} {open_secs * 1000:>8.2f} ms")
+        print(f"{'single-bill lookup':<22} file {file_secs / args.lookups * 1e6:>8.1f} us   "
+              f"archive {get_secs / args.lookups * 1e6:>8.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Batched vs one-at-a-time vision extraction (live Gemini calls).
+
+Runs the same receipts through VisionBillProcessor.process_batch at fixed
+batch sizes (size 1 is the one-call-per-receipt baseline) and with the
+auto-tuned size, then reports bills/minute, model calls, single-image
+fallbacks, tokens and estimated cost. Needs GEMINI_API_KEY; images are
+not uploaded to GCS.
+
+Usage (from the repo root):
+    python "code to test small components/bench_batch_vision.py" receipts/ --sizes 1,2,4,8 --auto
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bill_splitting_agent import BatchSizeTuner, Config, VisionBillProcessor  # noqa: E402
+from batch_process import iter_images, prepare_image  # noqa: E402
+
+# USD per million tokens (gemini-2.0-flash list prices); override for other models
+DEFAULT_INPUT_PRICE = 0.10
+DEFAULT_OUTPUT_PRICE = 0.40
+
+
+def run(processor: VisionBillProcessor, images, fixed_size: int):
+    processor.usage = {"calls": 0, "prompt_tokens": 0, "output_tokens": 0, "fallbacks": 0}
+    start = time.perf_counter()
+    done = 0
+    while done < len(images):
+        size = fixed_size or processor.batch_tuner.size
+        chunk = images[done:done + size]
+        processor.process_batch([content for _, content in chunk], [name for name, _ in chunk])
+        done += len(chunk)
+    return time.perf_counter() - start, dict(processor.usage)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="Directory, .zip or .tar of receipt images")
+    parser.add_argument("--sizes", default="1,2,4,8", help="Fixed batch sizes to compare")
+    parser.add_argument("--auto", action="store_true", help="Also run with the auto-tuned batch size")
+    parser.add_argument("--limit", type=int, default=32, help="Receipts to use")
+    parser.add_argument("--input-price", type=float, default=DEFAULT_INPUT_PRICE)
+    parser.add_argument("--output-price", type=float, default=DEFAULT_OUTPUT_PRICE)
+    args = parser.parse_args()
+
+    images = []
+    for name, content in iter_images(args.source):
+        images.append((name, prepare_image(content)))
+        if len(images) >= args.limit:
+            break
+    if not images:
+        sys.exit(f"No images found in {args.source}")
+
+    config = Config(os.getenv("GEMINI_API_KEY"))
+    processor = VisionBillProcessor(config)
+
+    modes = [(f"size {size}", int(size)) for size in args.sizes.split(",")]
+    if args.auto:
+        modes.append(("auto", 0))
+
+    print(f"{len(images)} receipts, model {config.vision_model}")
+    print(f"{'mode':<8} {'bills/min':>10} {'calls':>6} {'fallbacks':>10} {'tokens in':>10} "
+          f"{'tokens out':>11} {'$/1k bills':>11}")
+    for label, size in modes:
+        processor.batch_tuner = BatchSizeTuner(config.vision_batch_max, config.vision_batch_target_seconds)
+        seconds, usage = run(processor, images, size)
+        cost = (usage["prompt_tokens"] * args.input_price + usage["output_tokens"] * args.output_price) / 1e6
+        print(f"{label:<8} {len(images) / seconds * 60:>10.1f} {usage['calls']:>6} {usage['fallbacks']:>10} "
+              f"{usage['prompt_tokens']:>10} {usage['output_tokens']:>11} {cost / len(images) * 1000:>11.3f}")
+        if not size:
+            print(f"         auto-tuned size settled at {processor.batch_tuner.size}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Latency of the GET /bill/{bill_id} database path under concurrency, per pool mode.
+
+Each mode gets its own engine (database.engine_options) and runs the same
+session + SELECT that get_bill performs on a cache miss, from --concurrency
+coroutines at once. Compare `none` (the old NullPool setup: a new
+connection per request) against `direct` and, behind a transaction
+pooler, `pgbouncer`.
+
+Usage (from the repo root, DATABASE_URL pointing at the database to test):
+    python "code to test small components/bench_db_pool.py" --bill-id <id> --requests 2000 --concurrency 50
+    python "code to test small components/bench_db_pool.py" --bill-id <id> --modes pgbouncer
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine  # noqa: E402
+from sqlalchemy.future import select  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from database import DATABASE_URL, TimedQueuePool, engine_options  # noqa: E402
+from models import BillData  # noqa: E402
+
+
+async def run_mode(mode: str, bill_id: str, total: int, concurrency: int) -> dict:
+    engine = create_async_engine(DATABASE_URL, **engine_options(mode))
+    Session = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    TimedQueuePool.waits.clear()
+
+    latencies = []
+    sem = asyncio.Semaphore(concurrency)
+
+    async def get_bill():
+        async with sem:
+            start = time.perf_counter()
+            async with Session() as db:
+                result = await db.execute(select(BillData).where(BillData.bill_id == bill_id))
+                result.scalars().first()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(get_bill() for _ in range(total)))
+    elapsed = time.perf_counter() - start
+    await engine.dispose()
+
+    latencies.sort()
+    waits = sorted(TimedQueuePool.waits)
+    return {
+        "rps": total / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "wait_p95_ms": waits[int(len(waits) * 0.95) - 1] * 1000 if waits else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bill-id", required=True)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--modes", default="none,direct")
+    args = parser.parse_args()
+
+    print(f"{args.requests} lookups, concurrency {args.concurrency}")
+    print(f"{'mode':<10} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'checkout wait p95 ms':>21}")
+    for mode in args.modes.split(","):
+        r = asyncio.run(run_mode(mode, args.bill_id, args.requests, args.concurrency))
+        wait = f"{r['wait_p95_ms']:.2f}" if r["wait_p95_ms"] is not None else "-"
+        print(f"{mode:<10} {r['rps']:>8.1f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {wait:>21}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Throughput and memory of the bulk bill export (bill_export.py).
+
+Synthesizes export rows from the samples in data/processed_bills (cycled
+up to --rows, generated batch by batch like a server-side cursor would
+deliver them) and pushes them through ExportEncoder in every format, with
+and without gzip. Peak RSS should stay flat as --rows grows.
+
+With --database, also times the real CLI path (psycopg2 named cursor)
+against DATABASE_URL, discarding the output.
+
+Usage (from the repo root):
+    python "code to test small components/bench_export.py" --rows 1000000
+    python "code to test small components/bench_export.py" --rows 1000000 --database
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import resource
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bill_export import EXPORT_BATCH_ROWS, ExportEncoder, export_chunks  # noqa: E402
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "processed_bills")
+
+
+def load_samples():
+    samples = []
+    for path in sorted(glob.glob(os.path.join(SAMPLES_DIR, "*.json"))):
+        with open(path) as f:
+            doc = json.load(f)
+        bill_json = {"bill_data": doc.get("bill_data"), "split_result": doc.get("split_result")}
+        breakdown = (doc.get("split_result") or {}).get("breakdown") or []
+        splits = "; ".join(f"{share.get('person')}: {share.get('total')}" for share in breakdown)
+        samples.append((doc.get("file_name") or "", {"ndjson": json.dumps(bill_json), "csv": splits}))
+    return samples
+
+
+def synthetic_batches(samples, fmt: str, rows: int, batch_size: int):
+    """export_query()-shaped rows, one batch at a time"""
+    created_at = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    total = Decimal("1234.50")
+    batch = []
+    for n in range(rows):
+        file_name, last_column = samples[n % len(samples)]
+        batch.append((
+            f"{n:032x}", created_at, created_at.date(), "Sample Merchant",
+            total, 12, n % 1000, file_name, last_column[fmt],
+        ))
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def run(batches, fmt: str, compress: bool):
+    encoder = ExportEncoder(fmt, compress=compress)
+    start = time.perf_counter()
+    written = 0
+    for chunk in export_chunks(batches, encoder):
+        written += len(chunk)
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in KB on Linux; a process-wide high-water mark
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return encoder, written, elapsed, peak
+
+
+def report(label: str, encoder: ExportEncoder, written: int, elapsed: float, peak: int):
+    print(f"{label:<14} {encoder.rows / elapsed:>12,.0f} {encoder.raw_bytes / 1e6 / elapsed:>8.1f} "
+          f"{written / 1e6:>10.1f} {elapsed:>8.1f} {peak / 1e6:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--batch-size", type=int, default=EXPORT_BATCH_ROWS)
+    parser.add_argument("--database", action="store_true", help="Also export from DATABASE_URL")
+    args = parser.parse_args()
+
+    samples = load_samples()
+    if not samples:
+        sys.exit(f"No samples found in {SAMPLES_DIR}")
+
+    print(f"{args.rows:,} rows, batches of {args.batch_size}")
+    print(f"{'mode':<14} {'rows/s':>12} {'MB/s':>8} {'output MB':>10} {'secs':>8} {'peak RSS MB':>12}")
+    for fmt in ("ndjson", "csv"):
+        for compress in (False, True):
+            batches = synthetic_batches(samples, fmt, args.rows, args.batch_size)
+            report(fmt + (" +gzip" if compress else ""), *run(batches, fmt, compress))
+
+    if args.database:
+        import psycopg2
+
+        from bill_export import database_batches, export_query
+        from worker_db import sync_database_url
+
+        for fmt in ("ndjson", "csv"):
+            sql, params = export_query(fmt)
+            conn = psycopg2.connect(sync_database_url())
+            try:
+                report(f"db {fmt}", *run(database_batches(conn, sql, params, args.batch_size), fmt, False))
+            finally:
+                conn.close()
+
+
+if __name__ == "__main__":
+    main()
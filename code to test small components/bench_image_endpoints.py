@@ -0,0 +1,107 @@
+"""
+Requests/second of the bill image endpoints against a local GCS emulator.
+
+Runs two handlers that mirror /bill/{bill_id}/view under the same concurrent
+load, each inside a single asyncio event loop like uvicorn's:
+
+    before  - new storage.Client() per request, blob.exists(), then a blocking
+              download_as_bytes() directly inside the coroutine
+    after   - bill_images.fetch_image(): shared pooled client, no exists(),
+              download on the bounded GCS I/O thread pool
+
+Start the emulator first (see docker-compose.yml):
+    docker compose --profile emulator up -d gcs-emulator
+
+Usage (from the repo root):
+    STORAGE_EMULATOR_HOST=http://localhost:4443 \\
+        python "code to test small components/bench_image_endpoints.py" --requests 500 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from google.cloud import storage  # noqa: E402
+
+import bill_images  # noqa: E402
+
+BUCKET = "bench-bills"
+BLOB = "bills/bench_receipt.jpg"
+
+
+def emulator_client() -> storage.Client:
+    # With STORAGE_EMULATOR_HOST set the client uses anonymous credentials
+    return storage.Client(project="bench")
+
+
+def seed(size_kb: int):
+    client = emulator_client()
+    bucket = client.bucket(BUCKET)
+    if not bucket.exists():
+        client.create_bucket(BUCKET)
+    bucket.blob(BLOB).upload_from_string(
+        b"\xff\xd8\xff\xe0" + os.urandom(size_kb * 1024 - 4), content_type="image/jpeg"
+    )
+
+
+async def view_before():
+    client = emulator_client()
+    blob = client.bucket(BUCKET).blob(BLOB)
+    if not blob.exists():
+        raise RuntimeError("missing")
+    return blob.download_as_bytes()
+
+
+async def view_after():
+    content, _ = await bill_images.fetch_image(BUCKET, BLOB)
+    return content
+
+
+async def run_load(handler, total: int, concurrency: int):
+    latencies = []
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with sem:
+            start = time.perf_counter()
+            await handler()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "rps": total / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--size-kb", type=int, default=500)
+    args = parser.parse_args()
+
+    if not os.getenv("STORAGE_EMULATOR_HOST"):
+        sys.exit("Set STORAGE_EMULATOR_HOST to the GCS emulator, e.g. http://localhost:4443")
+
+    seed(args.size_kb)
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, {args.size_kb} KB image")
+    print(f"{'mode':<8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, handler in (("before", view_before), ("after", view_after)):
+        r = asyncio.run(run_load(handler, args.requests, args.concurrency))
+        print(f"{name:<8} {r['rps']:>8.1f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
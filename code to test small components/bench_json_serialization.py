@@ -0,0 +1,87 @@
+"""
+Serialization cost of bill payloads: stdlib json vs json_codec (orjson).
+
+For every sample in data/processed_bills, times how long it takes to render
+the GET /bill/{bill_id} body the way Starlette's JSONResponse does, the same
+body through json_codec.dumps, and the hot path that serves a pre-serialized
+body (just the UTF-8 encode). Also times a progress message, which the
+worker publishes several times per bill.
+
+Usage (from the repo root):
+    python "code to test small components/bench_json_serialization.py" --repeat 2000
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from json_codec import dumps, dumps_str  # noqa: E402
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "processed_bills")
+
+
+def stdlib_render(content) -> bytes:
+    """starlette.responses.JSONResponse.render"""
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def time_per_call(fn, arg, repeat: int) -> float:
+    """Best-of-3 microseconds per call"""
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            fn(arg)
+        best = min(best, (time.perf_counter() - start) / repeat)
+    return best * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    payloads = []
+    for path in sorted(glob.glob(os.path.join(SAMPLES_DIR, "*.json"))):
+        with open(path) as f:
+            payloads.append(json.load(f))
+    if not payloads:
+        sys.exit(f"No samples found in {SAMPLES_DIR}")
+
+    totals = {"stdlib": 0.0, "orjson": 0.0, "pre-serialized": 0.0}
+    largest = max(payloads, key=lambda p: len(stdlib_render(p)))
+
+    for payload in payloads:
+        assert json.loads(dumps(payload)) == json.loads(stdlib_render(payload))
+        body = dumps_str(payload)
+        totals["stdlib"] += time_per_call(stdlib_render, payload, args.repeat)
+        totals["orjson"] += time_per_call(dumps, payload, args.repeat)
+        totals["pre-serialized"] += time_per_call(str.encode, body, args.repeat)
+
+    sizes = [len(stdlib_render(p)) for p in payloads]
+    print(f"{len(payloads)} bills, {min(sizes)}-{max(sizes)} bytes, {args.repeat} renders each")
+    print(f"{'path':<16} {'avg us/bill':>12} {'speedup':>9}")
+    for name, total in totals.items():
+        avg = total / len(payloads)
+        print(f"{name:<16} {avg:>12.2f} {totals['stdlib'] / total:>8.1f}x")
+
+    print()
+    print(f"largest bill ({max(sizes)} bytes):")
+    for name, fn in (("stdlib", stdlib_render), ("orjson", dumps)):
+        print(f"  {name:<14} {time_per_call(fn, largest, args.repeat):>8.2f} us")
+
+    progress = {"stage": "splitting", "message": "Analyzing bill structure...", "progress": 60}
+    print("progress message:")
+    print(f"  {'stdlib':<14} {time_per_call(json.dumps, progress, args.repeat * 10):>8.2f} us")
+    print(f"  {'orjson':<14} {time_per_call(dumps, progress, args.repeat * 10):>8.2f} us")
+
+
+if __name__ == "__main__":
+    main()
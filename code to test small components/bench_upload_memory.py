@@ -0,0 +1,110 @@
+"""
+Peak memory of upload ingestion: whole-file read vs chunked streaming.
+
+Simulates N concurrent uploads of SIZE_MB each hitting /process-bill's
+ingestion step, once with the old `f.write(await file.read())` pattern and
+once with upload_stream.stream_upload. Each mode runs in a fresh process
+so their peak RSS numbers don't mix.
+
+Usage (from the repo root):
+    python "code to test small components/bench_upload_memory.py" --uploads 100 --size-mb 10
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from upload_stream import stream_upload  # noqa: E402
+
+
+class FakeUploadFile:
+    """Async reader over a file on disk, like Starlette's spooled UploadFile"""
+    def __init__(self, path: str):
+        self.f = open(path, "rb")
+
+    async def read(self, size: int = -1) -> bytes:
+        data = self.f.read(size)
+        await asyncio.sleep(0)  # let other requests interleave
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+async def ingest_whole_file(upload: FakeUploadFile, spool_dir: str):
+    path = os.path.join(spool_dir, f"whole-{id(upload)}")
+    content = await upload.read()
+    await asyncio.sleep(0.01)  # request keeps its buffer while the handler continues
+    with open(path, "wb") as f:
+        f.write(content)
+    os.remove(path)
+
+
+async def ingest_streaming(upload: FakeUploadFile, spool_dir: str):
+    streamed = await stream_upload(upload, spool_dir, max_bytes=1 << 40)
+    await asyncio.sleep(0.01)
+    streamed.cleanup()
+
+
+def run_mode(mode: str, source: str, uploads: int, spool_dir: str, results):
+    ingest = ingest_whole_file if mode == "whole-file" else ingest_streaming
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    async def main():
+        files = [FakeUploadFile(source) for _ in range(uploads)]
+        try:
+            await asyncio.gather(*(ingest(f, spool_dir) for f in files))
+        finally:
+            for f in files:
+                f.close()
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    asyncio.run(main())
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results[mode] = {
+        "peak_python_mb": peak / (1024 * 1024),
+        "peak_rss_growth_mb": (rss_after - rss_before) / 1024,  # ru_maxrss is KiB on Linux
+        "seconds": elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads", type=int, default=100)
+    parser.add_argument("--size-mb", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "receipt.jpg")
+        with open(source, "wb") as f:
+            f.write(b"\xff\xd8\xff\xe0" + os.urandom(args.size_mb * 1024 * 1024 - 4))
+
+        manager = multiprocessing.Manager()
+        results = manager.dict()
+        for mode in ("whole-file", "streaming"):
+            proc = multiprocessing.Process(target=run_mode, args=(mode, source, args.uploads, tmp, results))
+            proc.start()
+            proc.join()
+
+        print(f"{args.uploads} concurrent uploads of {args.size_mb} MB")
+        print(f"{'mode':<12} {'peak python MB':>15} {'peak RSS growth MB':>19} {'seconds':>9}")
+        for mode in ("whole-file", "streaming"):
+            r = results[mode]
+            print(f"{mode:<12} {r['peak_python_mb']:>15.1f} {r['peak_rss_growth_mb']:>19.1f} {r['seconds']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,40 +2,142 @@ from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 import os
-from sqlalchemy.pool import NullPool
+import threading
+import time
+import uuid
+from collections import deque
+from sqlalchemy.pool import NullPool, AsyncAdaptedQueuePool
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
 
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-# Create engine without statement caching
-engine = create_async_engine(
-    DATABASE_URL,
-    echo=True,
-    poolclass=NullPool,
-    pool_pre_ping=True,
-    connect_args={
-        "server_settings": {
-            "application_name": "bill_splitter",
-            "jit": "off"
-        },
-        "command_timeout": 60,
-        "statement_cache_size": 0,
-        "prepared_statement_cache_size": 0
+# ============================================================================
+# POOL CONFIGURATION
+# ============================================================================
+#
+# DB_POOL_MODE:
+#   direct    - talking straight to Postgres: pooled connections with
+#               asyncpg statement caching
+#   pgbouncer - behind a transaction-mode pooler (e.g. Supabase on port 6543):
+#               still pooled, but no statement caches, uniquely named prepared
+#               statements and no startup parameters PgBouncer would reject
+#   none      - no pooling, a fresh connection per session
+#
+# Unset, the mode is picked from DATABASE_URL: pgbouncer for a pooler
+# (port 6543 or a "pooler" host), direct otherwise.
+
+PGBOUNCER_PORT = 6543
+
+
+def detect_pool_mode(url: str) -> str:
+    """Pool mode for a database URL: pgbouncer if it points at a pooler"""
+    parsed = make_url(url)
+    if parsed.port == PGBOUNCER_PORT or "pooler" in (parsed.host or ""):
+        return "pgbouncer"
+    return "direct"
+
+
+DB_POOL_MODE = os.getenv("DB_POOL_MODE") or detect_pool_mode(DATABASE_URL)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() == "true"
+
+# Recent checkout waits kept per process for /metrics/db-pool
+POOL_WAIT_SAMPLES = 1000
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool that records how long each checkout waited"""
+
+    waits = deque(maxlen=POOL_WAIT_SAMPLES)
+    timeouts = 0
+    _lock = threading.Lock()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            with TimedQueuePool._lock:
+                TimedQueuePool.timeouts += 1
+            raise
+        finally:
+            TimedQueuePool.waits.append(time.perf_counter() - start)
+
+
+def engine_options(mode: str = DB_POOL_MODE) -> dict:
+    """create_async_engine() keyword arguments for a pool mode"""
+    server_settings = {"application_name": "bill_splitter"}
+    connect_args = {"command_timeout": 60, "server_settings": server_settings}
+
+    if mode == "pgbouncer":
+        # Transaction pooling hands each transaction a different server
+        # connection, so nothing prepared on one can be reused on the next
+        connect_args.update({
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+        })
+    else:
+        server_settings["jit"] = "off"
+        connect_args.update({
+            "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+        })
+
+    if mode == "none":
+        return {"poolclass": NullPool, "connect_args": connect_args}
+
+    return {
+        "poolclass": TimedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+        "connect_args": connect_args,
     }
-)
+
+
+engine = create_async_engine(DATABASE_URL, echo=DB_ECHO, **engine_options())
 
 sync_database_url = DATABASE_URL.replace('+asyncpg', '+psycopg2')
 sync_engine = create_engine(sync_database_url, poolclass=NullPool)
 
-engine.sync_engine = sync_engine
-
 # Create session factory
 AsyncSessionLocal = sessionmaker(
     bind=engine,
     class_=AsyncSession,
     expire_on_commit=False,
     autoflush=False,
-    autocommit=False  
+    autocommit=False
 )
+
+
+def pool_stats() -> dict:
+    """Current pool occupancy and checkout wait times for this process"""
+    pool = engine.sync_engine.pool
+    stats = {"mode": DB_POOL_MODE, "pool": pool.status()}
+
+    if isinstance(pool, TimedQueuePool):
+        waits = sorted(TimedQueuePool.waits)
+        stats.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "checked_in": pool.checkedin(),
+            "checkout_timeouts": TimedQueuePool.timeouts,
+            "checkout_wait": {
+                "samples": len(waits),
+                "avg_ms": round(sum(waits) / len(waits) * 1000, 3) if waits else None,
+                "p95_ms": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 3) if waits else None,
+                "max_ms": round(waits[-1] * 1000, 3) if waits else None,
+            },
+        })
+    return stats
@@ -77,14 +77,23 @@ function Upload() {
     formData.append('instruction', getInstruction());
 
     try {
+      const accessToken = localStorage.getItem("access_token");
       const response = await axios.post('http://localhost:8000/process-bill', formData, {
         headers: {
           'Content-Type': 'multipart/form-data',
+          ...(accessToken && { 'Authorization': `Bearer ${accessToken}` }),
         },
       });
 
       const newBillId = response.data.bill_id;
       setBillId(newBillId);
+
+      // Identical receipt already processed: result is ready, nothing to wait for
+      if (response.data.status === 'completed') {
+        setLoading(false);
+        navigate(`/result/${newBillId}`);
+        return;
+      }
       connectWebSocket(newBillId);
 
     } catch (err) {
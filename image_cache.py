@@ -0,0 +1,279 @@
+"""
+Node-local disk cache of bill images and their thumbnails.
+
+Recently viewed receipts are kept under IMAGE_CACHE_DIR, which every API
+process on the node shares, so reopening a result is served from disk
+instead of another GCS download. Entries are written atomically and the
+cache is trimmed to IMAGE_CACHE_MAX_MB by evicting the least recently used
+files (a hit refreshes the file's mtime). A hit returns the data file
+already open, so eviction can't remove it before it is served, and entries
+older than IMAGE_CACHE_REVALIDATE_SECONDS are checked against the object's
+current GCS generation (the metadata file's mtime records the last check).
+
+Thumbnails are resized WebP variants generated with Pillow from the cached
+original and cached alongside it. Widths are limited to THUMBNAIL_WIDTHS so
+the number of variants per image stays bounded.
+"""
+
+import asyncio
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import BinaryIO, Optional, Tuple
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from bill_images import ImageInfo, get_blob, run_gcs, stat_image
+
+
+IMAGE_CACHE_ENABLED = os.getenv("IMAGE_CACHE_ENABLED", "true").lower() == "true"
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "/tmp/bill_image_cache")
+IMAGE_CACHE_MAX_MB = int(os.getenv("IMAGE_CACHE_MAX_MB", "512"))
+# Seconds a cached image is served before its GCS generation is checked again
+IMAGE_CACHE_REVALIDATE_SECONDS = int(os.getenv("IMAGE_CACHE_REVALIDATE_SECONDS", "300"))
+
+THUMBNAIL_WIDTHS = tuple(
+    int(w) for w in os.getenv("THUMBNAIL_WIDTHS", "160,320,640").split(",") if w.strip()
+)
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+
+# Spool files older than this were abandoned by a crashed request
+STALE_SPOOL_SECONDS = 3600
+
+DATA_SUFFIX = ".img"
+META_SUFFIX = ".json"
+
+
+class ThumbnailUnavailable(Exception):
+    """The original image can't be decoded by Pillow (e.g. HEIC)"""
+
+
+class DiskImageCache:
+    """Size-bounded LRU of image files plus their metadata"""
+
+    def __init__(self, root: str = IMAGE_CACHE_DIR, max_bytes: int = IMAGE_CACHE_MAX_MB * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._evict_lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _base(self, key: str) -> str:
+        return os.path.join(self.root, hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+    def get(self, key: str) -> Optional[ImageInfo]:
+        """
+        Cached image for key with its data file open, or None. Marks the
+        entry as recently used; the caller must close() the result.
+        """
+        base = self._base(key)
+        try:
+            with open(base + META_SUFFIX) as f:
+                meta = json.load(f)
+            data = open(base + DATA_SUFFIX, "rb")
+        except (FileNotFoundError, ValueError):
+            return None
+        os.utime(data.fileno())
+        return ImageInfo(path=base + DATA_SUFFIX, file=data, **meta)
+
+    def validated_at(self, key: str) -> float:
+        """When the entry was last known to match GCS (0 if it's gone)"""
+        try:
+            return os.stat(self._base(key) + META_SUFFIX).st_mtime
+        except FileNotFoundError:
+            return 0.0
+
+    def mark_validated(self, key: str):
+        try:
+            os.utime(self._base(key) + META_SUFFIX)
+        except FileNotFoundError:
+            pass
+
+    def drop(self, key: str):
+        """Remove an entry (open handles stay readable)"""
+        base = self._base(key)
+        for suffix in (META_SUFFIX, DATA_SUFFIX):
+            try:
+                os.remove(base + suffix)
+            except FileNotFoundError:
+                pass
+
+    def put(self, key: str, source_path: str, info: ImageInfo) -> ImageInfo:
+        """Move source_path into the cache under key (takes ownership of the file)"""
+        base = self._base(key)
+        meta = info.to_dict()
+        meta["size"] = os.path.getsize(source_path)
+
+        # Data first, then metadata: an entry is only visible once both exist
+        os.replace(source_path, base + DATA_SUFFIX)
+        fd, tmp_meta = tempfile.mkstemp(dir=self.root, prefix=".meta-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_meta, base + META_SUFFIX)
+
+        # Opened before evicting, which may remove the entry straight away
+        data = open(base + DATA_SUFFIX, "rb")
+        self.evict()
+        return ImageInfo(path=base + DATA_SUFFIX, file=data, **meta)
+
+    def spool_path(self) -> str:
+        """Temp file inside the cache dir, so put() is a same-filesystem rename"""
+        fd, path = tempfile.mkstemp(dir=self.root, prefix=".incoming-")
+        os.close(fd)
+        return path
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits its budget"""
+        with self._evict_lock:
+            entries = []
+            total = 0
+            with os.scandir(self.root) as it:
+                for entry in it:
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    if entry.name.startswith("."):
+                        if time.time() - stat.st_mtime > STALE_SPOOL_SECONDS:
+                            try:
+                                os.remove(entry.path)
+                            except FileNotFoundError:
+                                pass
+                        continue
+                    if not entry.name.endswith(DATA_SUFFIX):
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+
+            if total <= self.max_bytes:
+                return
+
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                base = path[:-len(DATA_SUFFIX)]
+                for suffix in (META_SUFFIX, DATA_SUFFIX):
+                    try:
+                        os.remove(base + suffix)
+                    except FileNotFoundError:
+                        pass
+                total -= size
+
+
+# Thumbnails always live here; IMAGE_CACHE_ENABLED only decides whether originals do
+image_cache = DiskImageCache()
+
+
+def _download_to(blob, generation: int, path: str):
+    blob.download_to_filename(path, if_generation_match=generation)
+
+
+async def _revalidated(key: str, bucket_name: str, blob_name: str) -> Tuple[Optional[ImageInfo], Optional[ImageInfo]]:
+    """
+    (cached entry still matching GCS, or None; the fresh GCS metadata if it
+    had to be fetched). A stale entry is dropped. Raises NotFound.
+    """
+    cached = image_cache.get(key)
+    if not cached:
+        return None, None
+    if time.time() - image_cache.validated_at(key) < IMAGE_CACHE_REVALIDATE_SECONDS:
+        return cached, None
+
+    try:
+        current = await stat_image(bucket_name, blob_name)
+    except BaseException:
+        cached.close()
+        image_cache.drop(key)
+        raise
+    if current.generation == cached.generation:
+        image_cache.mark_validated(key)
+        return cached, current
+    cached.close()
+    image_cache.drop(key)
+    return None, current
+
+
+async def cached_original(bucket_name: str, blob_name: str) -> ImageInfo:
+    """
+    Original image, from the node cache when present, otherwise downloaded
+    once into it. Raises google.api_core.exceptions.NotFound.
+    """
+    key = f"{bucket_name}/{blob_name}"
+    cached, info = await _revalidated(key, bucket_name, blob_name)
+    if cached:
+        return cached
+
+    info = info or await stat_image(bucket_name, blob_name)
+    spool = image_cache.spool_path()
+    try:
+        await run_gcs(_download_to, get_blob(bucket_name, blob_name), info.generation, spool)
+        return await asyncio.to_thread(image_cache.put, key, spool, info)
+    except BaseException:
+        if os.path.exists(spool):
+            os.remove(spool)
+        raise
+
+
+def thumbnail_width(requested: int) -> int:
+    """Smallest allowed width that is at least the requested one"""
+    for width in sorted(THUMBNAIL_WIDTHS):
+        if width >= requested:
+            return width
+    return max(THUMBNAIL_WIDTHS)
+
+
+def _render_thumbnail(source: BinaryIO, width: int, target_path: str):
+    try:
+        source.seek(0)
+        with Image.open(source) as img:
+            img = ImageOps.exif_transpose(img)
+            if img.width > width:
+                height = max(round(img.height * width / img.width), 1)
+                img = img.resize((width, height), Image.Resampling.LANCZOS)
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGB")
+            buffer = io.BytesIO()
+            img.save(buffer, "WEBP", quality=THUMBNAIL_QUALITY, method=4)
+    except (UnidentifiedImageError, OSError) as e:
+        raise ThumbnailUnavailable(str(e))
+
+    with open(target_path, "wb") as f:
+        f.write(buffer.getvalue())
+
+
+async def cached_thumbnail(bucket_name: str, blob_name: str, width: int) -> ImageInfo:
+    """
+    WebP thumbnail of an image at one of THUMBNAIL_WIDTHS, generated on first
+    request and cached. Raises NotFound or ThumbnailUnavailable.
+    """
+    key = f"{bucket_name}/{blob_name}@w{width}.webp"
+    cached, _ = await _revalidated(key, bucket_name, blob_name)
+    if cached:
+        return cached
+
+    original = await cached_original(bucket_name, blob_name)
+    spool = image_cache.spool_path()
+    try:
+        try:
+            await asyncio.to_thread(_render_thumbnail, original.file, width, spool)
+        finally:
+            original.close()
+        stem = os.path.splitext(original.filename)[0]
+        variant = ImageInfo(
+            name=key,
+            filename=f"{stem}_w{width}.webp",
+            generation=original.generation,
+            size=0,
+            content_type="image/webp",
+            last_modified=original.last_modified,
+            etag=f'"{original.generation or original.md5_hash}-w{width}"',
+        )
+        return await asyncio.to_thread(image_cache.put, key, spool, variant)
+    except BaseException:
+        if os.path.exists(spool):
+            os.remove(spool)
+        raise
@@ -1,10 +1,94 @@
 from models import Base
 from database import engine
+from sqlalchemy import text, bindparam, Date
+from bill_summary import parse_bill_date
 import asyncio
 
+# Rows whose bill_date is backfilled per round trip
+BILL_DATE_BACKFILL_BATCH = 1000
+
+# Idempotent upgrades for tables created by earlier versions
+# (create_all only creates missing tables, it never alters existing ones)
+SCHEMA_UPGRADES = [
+    "ALTER TABLE bill_data ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    "ALTER TABLE bill_data ADD COLUMN IF NOT EXISTS instruction TEXT",
+    "CREATE INDEX IF NOT EXISTS ix_bill_data_content_hash ON bill_data (content_hash)",
+    "ALTER TABLE bill_data ADD COLUMN IF NOT EXISTS response_body TEXT",
+    "ALTER TABLE bill_data ADD COLUMN IF NOT EXISTS user_id INTEGER REFERENCES users (id) ON DELETE SET NULL",
+    "ALTER TABLE bill_data ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ NOT NULL DEFAULT now()",
+    "ALTER TABLE bill_data ADD COLUMN IF NOT EXISTS merchant VARCHAR(255)",
+    "ALTER TABLE bill_data ADD COLUMN IF NOT EXISTS total NUMERIC(12, 2)",
+    "ALTER TABLE bill_data ADD COLUMN IF NOT EXISTS bill_date DATE",
+    "ALTER TABLE bill_data ADD COLUMN IF NOT EXISTS item_count INTEGER",
+    "CREATE INDEX IF NOT EXISTS ix_bill_data_user_created ON bill_data (user_id, created_at DESC, id DESC)",
+    # Summaries for rows written before the summary columns existed (only touches unfilled rows)
+    r"""
+    UPDATE bill_data SET
+        merchant = left(NULLIF(btrim(bill_json->'bill_data'->>'merchant'), ''), 255),
+        -- Totals that don't fit NUMERIC(12, 2) (OCR noise) become NULL, as in bill_summary.parse_amount
+        total = CASE WHEN bill_json->'bill_data'->>'total' ~ '^-?[0-9]{1,10}(\.[0-9]+)?$'
+                     THEN CASE WHEN abs((bill_json->'bill_data'->>'total')::numeric) < 9999999999.995
+                               THEN round((bill_json->'bill_data'->>'total')::numeric, 2) END END,
+        item_count = CASE WHEN jsonb_typeof(bill_json->'bill_data'->'items') = 'array'
+                          THEN jsonb_array_length(bill_json->'bill_data'->'items') ELSE 0 END
+    WHERE item_count IS NULL
+    """,
+    "ALTER TABLE bill_data ALTER COLUMN item_count SET DEFAULT 0",
+    "ALTER TABLE bill_data ALTER COLUMN item_count SET NOT NULL",
+    # Search (GET /bills/search)
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE EXTENSION IF NOT EXISTS btree_gin",
+    "ALTER TABLE bill_data ADD COLUMN IF NOT EXISTS search_text TEXT",
+    """
+    ALTER TABLE bill_data ADD COLUMN IF NOT EXISTS search_vector TSVECTOR
+        GENERATED ALWAYS AS (to_tsvector('simple', coalesce(search_text, ''))) STORED
+    """,
+    """
+    UPDATE bill_data b SET search_text = NULLIF(concat_ws(' ', b.merchant, (
+        SELECT string_agg(item->>'name', ' ')
+        FROM jsonb_array_elements(
+            CASE WHEN jsonb_typeof(b.bill_json->'bill_data'->'items') = 'array'
+                 THEN b.bill_json->'bill_data'->'items' ELSE '[]'::jsonb END
+        ) AS item
+    )), '')
+    WHERE b.search_text IS NULL
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_bill_data_search_vector ON bill_data USING gin (user_id, search_vector)",
+    "CREATE INDEX IF NOT EXISTS ix_bill_data_search_trgm ON bill_data USING gin (user_id, search_text gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_bill_data_json_path ON bill_data USING gin (bill_json jsonb_path_ops)",
+]
+
+async def backfill_bill_dates(conn):
+    """
+    Fill bill_date from the stored receipt date with the parser the worker
+    uses (bill_summary.parse_bill_date), so old and new rows read
+    ambiguous dates the same way. Dates it can't parse stay NULL.
+    """
+    select = text("""
+        SELECT id, bill_json->'bill_data'->>'date' FROM bill_data
+        WHERE bill_date IS NULL AND bill_json->'bill_data'->>'date' IS NOT NULL AND id > :after
+        ORDER BY id LIMIT :limit
+    """)
+    update = text("UPDATE bill_data SET bill_date = :bill_date WHERE id = :id").bindparams(
+        bindparam("bill_date", type_=Date)
+    )
+    after = 0
+    while True:
+        rows = (await conn.execute(select, {"after": after, "limit": BILL_DATE_BACKFILL_BATCH})).all()
+        if not rows:
+            break
+        after = rows[-1][0]
+        parsed = [{"id": row_id, "bill_date": parse_bill_date(raw)} for row_id, raw in rows]
+        parsed = [row for row in parsed if row["bill_date"]]
+        if parsed:
+            await conn.execute(update, parsed)
+
 async def create_tables():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        for statement in SCHEMA_UPGRADES:
+            await conn.execute(text(statement))
+        await backfill_bill_dates(conn)
 
 if __name__ == "__main__":
     asyncio.run(create_tables())
@@ -0,0 +1,40 @@
+"""
+Fast JSON encoding shared by the API, the Celery workers and the Redis caches.
+
+Everything that serializes bill payloads or progress messages goes through
+orjson here instead of the stdlib json module, so large bills with hundreds
+of items are encoded several times faster and in one place. It has no web
+dependencies, so workers and CLI tools can use it without FastAPI; the
+response class lives in responses.py.
+"""
+
+from decimal import Decimal
+
+import orjson
+
+
+JSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+
+def _default(obj):
+    """Types orjson doesn't encode natively"""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj) -> bytes:
+    """Serialize to UTF-8 JSON bytes"""
+    return orjson.dumps(obj, default=_default, option=JSON_OPTIONS)
+
+
+def dumps_str(obj) -> str:
+    """Serialize to a JSON string (for Redis values and psycopg2 Json adapters)"""
+    return dumps(obj).decode("utf-8")
+
+
+def loads(data):
+    """Parse JSON from bytes or str"""
+    return orjson.loads(data)
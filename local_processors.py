@@ -0,0 +1,340 @@
+"""
+BillProcessor backends that don't call Gemini.
+
+- fixture: replays extractions saved in data/processed_bills (or a
+  bill_archive.py .bpack) by the SHA-256 of the image, with simulated
+  latency. batch_process.py records the hash of each original image file
+  and passes it back in, so its re-encoded images still match. An image
+  without a saved extraction gets one of the samples, picked
+  deterministically from its hash (or an error with FIXTURE_STRICT=true).
+  With SPLIT_BACKEND=fixture the split stage replays the split_result
+  saved with the same bill_data (an equal split for other bills), so the
+  whole pipeline runs with no API key or network: offline load tests and
+  local development.
+- ocr: Tesseract plus a rule-based receipt parser. Less accurate than the
+  model, but keeps extraction working while Gemini is unavailable (e.g.
+  as VISION_FALLBACK_BACKEND=ocr). Needs pytesseract and the tesseract
+  binary.
+
+Select one with VISION_BACKEND (see create_bill_processor in
+bill_splitting_agent.py).
+"""
+
+import copy
+import glob
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from bill_splitting_agent import (
+    BillData, BillProcessor, CloudStorageManager, Config, SplitResult, extraction_problems, register_processor,
+)
+from receipt_tiling import merge_bands, split_pages
+
+
+# Narrower images are upscaled before OCR (Tesseract wants ~300 dpi text)
+OCR_MIN_WIDTH = int(os.getenv("OCR_MIN_WIDTH", "1200"))
+# One column of text of varying sizes, with the spacing between columns kept
+TESSERACT_CONFIG = "--psm 4 -c preserve_interword_spaces=1"
+
+
+# ============================================================================
+# FIXTURE BACKEND
+# ============================================================================
+
+def fixture_docs(source: str) -> List[Dict]:
+    """Saved bill documents from a processed_bills directory or a .bpack archive, by bill_id"""
+    if os.path.isfile(source):
+        from bill_archive import iter_bills
+        docs = list(iter_bills(source))
+    else:
+        docs = []
+        for path in glob.glob(os.path.join(source, "*.json")):
+            with open(path) as f:
+                docs.append(json.load(f))
+    return sorted(docs, key=lambda d: str(d.get("bill_id")))
+
+
+def bill_key(bill_data: Dict) -> str:
+    """Identifies an extraction by content, so a replayed bill finds its saved split"""
+    return hashlib.sha256(json.dumps(bill_data, sort_keys=True).encode()).hexdigest()
+
+
+def load_fixtures(source: str) -> Tuple[Dict[str, Dict], List[Dict]]:
+    """Saved extractions: those keyed by image hash, and all of them ordered by bill_id"""
+    by_hash, samples = {}, []
+    for doc in fixture_docs(source):
+        bill_data = doc.get("bill_data")
+        if not isinstance(bill_data, dict) or not bill_data.get("items"):
+            continue
+        samples.append(bill_data)
+        if doc.get("content_hash"):
+            by_hash[doc["content_hash"]] = bill_data
+    return by_hash, samples
+
+
+@register_processor("fixture")
+class FixtureBillProcessor(BillProcessor):
+    """Replays saved extractions by image hash; deterministic, no API calls"""
+
+    def __init__(self, config: Config, storage_manager: Optional[CloudStorageManager] = None):
+        self.config = config
+        self.storage_manager = storage_manager
+        self.by_hash, self.samples = load_fixtures(config.fixture_source)
+        if not self.samples:
+            raise ValueError(f"No saved bills to replay in {config.fixture_source}")
+        print(f"🧪 Fixture backend: {len(self.samples)} saved bills ({len(self.by_hash)} by image hash)")
+
+    def process(self, image_path: str) -> BillData:
+        with open(image_path, "rb") as f:
+            content = f.read()
+        return self.process_bytes(content, os.path.basename(image_path))
+
+    def process_bytes(self, content: bytes, filename: str, gcs_uri: Optional[str] = None,
+                      page_heights: Optional[List[int]] = None, content_hash: Optional[str] = None) -> BillData:
+        """
+        The saved extraction for this image, after the simulated latency.
+        Looked up by content_hash (the original upload's) when the caller
+        passes re-encoded bytes, as batch_process.py does.
+        """
+        if gcs_uri is None and self.storage_manager:
+            gcs_uri = self.storage_manager.upload_bytes(content, filename)
+
+        content_hash = content_hash or hashlib.sha256(content).hexdigest()
+        raw_data = self.by_hash.get(content_hash)
+        if raw_data is None:
+            if self.config.fixture_strict:
+                raise ValueError(f"No saved extraction for image {content_hash[:12]}")
+            raw_data = self.samples[int(content_hash[:16], 16) % len(self.samples)]
+
+        time.sleep(self.latency(content_hash))
+        return BillData(copy.deepcopy(raw_data), gcs_uri=gcs_uri)
+
+    def latency(self, content_hash: str) -> float:
+        """Seconds to wait for this image: FIXTURE_LATENCY_MS +/- jitter, the same on every run"""
+        jitter = self.config.fixture_latency_jitter_ms
+        millis = self.config.fixture_latency_ms + random.Random(content_hash).uniform(-jitter, jitter)
+        return max(0.0, millis / 1000)
+
+
+class FixtureExpenseSplitter:
+    """
+    Stand-in for ExpenseSplitter (SPLIT_BACKEND=fixture): replays the
+    split_result saved with the same bill_data, or splits the total equally
+    between FIXTURE_SPLIT_PEOPLE people, after FIXTURE_SPLIT_LATENCY_MS.
+    """
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.splits = {}
+        for doc in fixture_docs(config.fixture_source):
+            if isinstance(doc.get("bill_data"), dict) and isinstance(doc.get("split_result"), dict):
+                self.splits[bill_key(doc["bill_data"])] = doc["split_result"]
+        print(f"🧪 Fixture splitter: {len(self.splits)} saved splits")
+
+    def split(self, bill_data: BillData, instruction: str, llm=None) -> SplitResult:
+        saved = self.splits.get(bill_key(bill_data.raw_data))
+        if saved is None and self.config.fixture_strict:
+            raise ValueError("No saved split for this bill")
+        time.sleep(self.config.fixture_split_latency_ms / 1000)
+        return SplitResult(copy.deepcopy(saved) if saved is not None else self.equal_split(bill_data))
+
+    def equal_split(self, bill_data: BillData) -> Dict:
+        """The total shared equally, the odd cents going to the first people"""
+        people = max(1, self.config.fixture_split_people)
+        total_cents = round(float(bill_data.total or 0) * 100)
+        share, extra = divmod(total_cents, people)
+        breakdown = []
+        for n in range(people):
+            cents = share + (1 if n < extra else 0)
+            breakdown.append({"person": f"Person {n + 1}", "items": [], "subtotal": cents / 100,
+                              "tax_share": 0.0, "total": cents / 100})
+        return {
+            "split_type": "equal",
+            "breakdown": breakdown,
+            "verification": {"sum": total_cents / 100, "bill_total": total_cents / 100},
+        }
+
+
+# ============================================================================
+# RECEIPT TEXT PARSER
+# ============================================================================
+
+AMOUNT = re.compile(
+    r"(?P<label>.*?)\s*(?P<sign>-)?\s*[$€£₹]?\s*"
+    r"(?P<amount>\d{1,3}(?:,\d{3})+\.\d{2}|\d+[.,]\d{2})(?P<trailing_sign>-)?"
+    r"\s*(?:[A-Z]{1,2}|\*)?$"  # tax code some tills print after the price
+)
+QTY_FIRST = re.compile(r"^(?P<qty>\d{1,3})\s*[xX@*]\s+(?P<name>.*[A-Za-z].*)$")
+QTY_AT_PRICE = re.compile(r"^(?P<name>.*[A-Za-z].*?)\s+(?P<qty>\d{1,3})\s*[xX@*]\s*[$€£₹]?(?P<unit>\d+[.,]\d{2})$")
+QTY_RATE = re.compile(r"^(?P<name>.*[A-Za-z].*?)\s+(?P<qty>\d{1,3}(?:\.\d+)?)\s+[$€£₹]?(?P<unit>\d+[.,]\d{2})$")
+RATE_QTY = re.compile(r"^(?P<name>.*[A-Za-z].*?)\s+[$€£₹]?(?P<unit>\d+[.,]\d{2})\s+(?P<qty>\d{1,3})$")
+
+SUBTOTAL = re.compile(r"\bsub\s*-?\s*tot", re.I)
+TAX = re.compile(r"\b(tax|vat|gst|cgst|sgst|igst|hst|pst)\b", re.I)
+TIP = re.compile(r"\b(tip|gratuity|service\s*(charge|chg|fee))\b", re.I)
+TOTAL = re.compile(r"\b(total|amount\s*(due|payable)|balance\s*due|net\s*(amount|payable))\b", re.I)
+PAYMENT = re.compile(
+    r"\b(cash|change|card|visa|master\s*card|amex|debit|credit|tender(ed)?|paid|payment|upi|"
+    r"sav(ed|ings?)|round(ed)?\s*off|points|balance)\b", re.I
+)
+DISCOUNT = re.compile(r"\b(discount|coupon|promo)\b|(?<!round )\boff\b", re.I)
+
+MONTH = r"(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?"
+DATE = re.compile(
+    rf"\b(\d{{4}}-\d{{2}}-\d{{2}}|\d{{1,2}}[/.-]\d{{1,2}}[/.-]\d{{2,4}}|"
+    rf"\d{{1,2}}\s+{MONTH},?\s+\d{{2,4}}|{MONTH}\s+\d{{1,2}},?\s+\d{{4}})",
+    re.I
+)
+TIME = re.compile(r"\b\d{1,2}:\d{2}(?::\d{2})?(?:\s*[ap]\.?m\.?)?", re.I)
+NOT_MERCHANT = re.compile(r"\b(receipt|invoice|bill|welcome|tel|phone|gstin|order|table|cashier)\b", re.I)
+
+
+def to_amount(text: str) -> float:
+    if "," in text and "." not in text:
+        text = text.replace(",", ".")  # decimal comma
+    return float(text.replace(",", ""))
+
+
+def parse_item(label: str, total: float) -> Dict:
+    """An item line's name and quantity; the quantity is only trusted if it multiplies out"""
+    label = re.sub(r"^\d{5,}\s+", "", label)  # SKU / barcode column
+    label = label.strip(" .:-*")
+
+    match = QTY_FIRST.match(label)
+    if match and int(match["qty"]):
+        qty = int(match["qty"])
+        return {"name": match["name"].strip(), "quantity": qty, "unit_price": round(total / qty, 2), "total": total}
+
+    for pattern in (QTY_AT_PRICE, QTY_RATE, RATE_QTY):
+        match = pattern.match(label)
+        if match:
+            qty, unit = float(match["qty"]), to_amount(match["unit"])
+            if qty and abs(qty * unit - abs(total)) <= 0.02:
+                qty = int(qty) if qty.is_integer() else qty
+                return {"name": match["name"].strip(" .:-*"), "quantity": qty, "unit_price": unit, "total": total}
+
+    return {"name": label, "quantity": 1, "unit_price": total, "total": total}
+
+
+def parse_receipt_text(text: str) -> Dict:
+    """
+    Rule-based receipt parser for OCR text. Lines ending in an amount are
+    items until the first subtotal/tax/total line; after that only the
+    subtotal, tax, tip and total lines are read. Only what is printed is
+    returned (see complete_bill for the missing fields).
+    """
+    data: Dict = {"items": []}
+    totals: List[float] = []
+    in_totals = False
+
+    lines = [re.sub(r"\s+", " ", line).strip() for line in text.splitlines()]
+    lines = [line for line in lines if line]
+    for position, line in enumerate(lines):
+        if "date" not in data:
+            date = DATE.search(line)
+            if date:
+                clock = TIME.search(line, date.end())
+                data["date"] = f"{date[0]} {clock[0]}" if clock else date[0]
+
+        match = AMOUNT.match(line)
+        if not match:
+            if "merchant" not in data and position < 6 and not data["items"] and not DATE.search(line) \
+                    and len(re.findall(r"[A-Za-z]", line)) >= 3 and not NOT_MERCHANT.search(line):
+                data["merchant"] = line
+            continue
+
+        label = match["label"].strip()
+        amount = to_amount(match["amount"])
+        if match["sign"] or match["trailing_sign"]:
+            amount = -amount
+
+        if SUBTOTAL.search(label):
+            in_totals = True
+            data.setdefault("subtotal", amount)
+        elif TAX.search(label) and not re.search(r"\bincl", label, re.I):
+            in_totals = True
+            data["tax"] = round(data.get("tax", 0) + amount, 2)
+        elif TIP.search(label):
+            data["tip"] = round(data.get("tip", 0) + amount, 2)
+        elif TOTAL.search(label):
+            in_totals = True
+            totals.append(amount)
+        elif in_totals or not re.search(r"[A-Za-z]", label):
+            continue
+        elif DISCOUNT.search(label):
+            data["items"].append(parse_item(label, -abs(amount)))
+        elif not PAYMENT.search(label):
+            data["items"].append(parse_item(label, amount))
+
+    if totals:
+        data["total"] = max(totals)  # e.g. "TOTAL" above "TOTAL SAVINGS"
+    return data
+
+
+def complete_bill(data: Dict) -> Dict:
+    """Fill in what the receipt didn't print and flag bills that don't add up"""
+    if not data["items"]:
+        data["error"] = "no line items found in the OCR text"
+    data.setdefault("merchant", None)
+    data.setdefault("date", None)
+    data.setdefault("subtotal", round(sum(item["total"] for item in data["items"]), 2))
+    data.setdefault("tax", 0.0)
+    data.setdefault("tip", 0.0)
+    data.setdefault("total", round(data["subtotal"] + data["tax"] + data["tip"], 2))
+
+    problems = extraction_problems(data)
+    if problems:
+        data["extraction_warnings"] = problems
+    return data
+
+
+# ============================================================================
+# OCR BACKEND
+# ============================================================================
+
+@register_processor("ocr")
+class TesseractBillProcessor(BillProcessor):
+    """Local OCR with Tesseract and the rule-based parser above"""
+
+    def __init__(self, config: Config, storage_manager: Optional[CloudStorageManager] = None):
+        try:
+            import pytesseract
+        except ImportError:
+            raise RuntimeError("The ocr backend needs pytesseract and the tesseract binary installed")
+        if config.tesseract_cmd:
+            pytesseract.pytesseract.tesseract_cmd = config.tesseract_cmd
+        self.pytesseract = pytesseract
+        self.config = config
+        self.storage_manager = storage_manager
+
+    def process(self, image_path: str) -> BillData:
+        with open(image_path, "rb") as f:
+            content = f.read()
+        return self.process_bytes(content, os.path.basename(image_path))
+
+    def process_bytes(self, content: bytes, filename: str, gcs_uri: Optional[str] = None,
+                      page_heights: Optional[List[int]] = None, content_hash: Optional[str] = None) -> BillData:
+        """OCR each photo of the receipt and parse the text; photos' overlapping lines are kept once"""
+        if gcs_uri is None and self.storage_manager:
+            gcs_uri = self.storage_manager.upload_bytes(content, filename)
+
+        with Image.open(io.BytesIO(content)) as img:
+            pages = split_pages(ImageOps.exif_transpose(img), page_heights)
+            parsed = [parse_receipt_text(self.read_text(page)) for page in pages]
+        raw_data = parsed[0] if len(parsed) == 1 else merge_bands(parsed)
+        return BillData(complete_bill(raw_data), gcs_uri=gcs_uri)
+
+    def read_text(self, img: Image.Image) -> str:
+        """Tesseract on a grayscale, contrast-stretched copy, upscaled if small"""
+        gray = ImageOps.autocontrast(img.convert("L"))
+        if gray.width < OCR_MIN_WIDTH:
+            gray = gray.resize((OCR_MIN_WIDTH, round(gray.height * OCR_MIN_WIDTH / gray.width)), Image.LANCZOS)
+        return self.pytesseract.image_to_string(gray, lang=self.config.ocr_lang, config=TESSERACT_CONFIG)
@@ -1,43 +1,96 @@
-from fastapi import FastAPI, File, Form, UploadFile, Depends, WebSocket, WebSocketDisconnect
-from fastapi.responses import JSONResponse, FileResponse, Response
+import time
+PROCESS_STARTED_AT = time.time()  # baseline for the worker cold-start metric
+
+from fastapi import FastAPI, File, Form, UploadFile, Depends, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.encoders import jsonable_encoder
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy import tuple_, or_, func, literal, text
 
-import tempfile
 import os
-import json
 import uuid
 import re
+import base64
+from datetime import datetime, date
 from pathlib import Path
+from typing import List, Optional
 from dotenv import load_dotenv
-from google.cloud import storage
 
 # Existing imports
-from bill_splitting_agent import BillSplitSystem
-from models import BillData
-from database import AsyncSessionLocal
+from bill_splitting_agent import BillSplitSystem, BillData as ParsedBill
+from models import BillData, SpendMonthly, SpendMerchant, SpendItem, SpendGroup, SpendPerson
+from database import AsyncSessionLocal, engine, pool_stats
 
 # NEW: RabbitMQ and Redis imports
 from celery import Celery
+from celery.signals import (
+    before_task_publish,
+    task_prerun,
+    task_postrun,
+    worker_init,
+    worker_process_init,
+    worker_process_shutdown,
+    worker_shutdown,
+)
 from redis import Redis
 import asyncio
 
-from auth import router as auth_router
+from task_queues import (
+    PRIORITY_INTERACTIVE,
+    configure_queues,
+    queue_stats,
+    record_completion,
+    record_wait_time,
+    resolve_priority,
+    stamp_enqueue_time,
+)
+
+from auth import router as auth_router, get_optional_user, get_current_user, resolve_user_id
+from admission import AdmissionController, INFLIGHT_RETRY_AFTER_SECONDS, release_inflight
+from task_registry import TaskRegistry, idempotency_key, STATE_COMPLETED, STATE_FAILED
+from worker_db import init_worker_db, close_worker_db, get_bill_writer
+from metrics import sample_stats, rate_per_minute
+from worker_warmup import warm_up_worker, mark_not_ready, is_prefork, stop_cold_worker
+from upload_handoff import create_upload_handoff, UPLOADS_DIR
+from upload_stream import stream_upload, UploadRejected, RequestSizeLimit, MAX_UPLOAD_BYTES, MULTIPART_OVERHEAD_BYTES
+from receipt_tiling import MAX_RECEIPT_PAGES, stitch_uploads, stitched_filename
+from bill_dedup import BillDedupIndex
+from json_codec import dumps, loads
+from responses import ORJSONResponse
+from bill_images import parse_gcs_uri, stat_image, image_response, run_gcs, etag_matches
+from bill_export import EXPORT_BATCH_ROWS, EXPORT_FORMATS, EXPORT_MEDIA_TYPES, ExportEncoder, export_query, is_export_admin
+from bill_cache import BillCache, CachedBill, BILL_CACHE_CONTROL, bill_payload
+from signed_urls import SignedUrlCache, redirect_mode, sign_image_url
+from image_cache import (
+    IMAGE_CACHE_ENABLED,
+    ThumbnailUnavailable,
+    cached_original,
+    cached_thumbnail,
+    thumbnail_width,
+)
+from google.api_core.exceptions import NotFound
 
 
 
 # Load environment variables
 load_dotenv()
 
-app = FastAPI(title="Bill Splitting API", version="1.0")
+app = FastAPI(title="Bill Splitting API", version="1.0", default_response_class=ORJSONResponse)
 
 # Folders
 DATA_DIR = Path("data/processed_bills")
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
-# CORS
+# Refuse oversized uploads before Starlette spools the form: every photo of a receipt at the per-file limit
+app.add_middleware(
+    RequestSizeLimit,
+    max_bytes=MAX_UPLOAD_BYTES * MAX_RECEIPT_PAGES + MULTIPART_OVERHEAD_BYTES,
+    paths=("/process-bill",),
+)
+
+# CORS (added last so it wraps every response, 413s included)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:5173"],
@@ -60,6 +113,9 @@ system = BillSplitSystem(
     gcs_bucket_name='uploaded_bills'
 )
 
+# How uploads get from the API to the workers (local disk / Redis / GCS)
+upload_handoff = create_upload_handoff(system)
+
 # ============ NEW: Celery + Redis Configuration ============
 
 # Celery app for async task queue
@@ -84,209 +140,567 @@ celery_app.conf.update(
     enable_utc=True,
     broker_heartbeat=60,  
     broker_heartbeat_checkrate=2,  
+    # Give worker_process_init enough time for the warm-up below
+    worker_proc_alive_timeout=60,
 )
 
+# Dedicated queues per pipeline stage (vision / split / db_write) with priorities
+configure_queues(celery_app)
+
 # Redis client for progress tracking
 # redis_client = Redis(host='localhost', port=6379, decode_responses=True) #changed to below for docker compatibility
 
 redis_client = Redis(host="redis", port=6379, decode_responses=True)
 
+# Admission control for /process-bill (queue backlog bound + per-user in-flight limit)
+admission = AdmissionController(celery_app, redis_client)
 
+# bill_id -> task state/stage/result, plus upload idempotency keys
+task_registry = TaskRegistry(redis_client)
 
-# ============ NEW: Celery Background Task ============
+# (image hash, instruction) -> already processed bill_id
+dedup_index = BillDedupIndex(redis_client)
 
-@celery_app.task(bind=True)
+# bill_id -> signed image URL (IMAGE_DELIVERY_MODE=redirect)
+signed_url_cache = SignedUrlCache(redis_client)
 
+# bill_id -> serialized GET /bill/{bill_id} body + ETag
+bill_cache = BillCache(redis_client)
 
-def process_bill_async(self, bill_id: str, temp_file_path: str, instruction: str):
+
+
+# ============ NEW: Celery Background Tasks (one per pipeline stage) ============
+
+def publish_progress(bill_id: str, stage: str, message: str, progress: int):
+    """Publish progress to Redis for WebSocket and record it in the task registry"""
+    task_registry.update_stage(bill_id, stage, message, progress)
+    redis_client.publish(
+        f'bill_progress:{bill_id}',
+        dumps({
+            "stage": stage,
+            "message": message,
+            "progress": progress
+        })
+    )
+
+
+@before_task_publish.connect
+def stamp_task_enqueue_time(headers=None, **kwargs):
+    """Tag every outgoing task with its publish time for queue wait metrics"""
+    stamp_enqueue_time(headers)
+
+
+@task_prerun.connect
+def track_task_queue_wait(task=None, **kwargs):
+    """Record how long the task waited in its queue before a worker picked it up"""
+    try:
+        record_wait_time(redis_client, task)
+    except Exception as e:
+        print(f"⚠️ Could not record queue wait time: {e}")
+
+
+@task_postrun.connect
+def track_task_completion(task=None, **kwargs):
+    """Count the finished task towards its queue's throughput"""
+    try:
+        record_completion(redis_client, task)
+    except Exception as e:
+        print(f"⚠️ Could not record task completion: {e}")
+
+
+@worker_init.connect
+def warm_up_worker_main_process(sender=None, **kwargs):
+    """Warm up thread/gevent/solo workers, which run tasks in the main process"""
+    if not is_prefork(sender):
+        if warm_up_worker(system, redis_client, PROCESS_STARTED_AT) is None:
+            stop_cold_worker()
+
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    """Open this worker process's database pool once, not per task, and warm up"""
+    forked_at = time.time()
+    init_worker_db(redis_client)
+    if warm_up_worker(system, redis_client, forked_at) is None:
+        stop_cold_worker(child=True)
+
+
+@worker_process_shutdown.connect
+def shutdown_worker_process(**kwargs):
+    """Flush pending batched writes and close pooled connections"""
+    mark_not_ready(redis_client, remove_ready_file=False)
+    close_worker_db()
+
+
+@worker_shutdown.connect
+def shutdown_worker_main_process(**kwargs):
+    """Same cleanup for workers without child processes"""
+    mark_not_ready(redis_client)
+    close_worker_db()
+
+
+@celery_app.task(bind=True)
+def process_bill_async(self, bill_id: str, upload_handle: str, filename: str, instruction: str,
+                       priority: int = PRIORITY_INTERACTIVE, content_hash: Optional[str] = None,
+                       user_id: Optional[int] = None, page_heights: Optional[List[int]] = None):
     """
-    Celery task to process bill in the background with detailed progress updates.
+    Vision stage: upload the bill image and extract structured data with Gemini.
+    The image bytes are read through the upload handoff, not a shared path;
+    page_heights is set when the image was stitched from several photos.
+    Hands off to the split stage on the 'split' queue.
     """
-    import time
-    import psycopg2
-    from psycopg2.extras import Json
-    import os
-    
-    def publish_progress(stage, message, progress):
-        """Publish progress to Redis for WebSocket"""
-        redis_client.publish(
-            f'bill_progress:{bill_id}',
-            json.dumps({
-                "stage": stage,
-                "message": message,
-                "progress": progress
-            })
-        )
-    
+    # A handed-off GCS object becomes the bill's stored image once extracted
+    stored = False
     try:
         # Step 1: Upload preparation
-        publish_progress('uploading', 'Preparing file for upload...', 5)
-        # time.sleep(1)
-        
-        publish_progress('uploading', 'Connecting to Google Cloud Storage...', 10)
-        # time.sleep(1)
-        
-        publish_progress('uploading', 'Uploading bill image...', 15)
-        # time.sleep(1.5)
-        
-        publish_progress('uploading', 'Upload complete! Starting OCR...', 20)
-        # time.sleep(0.5)
-        
+        publish_progress(bill_id, 'uploading', 'Preparing file for upload...', 5)
+        publish_progress(bill_id, 'uploading', 'Connecting to Google Cloud Storage...', 10)
+        publish_progress(bill_id, 'uploading', 'Uploading bill image...', 15)
+        publish_progress(bill_id, 'uploading', 'Upload complete! Starting OCR...', 20)
+
         # Step 2: OCR Processing
-        publish_progress('ocr', 'Initializing OCR engine...', 25)
-        # time.sleep(1)
-        
-        publish_progress('ocr', 'Scanning bill image...', 30)
-        # time.sleep(1)
-        
-        publish_progress('ocr', 'Extracting text from bill...', 40)
-        # time.sleep(1)
-        
-        # Process bill (actual AI work happens here)
-        bill_data, split_result = system.process_and_split(temp_file_path, instruction)
-        
+        publish_progress(bill_id, 'ocr', 'Initializing OCR engine...', 25)
+        publish_progress(bill_id, 'ocr', 'Scanning bill image...', 30)
+        publish_progress(bill_id, 'ocr', 'Extracting text from bill...', 40)
+
+        # Extract bill data from image (uploading to GCS unless the handoff already did)
+        content = upload_handoff.get(upload_handle)
+        bill_data = system.bill_processor.process_bytes(
+            content,
+            f"{bill_id}_{filename}",
+            gcs_uri=upload_handoff.storage_uri(upload_handle),
+            page_heights=page_heights,
+            content_hash=content_hash,
+        )
+
         # Get item count
         item_count = len(bill_data.raw_data.get('items', []))
-        publish_progress('ocr', f'Found {item_count} line items on bill', 50)
-        # time.sleep(1)
-        
-        publish_progress('ocr', 'Parsing prices and totals...', 55)
-        # time.sleep(1)
-        
+        publish_progress(bill_id, 'ocr', f'Found {item_count} line items on bill', 50)
+        publish_progress(bill_id, 'ocr', 'Parsing prices and totals...', 55)
+
+        # Queue the split stage
+        split_bill_async.apply_async(
+            args=(bill_id, bill_data.raw_data, bill_data.gcs_uri, instruction),
+            kwargs={"priority": priority, "content_hash": content_hash, "user_id": user_id},
+            priority=priority,
+        )
+        stored = bill_data.gcs_uri is not None and bill_data.gcs_uri == upload_handoff.storage_uri(upload_handle)
+
+        return {
+            "bill_id": bill_id,
+            "status": "extracted",
+            "file_name": bill_data.gcs_uri
+        }
+
+    except Exception as e:
+        publish_progress(bill_id, 'error', f'Error: {str(e)}', 0)
+        release_inflight(redis_client, bill_id)
+        raise e
+
+    finally:
+        # Release the handed-off upload, unless it is now the stored image
+        if not stored:
+            upload_handoff.discard(upload_handle)
+
+
+@celery_app.task(bind=True)
+def split_bill_async(self, bill_id: str, raw_bill: dict, file_name: str, instruction: str,
+                     priority: int = PRIORITY_INTERACTIVE, content_hash: Optional[str] = None,
+                     user_id: Optional[int] = None):
+    """
+    Split stage: run the expense splitting agent on already-extracted bill data.
+    Used both after extraction and for re-splits of stored bills.
+    """
+    try:
         # Step 3: Bill Splitting
-        publish_progress('splitting', 'Analyzing bill structure...', 60)
-        # time.sleep(1)
-        
+        publish_progress(bill_id, 'splitting', 'Analyzing bill structure...', 60)
+
+        bill_data = ParsedBill(raw_bill, gcs_uri=file_name)
+        split_result = system.expense_splitter.split(bill_data, instruction)
+
         person_count = len(split_result.raw_data.get('breakdown', []))
-        publish_progress('splitting', f'Calculating split for {person_count} people...', 65)
-        # time.sleep(1)
-        
+        publish_progress(bill_id, 'splitting', f'Calculating split for {person_count} people...', 65)
+
         # Get per-person amount
         if person_count > 0:
             per_person = split_result.raw_data['breakdown'][0].get('total', 0)
-            publish_progress('splitting', f'Each person owes ${per_person:.2f}', 70)
+            publish_progress(bill_id, 'splitting', f'Each person owes ${per_person:.2f}', 70)
         else:
-            publish_progress('splitting', 'Calculating amounts...', 70)
-        # time.sleep(1)
-        
-        publish_progress('splitting', 'Applying tax and tip distribution...', 75)
-        # time.sleep(1)
-        
-        publish_progress('splitting', 'Verifying calculations...', 80)
-        # time.sleep(1)
-        
-        # Step 4: Saving to Database Only
-        publish_progress('saving', 'Preparing data for storage...', 85)
-        # time.sleep(0.5)
-        
-        publish_progress('saving', 'Connecting to database...', 88)
-        # time.sleep(0.5)
-        
-        publish_progress('saving', 'Writing to database...', 92)
-        
-        # Save to PostgreSQL using psycopg2 (sync)
-        database_url = os.getenv("DATABASE_URL")
-        conn = psycopg2.connect(database_url.replace('+asyncpg', ''))
-        cur = conn.cursor()
-        
-        # Insert data
+            publish_progress(bill_id, 'splitting', 'Calculating amounts...', 70)
+
+        publish_progress(bill_id, 'splitting', 'Applying tax and tip distribution...', 75)
+        publish_progress(bill_id, 'splitting', 'Verifying calculations...', 80)
+
+        # Queue the persistence stage
         bill_json = {
             "bill_data": bill_data.raw_data,
             "split_result": split_result.raw_data
         }
-        
-        cur.execute(
-            """
-            INSERT INTO bill_data (bill_id, file_name, bill_json)
-            VALUES (%s, %s, %s)
-            ON CONFLICT (bill_id) DO UPDATE
-            SET file_name = EXCLUDED.file_name,
-                bill_json = EXCLUDED.bill_json
-            """,
-            (bill_id, bill_data.gcs_uri, Json(bill_json))
+        persist_bill_async.apply_async(
+            args=(bill_id, file_name, bill_json),
+            kwargs={"content_hash": content_hash, "instruction": instruction, "user_id": user_id},
+            priority=priority,
         )
-        
-        conn.commit()
-        cur.close()
-        conn.close()
-        
-        # time.sleep(1)
-        
-        publish_progress('saving', 'Finalizing...', 96)
-        # time.sleep(0.5)
-        
-        # Clean up temp file
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
-        
-        publish_progress('completed', 'Bill processed successfully!', 100)
-        
+
+        return {
+            "bill_id": bill_id,
+            "status": "split",
+            "file_name": file_name
+        }
+
+    except Exception as e:
+        publish_progress(bill_id, 'error', f'Error: {str(e)}', 0)
+        release_inflight(redis_client, bill_id)
+        raise e
+
+
+@celery_app.task(bind=True)
+def persist_bill_async(self, bill_id: str, file_name: str, bill_json: dict,
+                       content_hash: Optional[str] = None, instruction: Optional[str] = None,
+                       user_id: Optional[int] = None):
+    """
+    Persistence stage: upsert the processed bill into PostgreSQL.
+    Writes from concurrent tasks are coalesced into multi-row upserts on a
+    pooled connection (see worker_db.py).
+    """
+    try:
+        # Step 4: Saving to Database Only
+        publish_progress(bill_id, 'saving', 'Preparing data for storage...', 85)
+        publish_progress(bill_id, 'saving', 'Writing to database...', 92)
+
+        # Serialize the GET /bill/{bill_id} body once; it's stored with the row and cached
+        response = CachedBill.from_payload(bill_payload(bill_id, file_name, bill_json))
+
+        # Blocks until the batch containing this bill is committed
+        get_bill_writer(redis_client).write(
+            bill_id, file_name, bill_json, content_hash, instruction,
+            response_body=response.body, user_id=user_id
+        )
+
+        # Identical future uploads can now skip the pipeline entirely
+        if content_hash and instruction:
+            dedup_index.remember(content_hash, instruction, bill_id, user_id)
+
+        # The frontend's next poll of GET /bill/{bill_id} is served from cache
+        bill_cache.fill(bill_id, response, overwrite=True)
+
+        task_registry.set_result(bill_id, file_name)
+        publish_progress(bill_id, 'saving', 'Finalizing...', 96)
+        publish_progress(bill_id, 'completed', 'Bill processed successfully!', 100)
+        release_inflight(redis_client, bill_id)
+
         return {
             "bill_id": bill_id,
             "status": "completed",
-            "file_name": bill_data.gcs_uri
+            "file_name": file_name
         }
-        
+
     except Exception as e:
-        publish_progress('error', f'Error: {str(e)}', 0)
-        
-        # Clean up temp file on error
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
-        
+        publish_progress(bill_id, 'error', f'Error: {str(e)}', 0)
+        release_inflight(redis_client, bill_id)
         raise e
 
 # ============ MODIFIED: Process Bill Endpoint (Now Async) ============
 
+def admission_rejected(decision) -> ORJSONResponse:
+    """429 response telling the client when to retry"""
+    return ORJSONResponse(
+        status_code=429,
+        headers={"Retry-After": str(decision.retry_after)},
+        content={"error": decision.reason, **decision.to_dict()}
+    )
+
+
+async def attach_to_existing(bill_id: str) -> ORJSONResponse:
+    """Response for a duplicate upload: point the client at the existing bill"""
+    record = await asyncio.to_thread(task_registry.get, bill_id) or {}
+    print(f"🔵 Duplicate upload attached to bill_id: {bill_id}")
+    return ORJSONResponse(content={
+        "message": "Bill already submitted",
+        "bill_id": bill_id,
+        "status": record.get("state", "queued"),
+        "deduplicated": True
+    })
+
+
+async def find_processed_duplicate(db: AsyncSession, content_hash: str, instruction: str,
+                                   user_id: Optional[int] = None):
+    """
+    The user's completed bill with the same image bytes and instruction, if any.
+    Checks the Redis index first and falls back to the indexed content_hash column.
+    """
+    bill = None
+    bill_id = await asyncio.to_thread(dedup_index.lookup, content_hash, instruction, user_id)
+    if bill_id:
+        result = await db.execute(select(BillData).where(BillData.bill_id == bill_id))
+        bill = result.scalars().first()
+        if not bill or bill.content_hash != content_hash or bill.instruction != instruction:
+            # Bill was deleted or re-split with another instruction since it was indexed
+            await asyncio.to_thread(dedup_index.forget, content_hash, instruction, user_id)
+            bill = None
+
+    if bill is None:
+        owner_filter = BillData.user_id == user_id if user_id is not None else BillData.user_id.is_(None)
+        result = await db.execute(
+            select(BillData)
+            .where(BillData.content_hash == content_hash, BillData.instruction == instruction, owner_filter)
+            .order_by(BillData.id.desc())
+            .limit(1)
+        )
+        bill = result.scalars().first()
+        if bill:
+            await asyncio.to_thread(dedup_index.remember, content_hash, instruction, bill.bill_id, user_id)
+
+    await asyncio.to_thread(dedup_index.record_check, hit=bill is not None)
+    return bill
+
+
+def stored_bill_payload(bill: BillData) -> dict:
+    """Public JSON shape of a BillData row"""
+    return bill_payload(bill.bill_id, bill.file_name, bill.bill_json)
+
+
 @app.post("/process-bill")
 async def process_bill(
+    request: Request,
     file: UploadFile = File(...),
     instruction: str = Form(...),
+    priority: str = Form("interactive"),
+    pages: Optional[List[UploadFile]] = File(None),
+    user: Optional[str] = Depends(get_optional_user),
     db: AsyncSession = Depends(get_db)
 ):
     """
     Upload a bill image and queue it for async processing.
     Returns immediately with bill_id. Client can track progress via WebSocket.
+    `priority` is 'interactive' (default) or 'bulk'.
+    A long receipt photographed in parts sends the first photo as `file` and the
+    rest, in order, as `pages`; they are stitched into one bill image.
+    Resubmitting the same image with the same instruction returns the bill_id already in flight.
+    Responds 429 with Retry-After when the backlog or the caller's in-flight limit is exceeded.
     """
+    bill_id = None
+    upload = None
+    upload_handle = None
+    page_uploads = []
+    page_heights = None
     try:
         print(f"🔵 Received file: {file.filename}")
+        pages = [page for page in pages or [] if page.filename]
+        if len(pages) + 1 > MAX_RECEIPT_PAGES:
+            return ORJSONResponse(
+                status_code=400,
+                content={"error": f"A receipt can have at most {MAX_RECEIPT_PAGES} photos"}
+            )
+
+        # Stream to a spool file in chunks: hashes, size-limits and type-checks on the fly
+        try:
+            upload = await stream_upload(file, UPLOADS_DIR)
+            if pages:
+                for page in pages:
+                    page_uploads.append(await stream_upload(page, UPLOADS_DIR))
+                photos = [upload] + page_uploads
+                upload, page_heights = await asyncio.to_thread(stitch_uploads, photos, UPLOADS_DIR)
+                page_uploads = photos
+        except UploadRejected as e:
+            print(f"🟠 Rejected upload {file.filename}: {e.message}")
+            return ORJSONResponse(status_code=e.status_code, content={"error": e.message})
+        filename = file.filename
+        if page_heights:
+            filename = stitched_filename(file.filename)
+            print(f"🔵 Stitched {len(page_heights)} photos into one image")
+        print(f"🔵 Streamed {upload.size} bytes ({upload.content_type}), sha256 {upload.sha256[:12]}")
+
+        # Uploads by signed-in users are owned by them and listed in GET /bills
+        user_id = await resolve_user_id(user)
+
+        # Already processed: return the stored result without queueing anything
+        processed = await find_processed_duplicate(db, upload.sha256, instruction, user_id)
+        if processed:
+            print(f"🔵 Upload deduplicated to bill_id: {processed.bill_id}")
+            return ORJSONResponse(content={
+                "message": "Bill already processed",
+                **stored_bill_payload(processed),
+                "status": "completed",
+                "deduplicated": True
+            })
+
+        # Duplicate submissions attach to the task already in flight
+        upload_key = idempotency_key(upload.sha256, instruction, user_id)
+        existing_bill_id = await asyncio.to_thread(task_registry.find_duplicate, upload_key)
+        if existing_bill_id:
+            return await attach_to_existing(existing_bill_id)
+
+        # Admission control before queueing anything
+        owner = user or f"ip:{request.client.host if request.client else 'unknown'}"
+        decision = await asyncio.to_thread(admission.check, owner)
+        if not decision.admitted:
+            print(f"🟠 Rejected upload from {owner}: {decision.reason}")
+            return admission_rejected(decision)
         
         # Generate unique ID
         bill_id = str(uuid.uuid4())
         print(f"🔵 Generated bill_id: {bill_id}")
+
+        if not await asyncio.to_thread(admission.acquire, owner, bill_id):
+            decision.reason = "Too many bills in progress"
+            decision.retry_after = INFLIGHT_RETRY_AFTER_SECONDS
+            return admission_rejected(decision)
+
+        # Lost a race with an identical concurrent upload
+        existing_bill_id = await asyncio.to_thread(task_registry.claim, upload_key, bill_id)
+        if existing_bill_id:
+            await asyncio.to_thread(admission.release, bill_id)
+            return await attach_to_existing(existing_bill_id)
         
-        # Use environment variable with fallback
-        uploads_dir = os.getenv("UPLOADS_DIR", "/tmp/uploads")
-        os.makedirs(uploads_dir, exist_ok=True)
-        print(f"🔵 Uploads directory: {uploads_dir}")
-        
-        # Save uploaded file temporarily (will be processed by worker)
-        temp_file_path = os.path.join(uploads_dir, f"{bill_id}_{file.filename}")
-        with open(temp_file_path, "wb") as f:
-            f.write(await file.read())
-        print(f"🔵 File saved to: {temp_file_path}")
+        # Hand the upload off to the workers (will be processed by worker)
+        upload_handle = await asyncio.to_thread(
+            upload_handoff.put, bill_id, filename, upload.path, upload.sha256
+        )
+        print(f"🔵 Upload handed off as: {upload_handle}")
         
         # Queue the processing job (non-blocking)
         print(f"🔵 Queueing task...")
-        task = process_bill_async.delay(bill_id, temp_file_path, instruction)
+        task_priority = resolve_priority(priority)
+        task = process_bill_async.apply_async(
+            args=(bill_id, upload_handle, filename, instruction),
+            kwargs={"priority": task_priority, "content_hash": upload.sha256, "user_id": user_id,
+                    "page_heights": page_heights},
+            priority=task_priority,
+            task_id=bill_id,
+        )
         print(f"🔵 Task queued with ID: {task.id}")
         
         # Return immediately
-        return JSONResponse(content={
+        return ORJSONResponse(content={
             "message": "Bill queued for processing",
             "bill_id": bill_id,
-            "status": "queued"
+            "status": "queued",
+            "deduplicated": False,
+            **decision.to_dict()
         })
         
     except Exception as e:
         print(f"❌ Error in process_bill: {str(e)}")
+        if bill_id:
+            await asyncio.to_thread(admission.release, bill_id)
+            await asyncio.to_thread(task_registry.forget, bill_id)
+        if upload_handle:
+            upload_handoff.discard(upload_handle)
         import traceback
         traceback.print_exc()
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=500,
             content={"error": str(e)}
         )
 
+    finally:
+        # No-op once the handoff has taken ownership of the spool file
+        if upload:
+            upload.cleanup()
+        for page_upload in page_uploads:
+            page_upload.cleanup()
+
+
+# ============ NEW: Re-split a Stored Bill ============
+
+@app.post("/bill/{bill_id}/split")
+async def resplit_bill(
+    bill_id: str,
+    instruction: str = Form(...),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Re-run the split for an already-extracted bill with a new instruction.
+    Goes straight to the 'split' queue, so it never waits behind image extraction.
+    """
+    result = await db.execute(select(BillData).where(BillData.bill_id == bill_id))
+    bill = result.scalars().first()
+
+    if not bill:
+        return ORJSONResponse(
+            content={"error": f"No bill found with ID {bill_id}"},
+            status_code=404
+        )
+
+    # Stop serving the old split; the worker refills the cache when the new one lands
+    await asyncio.to_thread(bill_cache.invalidate, bill_id)
+
+    split_bill_async.apply_async(
+        args=(bill_id, bill.bill_json.get("bill_data"), bill.file_name, instruction),
+        kwargs={"priority": PRIORITY_INTERACTIVE, "content_hash": bill.content_hash, "user_id": bill.user_id},
+        priority=PRIORITY_INTERACTIVE,
+    )
+
+    return ORJSONResponse(content={
+        "message": "Bill queued for re-split",
+        "bill_id": bill_id,
+        "status": "queued"
+    })
+
+
+# ============ NEW: Queue Metrics ============
+
+@app.get("/queues/stats")
+async def get_queue_stats():
+    """
+    Per-queue depth, consumer count, recent wait times and configured concurrency.
+    """
+    stats = await asyncio.to_thread(queue_stats, celery_app, redis_client)
+    return ORJSONResponse(content={"queues": stats})
+
+
+@app.get("/metrics/db-writes")
+async def get_db_write_metrics():
+    """
+    Worker-side persistence metrics: per-bill write latency and connections opened per minute.
+    """
+    latency = await asyncio.to_thread(sample_stats, redis_client, "db_write_latency")
+    opened = await asyncio.to_thread(rate_per_minute, redis_client, "db_connections_opened")
+    return ORJSONResponse(content={
+        "write_latency_seconds": latency,
+        "connections_opened_per_minute": opened
+    })
+
+
+@app.get("/metrics/dedup")
+async def get_dedup_metrics():
+    """
+    Upload deduplication hit rate.
+    """
+    return ORJSONResponse(content=await asyncio.to_thread(dedup_index.stats))
+
+
+@app.get("/metrics/db-pool")
+async def get_db_pool_metrics():
+    """
+    This API process's database pool occupancy and checkout wait times.
+    """
+    return ORJSONResponse(content=pool_stats())
+
+
+@app.get("/metrics/bill-cache")
+async def get_bill_cache_metrics():
+    """
+    GET /bill/{bill_id} cache hit rate and database queries saved.
+    """
+    return ORJSONResponse(content=await asyncio.to_thread(bill_cache.stats))
+
+
+@app.get("/workers/ready")
+async def get_ready_workers():
+    """
+    Worker processes that finished warm-up, with their cold-start breakdown.
+    """
+    ready = await asyncio.to_thread(redis_client.hgetall, "workers:ready")
+    workers = {name: loads(report) for name, report in ready.items()}
+    return ORJSONResponse(content={
+        "ready_workers": len(workers),
+        "workers": workers,
+        "cold_start_seconds": await asyncio.to_thread(sample_stats, redis_client, "worker_cold_start")
+    })
+
+
 # ============ NEW: WebSocket for Real-time Progress ============
 
 @app.websocket("/ws/progress/{bill_id}")
@@ -302,11 +716,23 @@ async def websocket_progress(websocket: WebSocket, bill_id: str):
     pubsub.subscribe(f'bill_progress:{bill_id}')
     
     try:
+        # Send the current state first, so late subscribers don't wait forever
+        record = await asyncio.to_thread(task_registry.get, bill_id)
+        if record:
+            await websocket.send_json({
+                "stage": record["stage"],
+                "message": record["message"],
+                "progress": record["progress"]
+            })
+            if record["state"] in [STATE_COMPLETED, STATE_FAILED]:
+                return
+
         # Listen for messages
         for message in pubsub.listen():
             if message['type'] == 'message':
-                data = json.loads(message['data'])
-                await websocket.send_json(data)
+                # Forward the publisher's JSON as-is; parse only to spot the final stage
+                data = loads(message['data'])
+                await websocket.send_text(message['data'])
                 
                 # Close connection when complete
                 if data['stage'] in ['completed', 'error']:
@@ -321,154 +747,525 @@ async def websocket_progress(websocket: WebSocket, bill_id: str):
 # ============ NEW: Check Processing Status ============
 
 @app.get("/bill/{bill_id}/status")
-async def get_bill_status(bill_id: str):
+async def get_bill_status(bill_id: str, db: AsyncSession = Depends(get_db)):
     """
     Get current processing status of a bill.
     Useful for polling if WebSocket is not available.
     """
-    # Check Celery task result
-    task_result = celery_app.AsyncResult(bill_id)
-    
-    return JSONResponse(content={
+    # Single O(1) read from the task registry
+    record = await asyncio.to_thread(task_registry.get, bill_id)
+
+    if not record:
+        # Registry entry expired (or predates it): fall back to the stored bill
+        result = await db.execute(select(BillData.bill_id).where(BillData.bill_id == bill_id))
+        if not result.scalars().first():
+            return ORJSONResponse(
+                content={"error": f"No bill found with ID {bill_id}"},
+                status_code=404
+            )
+        record = {"state": STATE_COMPLETED, "stage": "completed", "progress": 100,
+                  "message": "Bill processed successfully!", "result": f"bill_data:{bill_id}"}
+
+    return ORJSONResponse(content={
         "bill_id": bill_id,
-        "status": task_result.state,
-        "info": task_result.info if task_result.info else {}
+        "status": record["state"],
+        "info": record
     })
 
 
-# ============ EXISTING ENDPOINTS (Unchanged) ============
+# ============ NEW: Bill History ============
 
-@app.get("/bill/{bill_id}")
-async def get_bill(bill_id: str, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(BillData).where(BillData.bill_id == bill_id))
-    bill = result.scalars().first()
+BILLS_PAGE_DEFAULT = 20
+BILLS_PAGE_MAX = 100
 
-    if not bill:
-        return JSONResponse(
-            content={"error": f"No bill found with ID {bill_id}"},
-            status_code=404
-        )
 
-    return JSONResponse(
-        content={
-            "bill_id": bill.bill_id,
-            "file_name": bill.file_name,
-            "bill_data": bill.bill_json.get("bill_data"),
-            "split_result": bill.bill_json.get("split_result")
-        },
-        status_code=200
+def encode_bills_cursor(created_at: datetime, row_id: int) -> str:
+    """Opaque keyset cursor: position of the last row on a page"""
+    raw = f"{created_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_bills_cursor(cursor: str):
+    raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+    created_at, row_id = raw.rsplit("|", 1)
+    return datetime.fromisoformat(created_at), int(row_id)
+
+
+BILL_SUMMARY_COLUMNS = (
+    BillData.id, BillData.bill_id, BillData.merchant, BillData.total,
+    BillData.bill_date, BillData.item_count, BillData.created_at,
+)
+
+
+async def bill_summary_page(db: AsyncSession, query, cursor: Optional[str], limit: int) -> ORJSONResponse:
+    """
+    Run a BILL_SUMMARY_COLUMNS query newest first, one keyset page at a time
+    """
+    limit = max(1, min(limit, BILLS_PAGE_MAX))
+    query = query.order_by(BillData.created_at.desc(), BillData.id.desc()).limit(limit + 1)
+
+    if cursor:
+        try:
+            after_created_at, after_id = decode_bills_cursor(cursor)
+        except ValueError:
+            return ORJSONResponse(content={"error": "Invalid cursor"}, status_code=400)
+        query = query.where(tuple_(BillData.created_at, BillData.id) < tuple_(after_created_at, after_id))
+
+    rows = (await db.execute(query)).all()
+    page = rows[:limit]
+    next_cursor = encode_bills_cursor(page[-1].created_at, page[-1].id) if len(rows) > limit else None
+
+    return ORJSONResponse(content={
+        "bills": [
+            {
+                "bill_id": row.bill_id,
+                "merchant": row.merchant,
+                "total": float(row.total) if row.total is not None else None,
+                "date": row.bill_date.isoformat() if row.bill_date else None,
+                "item_count": row.item_count,
+                "created_at": row.created_at.isoformat(),
+                "thumbnail_url": f"/bill/{row.bill_id}/thumbnail",
+            }
+            for row in page
+        ],
+        "next_cursor": next_cursor
+    })
+
+
+@app.get("/bills")
+async def list_bills(
+    cursor: Optional[str] = None,
+    limit: int = BILLS_PAGE_DEFAULT,
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    The caller's bills, newest first, as lightweight summaries.
+    Keyset-paginated on (created_at, id) via ix_bill_data_user_created:
+    pass the returned next_cursor to fetch the following page.
+    """
+    user_id = await resolve_user_id(user["email"])
+    if user_id is None:
+        return ORJSONResponse(content={"bills": [], "next_cursor": None})
+
+    query = select(*BILL_SUMMARY_COLUMNS).where(BillData.user_id == user_id)
+    return await bill_summary_page(db, query, cursor, limit)
+
+
+def prefix_tsquery(text: str) -> Optional[str]:
+    """'tandoori pal' -> 'tandoori:* & pal:*' (every word as a prefix)"""
+    words = re.findall(r"\w+", text.lower())
+    return " & ".join(f"{word}:*" for word in words) or None
+
+
+@app.get("/bills/search")
+async def search_bills(
+    q: Optional[str] = None,
+    item: Optional[str] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    min_total: Optional[float] = None,
+    max_total: Optional[float] = None,
+    cursor: Optional[str] = None,
+    limit: int = BILLS_PAGE_DEFAULT,
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Search the caller's bills by merchant and item names.
+
+    `q` matches words by prefix (full-text, ix_bill_data_search_vector) or
+    approximately (trigram word similarity, ix_bill_data_search_trgm), so
+    "tandori" still finds "Tandoori". `item` is an exact item name, matched
+    by JSONB containment (ix_bill_data_json_path). Results can be narrowed
+    by receipt date and total, and page like GET /bills.
+    """
+    user_id = await resolve_user_id(user["email"])
+    if user_id is None:
+        return ORJSONResponse(content={"bills": [], "next_cursor": None})
+
+    query = select(*BILL_SUMMARY_COLUMNS).where(BillData.user_id == user_id)
+
+    if q and q.strip():
+        matches = [literal(q.strip()).op("<%")(BillData.search_text)]
+        tsquery = prefix_tsquery(q)
+        if tsquery:
+            matches.append(BillData.search_vector.op("@@")(func.to_tsquery("simple", tsquery)))
+        query = query.where(or_(*matches))
+    if item:
+        query = query.where(BillData.bill_json.contains({"bill_data": {"items": [{"name": item}]}}))
+    if date_from:
+        query = query.where(BillData.bill_date >= date_from)
+    if date_to:
+        query = query.where(BillData.bill_date <= date_to)
+    if min_total is not None:
+        query = query.where(BillData.total >= min_total)
+    if max_total is not None:
+        query = query.where(BillData.total <= max_total)
+
+    return await bill_summary_page(db, query, cursor, limit)
+
+
+# ============ NEW: Spend Analytics ============
+# Served from the spend_* aggregate tables, which the worker keeps current
+# on every bill write (spend_analytics.py): no query here scans bills.
+
+ANALYTICS_MONTHS_DEFAULT = 12
+ANALYTICS_MONTHS_MAX = 120
+ANALYTICS_TOP_DEFAULT = 10
+ANALYTICS_TOP_MAX = 100
+
+
+def analytics_since(months: int) -> date:
+    """First day of the month `months - 1` months before this one"""
+    months = max(1, min(months, ANALYTICS_MONTHS_MAX))
+    today = date.today()
+    index = today.year * 12 + today.month - 1 - (months - 1)
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def money(value) -> float:
+    return float(value) if value is not None else 0.0
+
+
+def people_over_time(rows) -> list:
+    """SpendPerson rows -> per person: total owed, bills and a monthly series"""
+    people = {}
+    for row in rows:
+        person = people.setdefault(row.person, {"person": row.person, "owed": 0.0, "bill_count": 0, "monthly": {}})
+        person["owed"] += money(row.owed)
+        person["bill_count"] += row.bill_count
+        month = row.month.isoformat()
+        person["monthly"][month] = person["monthly"].get(month, 0.0) + money(row.owed)
+
+    result = []
+    for person in sorted(people.values(), key=lambda p: p["owed"], reverse=True):
+        person["owed"] = round(person["owed"], 2)
+        person["monthly"] = [{"month": m, "owed": round(v, 2)} for m, v in sorted(person["monthly"].items())]
+        result.append(person)
+    return result
+
+
+@app.get("/analytics")
+async def get_spend_analytics(
+    months: int = ANALYTICS_MONTHS_DEFAULT,
+    top: int = ANALYTICS_TOP_DEFAULT,
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    The signed-in user's spend: totals and a monthly series for the last
+    `months` months, plus all-time top merchants and items and what each
+    person they split with owed over the window.
+    """
+    since = analytics_since(months)
+    top = max(1, min(top, ANALYTICS_TOP_MAX))
+    user_id = await resolve_user_id(user["email"])
+    if user_id is None:
+        return ORJSONResponse(content={"since": since.isoformat(), "total_spent": 0.0, "bill_count": 0,
+                                       "monthly": [], "merchants": [], "items": [], "people": []})
+
+    monthly = (await db.execute(
+        select(SpendMonthly.month, SpendMonthly.bill_count, SpendMonthly.total)
+        .where(SpendMonthly.user_id == user_id, SpendMonthly.month >= since)
+        .order_by(SpendMonthly.month)
+    )).all()
+    merchants = (await db.execute(
+        select(SpendMerchant.merchant, SpendMerchant.bill_count, SpendMerchant.total)
+        .where(SpendMerchant.user_id == user_id)
+        .order_by(SpendMerchant.total.desc())
+        .limit(top)
+    )).all()
+    items = (await db.execute(
+        select(SpendItem.name, SpendItem.times, SpendItem.quantity, SpendItem.total)
+        .where(SpendItem.user_id == user_id)
+        .order_by(SpendItem.total.desc())
+        .limit(top)
+    )).all()
+    people = (await db.execute(
+        select(SpendPerson.person, SpendPerson.month, SpendPerson.bill_count, SpendPerson.owed)
+        .where(SpendPerson.user_id == user_id, SpendPerson.month >= since)
+    )).all()
+
+    return ORJSONResponse(content={
+        "since": since.isoformat(),
+        "total_spent": round(sum(money(row.total) for row in monthly), 2),
+        "bill_count": sum(row.bill_count for row in monthly),
+        "monthly": [
+            {"month": row.month.isoformat(), "bill_count": row.bill_count, "total": money(row.total)}
+            for row in monthly
+        ],
+        "merchants": [
+            {"merchant": row.merchant or None, "bill_count": row.bill_count, "total": money(row.total)}
+            for row in merchants
+        ],
+        "items": [
+            {"name": row.name, "times": row.times, "quantity": money(row.quantity), "total": money(row.total)}
+            for row in items
+        ],
+        "people": people_over_time(people),
+    })
+
+
+@app.get("/analytics/groups")
+async def list_spend_groups(
+    top: int = ANALYTICS_TOP_DEFAULT,
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """Groups of people the signed-in user splits bills with, by total spent"""
+    top = max(1, min(top, ANALYTICS_TOP_MAX))
+    user_id = await resolve_user_id(user["email"])
+    if user_id is None:
+        return ORJSONResponse(content={"groups": []})
+
+    rows = (await db.execute(
+        select(SpendGroup.group_key, SpendGroup.people, SpendGroup.bill_count, SpendGroup.total)
+        .where(SpendGroup.user_id == user_id)
+        .order_by(SpendGroup.total.desc())
+        .limit(top)
+    )).all()
+
+    return ORJSONResponse(content={"groups": [
+        {"group_key": row.group_key, "people": row.people, "bill_count": row.bill_count, "total": money(row.total)}
+        for row in rows
+    ]})
+
+
+@app.get("/analytics/groups/{group_key}")
+async def get_spend_group(
+    group_key: str,
+    months: int = ANALYTICS_MONTHS_DEFAULT,
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """One group's all-time totals and what each member owed per month"""
+    since = analytics_since(months)
+    user_id = await resolve_user_id(user["email"])
+    group = None
+    if user_id is not None:
+        group = (await db.execute(
+            select(SpendGroup.people, SpendGroup.bill_count, SpendGroup.total)
+            .where(SpendGroup.user_id == user_id, SpendGroup.group_key == group_key)
+        )).first()
+    if group is None:
+        return ORJSONResponse(content={"error": "Group not found"}, status_code=404)
+
+    people = (await db.execute(
+        select(SpendPerson.person, SpendPerson.month, SpendPerson.bill_count, SpendPerson.owed)
+        .where(SpendPerson.user_id == user_id, SpendPerson.group_key == group_key, SpendPerson.month >= since)
+    )).all()
+
+    return ORJSONResponse(content={
+        "group_key": group_key,
+        "people": group.people,
+        "bill_count": group.bill_count,
+        "total": money(group.total),
+        "since": since.isoformat(),
+        "members": people_over_time(people),
+    })
+
+
+# ============ NEW: Bulk Export ============
+
+@app.get("/export/bills")
+async def export_bills(
+    format: str = "ndjson",
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    user_id: Optional[int] = None,
+    group_key: Optional[str] = None,
+    gzip: bool = False,
+    user: dict = Depends(get_current_user)
+):
+    """
+    Stream bills as NDJSON or CSV, read through a server-side cursor so the
+    export runs in constant memory. Filters: receipt date range, user and
+    spend group. Users export their own bills; EXPORT_ADMIN_EMAILS may pick
+    any user_id or omit it to export everyone's.
+    """
+    if format not in EXPORT_FORMATS:
+        return ORJSONResponse(content={"error": f"format must be one of {', '.join(EXPORT_FORMATS)}"}, status_code=400)
+
+    if not is_export_admin(user["email"]):
+        own_id = await resolve_user_id(user["email"])
+        if own_id is None or (user_id is not None and user_id != own_id):
+            return ORJSONResponse(content={"error": "Not allowed to export these bills"}, status_code=403)
+        user_id = own_id
+
+    sql, params = export_query(format, date_from, date_to, user_id, group_key, paramstyle="named")
+    encoder = ExportEncoder(format, compress=gzip)
+
+    async def chunks():
+        # Own connection: the response outlives the request's session dependency
+        async with engine.connect() as conn:
+            result = await conn.stream(text(sql).execution_options(yield_per=EXPORT_BATCH_ROWS), params)
+            yield encoder.header()
+            async for rows in result.partitions(EXPORT_BATCH_ROWS):
+                yield encoder.encode(rows)
+            yield encoder.finish()
+        print(f"📤 Exported {encoder.rows} bills ({encoder.raw_bytes / 1e6:.1f} MB {format})")
+
+    filename = f"bills.{format}" + (".gz" if gzip else "")
+    return StreamingResponse(
+        chunks(),
+        media_type="application/gzip" if gzip else EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
 
 
-@app.get("/bill/{bill_id}/download")
-async def download_bill(bill_id: str, db: AsyncSession = Depends(get_db)):
-    """Download the original bill image from GCS"""
-    try:
+# ============ Bill Retrieval and Images ============
+
+@app.get("/bill/{bill_id}")
+async def get_bill(bill_id: str, request: Request, db: AsyncSession = Depends(get_db)):
+    cached = await asyncio.to_thread(bill_cache.get, bill_id)
+    if cached is None:
         result = await db.execute(select(BillData).where(BillData.bill_id == bill_id))
         bill = result.scalars().first()
 
         if not bill:
-            return JSONResponse(
-                content={"error": f"No record found for Bill ID {bill_id}"},
+            return ORJSONResponse(
+                content={"error": f"No bill found with ID {bill_id}"},
                 status_code=404
             )
 
-        gcs_uri = bill.file_name
-        if not gcs_uri:
-            return JSONResponse(
-                content={"error": "No GCS URI found for this bill."},
-                status_code=400
-            )
+        if bill.response_body:
+            cached = CachedBill.from_body(bill.response_body)
+        else:
+            cached = CachedBill.from_payload(stored_bill_payload(bill))
+        cached = await asyncio.to_thread(bill_cache.fill, bill_id, cached)
 
-        match = re.match(r"(?:gs://|https://storage\.googleapis\.com/)([^/]+)/(.+)", gcs_uri)
-        if not match:
-            return JSONResponse(
-                content={"error": "Invalid GCS URI format."},
-                status_code=400
-            )
+    headers = {"ETag": cached.etag, "Cache-Control": BILL_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), cached.etag):
+        return Response(status_code=304, headers=headers)
 
-        bucket_name, blob_name = match.groups()
+    return Response(
+        content=cached.body,
+        media_type="application/json",
+        headers=headers,
+        status_code=200
+    )
 
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        blob = bucket.blob(blob_name)
 
-        if not blob.exists():
-            return JSONResponse(
-                content={"error": "File not found in Google Cloud Storage."},
-                status_code=404
-            )
+async def resolve_bill_image(bill_id: str, db: AsyncSession):
+    """(bucket, blob name) of a bill's original image, or an error response"""
+    result = await db.execute(select(BillData).where(BillData.bill_id == bill_id))
+    bill = result.scalars().first()
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(blob_name)[1]) as tmp:
-            blob.download_to_filename(tmp.name)
-            temp_path = tmp.name
+    if not bill:
+        return ORJSONResponse(
+            content={"error": f"No record found for Bill ID {bill_id}"},
+            status_code=404
+        )
 
-        filename = os.path.basename(blob_name)
-        return FileResponse(
-            path=temp_path,
-            filename=filename,
-            media_type="image/jpeg"
+    gcs_uri = bill.file_name
+    if not gcs_uri:
+        return ORJSONResponse(
+            content={"error": "No GCS URI found for this bill."},
+            status_code=400
         )
 
-    except Exception as e:
-        return JSONResponse(
-            content={"error": f"Failed to fetch file from GCS: {str(e)}"},
-            status_code=500
+    location = parse_gcs_uri(gcs_uri)
+    if not location:
+        return ORJSONResponse(
+            content={"error": "Invalid GCS URI format."},
+            status_code=400
         )
 
+    return location
+
+
+@app.get("/bill/{bill_id}/download")
+async def download_bill(bill_id: str, request: Request, db: AsyncSession = Depends(get_db)):
+    """Download the original bill image from GCS (supports Range and If-None-Match)"""
+    return await serve_bill_image(bill_id, request, db, disposition="attachment")
+
 
 @app.get("/bill/{bill_id}/view")
-async def view_bill(bill_id: str, db: AsyncSession = Depends(get_db)):
-    """Display the original bill image from GCS"""
+async def view_bill(bill_id: str, request: Request, db: AsyncSession = Depends(get_db)):
+    """Display the original bill image from GCS (supports Range and If-None-Match)"""
+    return await serve_bill_image(bill_id, request, db, disposition="inline")
+
+
+@app.get("/bill/{bill_id}/thumbnail")
+async def thumbnail_bill(bill_id: str, request: Request, width: int = 320, db: AsyncSession = Depends(get_db)):
+    """Resized WebP preview of the bill image, for lists and history pages"""
     try:
-        result = await db.execute(select(BillData).where(BillData.bill_id == bill_id))
-        bill = result.scalars().first()
+        location = await resolve_bill_image(bill_id, db)
+        if isinstance(location, ORJSONResponse):
+            return location
+        bucket_name, blob_name = location
 
-        if not bill:
-            return JSONResponse(
-                content={"error": f"No record found for Bill ID {bill_id}"},
+        try:
+            info = await cached_thumbnail(bucket_name, blob_name, thumbnail_width(width))
+        except NotFound:
+            return ORJSONResponse(
+                content={"error": "File not found in Google Cloud Storage."},
                 status_code=404
             )
-
-        gcs_uri = bill.file_name
-        if not gcs_uri:
-            return JSONResponse(
-                content={"error": "No GCS URI found for this bill."},
-                status_code=400
+        except ThumbnailUnavailable:
+            return ORJSONResponse(
+                content={"error": "No thumbnail available for this image format."},
+                status_code=415
             )
 
-        match = re.match(r"(?:gs://|https://storage\.googleapis\.com/)([^/]+)/(.+)", gcs_uri)
-        if not match:
-            return JSONResponse(
-                content={"error": "Invalid GCS URI format."},
-                status_code=400
-            )
+        return image_response(info, request.headers, "inline")
+
+    except Exception as e:
+        return ORJSONResponse(
+            content={"error": f"Failed to create thumbnail: {str(e)}"},
+            status_code=500
+        )
 
-        bucket_name, blob_name = match.groups()
 
-        client = storage.Client()
-        bucket = client.bucket(bucket_name)
-        blob = bucket.blob(blob_name)
+async def serve_bill_image(bill_id: str, request: Request, db: AsyncSession, disposition: str):
+    """Stream a bill image straight from GCS to the client, or redirect to a signed URL"""
+    if redirect_mode():
+        return await redirect_to_signed_url(bill_id, db, disposition)
 
-        if not blob.exists():
-            return JSONResponse(
+    try:
+        location = await resolve_bill_image(bill_id, db)
+        if isinstance(location, ORJSONResponse):
+            return location
+        bucket_name, blob_name = location
+
+        try:
+            if IMAGE_CACHE_ENABLED:
+                info = await cached_original(bucket_name, blob_name)
+            else:
+                info = await stat_image(bucket_name, blob_name)
+        except NotFound:
+            return ORJSONResponse(
                 content={"error": "File not found in Google Cloud Storage."},
                 status_code=404
             )
 
-        image_bytes = blob.download_as_bytes()
-        content_type = blob.content_type or "image/jpeg"
+        return image_response(info, request.headers, disposition)
 
-        return Response(
-            content=image_bytes,
-            media_type=content_type,
-            headers={
-                "Content-Disposition": f'inline; filename="{blob_name.split("/")[-1]}"'
-            }
+    except Exception as e:
+        return ORJSONResponse(
+            content={"error": f"Failed to fetch image from GCS: {str(e)}"},
+            status_code=500
         )
 
+
+async def redirect_to_signed_url(bill_id: str, db: AsyncSession, disposition: str):
+    """302 to a short-lived signed URL; repeat views are served from Redis"""
+    try:
+        url = await asyncio.to_thread(signed_url_cache.get, bill_id, disposition)
+        if not url:
+            location = await resolve_bill_image(bill_id, db)
+            if isinstance(location, ORJSONResponse):
+                return location
+            bucket_name, blob_name = location
+
+            url = await run_gcs(sign_image_url, bucket_name, blob_name, disposition)
+            await asyncio.to_thread(signed_url_cache.put, bill_id, disposition, url)
+
+        return RedirectResponse(url, status_code=302, headers={"Cache-Control": "no-store"})
+
     except Exception as e:
-        return JSONResponse(
-            content={"error": f"Failed to fetch image from GCS: {str(e)}"},
+        return ORJSONResponse(
+            content={"error": f"Failed to sign image URL: {str(e)}"},
             status_code=500
-        )
\ No newline at end of file
+        )
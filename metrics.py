@@ -0,0 +1,67 @@
+"""
+Lightweight Redis-backed metrics shared by the API and the Celery workers.
+
+Three primitives cover what we need:
+- samples:  a capped list of recent values (latencies, waits) summarized as avg/p95
+- counters: monotonically increasing totals (cache hits, dedup hits, ...)
+- rates:    per-minute buckets for "events per minute" style numbers
+"""
+
+import time
+from typing import Dict, Optional
+
+
+SAMPLE_SIZE = 200
+RATE_BUCKET_SECONDS = 60
+RATE_RETENTION_MINUTES = 60
+
+
+def record_sample(redis_client, name: str, value: float, sample_size: int = SAMPLE_SIZE):
+    """Append a value to a capped list of recent samples"""
+    key = f"metrics:sample:{name}"
+    pipe = redis_client.pipeline()
+    pipe.lpush(key, round(value, 4))
+    pipe.ltrim(key, 0, sample_size - 1)
+    pipe.execute()
+
+
+def sample_stats(redis_client, name: str) -> Dict[str, Optional[float]]:
+    """Count, average and p95 of the recent samples for a metric"""
+    samples = sorted(float(s) for s in redis_client.lrange(f"metrics:sample:{name}", 0, -1))
+    if not samples:
+        return {"samples": 0, "avg": None, "p95": None}
+
+    p95_index = min(len(samples) - 1, int(len(samples) * 0.95))
+    return {
+        "samples": len(samples),
+        "avg": round(sum(samples) / len(samples), 4),
+        "p95": samples[p95_index],
+    }
+
+
+def incr_counter(redis_client, name: str, amount: int = 1):
+    """Increment a named counter"""
+    redis_client.hincrby("metrics:counters", name, amount)
+
+
+def get_counters(redis_client) -> Dict[str, int]:
+    """All counters as a dict"""
+    return {name: int(value) for name, value in redis_client.hgetall("metrics:counters").items()}
+
+
+def incr_rate(redis_client, name: str, amount: int = 1):
+    """Count an event in the current per-minute bucket"""
+    bucket = int(time.time() // RATE_BUCKET_SECONDS)
+    key = f"metrics:rate:{name}:{bucket}"
+    pipe = redis_client.pipeline()
+    pipe.incrby(key, amount)
+    pipe.expire(key, RATE_RETENTION_MINUTES * RATE_BUCKET_SECONDS)
+    pipe.execute()
+
+
+def rate_per_minute(redis_client, name: str, minutes: int = 5) -> float:
+    """Average events per minute over the last `minutes` complete minutes"""
+    now_bucket = int(time.time() // RATE_BUCKET_SECONDS)
+    keys = [f"metrics:rate:{name}:{now_bucket - i}" for i in range(1, minutes + 1)]
+    total = sum(int(count) for count in redis_client.mget(keys) if count)
+    return round(total / minutes, 2)
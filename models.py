@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, func
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import Column, Integer, String, Text, DateTime, Date, Numeric, ForeignKey, Index, Computed, func
+from sqlalchemy.dialects.postgresql import JSONB, ARRAY, TSVECTOR
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
@@ -11,6 +11,104 @@ class BillData(Base):
     bill_id = Column(String, nullable=False, unique=True, index=True)
     file_name = Column(String, nullable=False)
     bill_json = Column(JSONB, nullable=False)
+    content_hash = Column(String(64), nullable=True, index=True)  # sha256 of the uploaded image
+    instruction = Column(Text, nullable=True)
+    response_body = Column(Text, nullable=True)  # GET /bill/{bill_id} body, serialized by the worker
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)  # NULL for anonymous uploads
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    # Summary for history listings, extracted from bill_json at write time (see bill_summary.py)
+    merchant = Column(String(255), nullable=True)
+    total = Column(Numeric(12, 2), nullable=True)
+    bill_date = Column(Date, nullable=True)
+    item_count = Column(Integer, nullable=False, server_default="0")
+
+    # Merchant + item names for search; GIN indexes on these live in init_db.py (they need extensions)
+    search_text = Column(Text, nullable=True)
+    search_vector = Column(TSVECTOR, Computed("to_tsvector('simple', coalesce(search_text, ''))", persisted=True))
+
+    __table_args__ = (
+        # Keyset pagination of a user's history: newest first, id breaks ties
+        Index("ix_bill_data_user_created", "user_id", created_at.desc(), id.desc()),
+    )
+
+class BillItem(Base):
+    """One receipt line, flattened from bill_json for reporting (see bill_items.py)"""
+    __tablename__ = "bill_items"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    bill_id = Column(String, ForeignKey("bill_data.bill_id", ondelete="CASCADE"), nullable=False, index=True)
+    position = Column(Integer, nullable=False)
+    name = Column(String(255), nullable=False, index=True)
+    quantity = Column(Numeric(12, 3), nullable=True)
+    unit_price = Column(Numeric(12, 2), nullable=True)
+    total = Column(Numeric(12, 2), nullable=True)
+
+class BillShare(Base):
+    """One person's share of a split, flattened from bill_json for reporting"""
+    __tablename__ = "bill_shares"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    bill_id = Column(String, ForeignKey("bill_data.bill_id", ondelete="CASCADE"), nullable=False, index=True)
+    position = Column(Integer, nullable=False)
+    person = Column(String(255), nullable=False, index=True)
+    items = Column(ARRAY(Text), nullable=False, server_default="{}")
+    subtotal = Column(Numeric(12, 2), nullable=True)
+    tax_share = Column(Numeric(12, 2), nullable=True)
+    total = Column(Numeric(12, 2), nullable=True)
+
+class SpendMonthly(Base):
+    """A user's bills and spend per month, kept current by spend_analytics.py"""
+    __tablename__ = "spend_monthly"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    month = Column(Date, primary_key=True)  # first day of the month (receipt date, else upload date)
+    bill_count = Column(Integer, nullable=False, default=0)
+    total = Column(Numeric(14, 2), nullable=False, default=0)
+
+class SpendMerchant(Base):
+    """A user's bills and spend per merchant ('' when the receipt had none)"""
+    __tablename__ = "spend_merchants"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    merchant = Column(String(255), primary_key=True)
+    bill_count = Column(Integer, nullable=False, default=0)
+    total = Column(Numeric(14, 2), nullable=False, default=0)
+
+    __table_args__ = (Index("ix_spend_merchants_user_total", "user_id", total.desc()),)
+
+class SpendItem(Base):
+    """How often and how much a user spent on each item name"""
+    __tablename__ = "spend_items"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    name = Column(String(255), primary_key=True)
+    times = Column(Integer, nullable=False, default=0)  # receipt lines
+    quantity = Column(Numeric(14, 3), nullable=False, default=0)
+    total = Column(Numeric(14, 2), nullable=False, default=0)
+
+    __table_args__ = (Index("ix_spend_items_user_total", "user_id", total.desc()),)
+
+class SpendGroup(Base):
+    """A set of people a user has split bills with (md5 of their sorted, lower-cased names)"""
+    __tablename__ = "spend_groups"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    group_key = Column(String(32), primary_key=True)
+    people = Column(ARRAY(Text), nullable=False)
+    bill_count = Column(Integer, nullable=False, default=0)
+    total = Column(Numeric(14, 2), nullable=False, default=0)
+
+class SpendPerson(Base):
+    """What each person owed per month, within one group"""
+    __tablename__ = "spend_people"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    group_key = Column(String(32), primary_key=True)
+    person = Column(String(255), primary_key=True)
+    month = Column(Date, primary_key=True)
+    bill_count = Column(Integer, nullable=False, default=0)
+    owed = Column(Numeric(14, 2), nullable=False, default=0)
 
 class User(Base):
     __tablename__ = "users"
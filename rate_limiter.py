@@ -0,0 +1,62 @@
+"""
+Client-side rate limiting for Gemini calls.
+
+A thread-safe token bucket: callers block in acquire() until a call is
+allowed, so a process running many concurrent vision/split calls stays
+under the API quota instead of collecting 429s and retrying.
+"""
+
+import os
+import threading
+import time
+
+
+# Calls per minute allowed per process, and how many may go out back to back
+GEMINI_RATE_LIMIT_RPM = float(os.getenv("GEMINI_RATE_LIMIT_RPM", "60"))
+GEMINI_RATE_LIMIT_BURST = int(os.getenv("GEMINI_RATE_LIMIT_BURST", "5"))
+
+
+class RateLimiter:
+    """Token bucket refilled continuously at rate_per_minute"""
+
+    def __init__(self, rate_per_minute: float = GEMINI_RATE_LIMIT_RPM, burst: int = GEMINI_RATE_LIMIT_BURST):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited = 0.0  # total seconds callers spent blocked
+
+    def acquire(self, tokens: int = 1) -> float:
+        """
+        Block until `tokens` calls are allowed; returns the seconds waited.
+        A request larger than the burst waits for a full bucket and leaves
+        it in debt, which later callers wait out.
+        """
+        if self.rate <= 0:
+            return 0.0
+        start = time.monotonic()
+        needed = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= needed:
+                    self._tokens -= tokens
+                    waited = now - start
+                    self.waited += waited
+                    return waited
+                delay = (needed - self._tokens) / self.rate
+            time.sleep(delay)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+# Shared by everything in this process that calls Gemini
+gemini_limiter = RateLimiter()
@@ -0,0 +1,222 @@
+"""
+Tiling and multi-photo support for long receipts.
+
+A long receipt sent as one tall image is shrunk by the vision model until
+the line items are unreadable, and a single answer for 200+ lines runs
+into the output limit. Instead each page is cut into overlapping
+horizontal bands about as tall as the page is wide, every band is
+extracted on its own (concurrently), and the per-band answers are merged
+back into one bill: line items repeated in the overlap between
+neighbouring bands are dropped, header fields come from the first band
+that has them and totals from the last.
+
+Several photos of one receipt are stitched into a single tall image (the
+image that gets stored) and their heights are kept, so each photo is
+tiled on its own and bands never straddle two photos.
+"""
+
+import hashlib
+import io
+import os
+import re
+import tempfile
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from PIL import Image, ImageOps
+
+from upload_stream import StreamedUpload, UploadRejected
+
+
+# Pages taller than this many widths are tiled
+VISION_TILE_ASPECT = float(os.getenv("VISION_TILE_ASPECT", "2.5"))
+# Band height as a multiple of the page width, and the fraction shared by neighbouring bands
+VISION_BAND_ASPECT = float(os.getenv("VISION_BAND_ASPECT", "1.25"))
+VISION_BAND_OVERLAP = float(os.getenv("VISION_BAND_OVERLAP", "0.15"))
+# Width photos are scaled to when stitched into one image
+STITCH_WIDTH = int(os.getenv("STITCH_WIDTH", "1600"))
+STITCH_JPEG_QUALITY = 90
+# Most photos accepted for one receipt
+MAX_RECEIPT_PAGES = int(os.getenv("MAX_RECEIPT_PAGES", "10"))
+
+# Item names this similar (after normalizing) with the same total are the same line
+SAME_LINE_RATIO = 0.8
+
+TOTAL_FIELDS = ("subtotal", "tax", "tip", "total")
+
+EXIF_ORIENTATION = 0x0112
+
+
+def is_tall(size: Tuple[int, int], aspect: float = VISION_TILE_ASPECT) -> bool:
+    """Whether an image of this (width, height) needs tiling"""
+    width, height = size
+    return width > 0 and height > width * aspect
+
+
+def band_boxes(size: Tuple[int, int], band_aspect: float = VISION_BAND_ASPECT,
+               overlap: float = VISION_BAND_OVERLAP) -> List[Tuple[int, int, int, int]]:
+    """
+    Crop boxes of the overlapping bands covering an image, top to bottom.
+    Bands are evenly spaced so the last one ends at the bottom edge.
+    """
+    width, height = size
+    band = max(1, int(width * band_aspect))
+    if height <= band:
+        return [(0, 0, width, height)]
+    step = band * (1 - overlap)
+    count = -int(-(height - band) // step) + 1  # ceil
+    stride = (height - band) / (count - 1)
+    return [(0, round(i * stride), width, round(i * stride) + band) for i in range(count)]
+
+
+def split_pages(img: Image.Image, page_heights: Optional[Sequence[int]] = None) -> List[Image.Image]:
+    """The photos a stitched image was built from (the image itself if it wasn't)"""
+    if not page_heights or len(page_heights) < 2:
+        return [img]
+    pages, top = [], 0
+    for height in page_heights:
+        pages.append(img.crop((0, top, img.width, min(img.height, top + height))))
+        top += height
+    return pages
+
+
+def tile(pages: List[Image.Image]) -> List[Image.Image]:
+    """Bands to extract, in reading order: tall pages tiled, the rest whole"""
+    bands = []
+    for page in pages:
+        if is_tall(page.size):
+            bands.extend(page.crop(box) for box in band_boxes(page.size))
+        else:
+            bands.append(page)
+    return bands
+
+
+def draft_for_width(img: Image.Image, width: int):
+    """
+    Have a JPEG decode at the smallest scale (1/2, 1/4, 1/8) still at least
+    `width` wide once upright, instead of at full resolution. No-op for
+    other formats.
+    """
+    rotated = img.getexif().get(EXIF_ORIENTATION) in (5, 6, 7, 8)
+    upright_width = img.height if rotated else img.width
+    if upright_width <= width:
+        return
+    scale = width / upright_width
+    img.draft("RGB", (max(1, int(img.width * scale)), max(1, int(img.height * scale))))
+
+
+def stitch_pages(contents: List[bytes], width: int = STITCH_WIDTH) -> Tuple[bytes, List[int]]:
+    """
+    Stack photos of one receipt (in order, top first) into one JPEG, each
+    scaled to the same width. Returns the JPEG and the height of each photo
+    in it.
+    """
+    pages = []
+    for content in contents:
+        with Image.open(io.BytesIO(content)) as img:
+            draft_for_width(img, width)
+            upright = ImageOps.exif_transpose(img).convert("RGB")
+        target = min(width, upright.width)
+        if upright.width != target:
+            upright = upright.resize((target, max(1, round(upright.height * target / upright.width))))
+        pages.append(upright)
+
+    target = min(page.width for page in pages)
+    pages = [page if page.width == target
+             else page.resize((target, max(1, round(page.height * target / page.width))))
+             for page in pages]
+    heights = [page.height for page in pages]
+
+    stitched = Image.new("RGB", (target, sum(heights)), "white")
+    top = 0
+    for page in pages:
+        stitched.paste(page, (0, top))
+        top += page.height
+
+    out = io.BytesIO()
+    stitched.save(out, format="JPEG", quality=STITCH_JPEG_QUALITY, optimize=True)
+    return out.getvalue(), heights
+
+
+def stitched_filename(filename: str) -> str:
+    """Name to store a stitched receipt under: the first photo's name, as a JPEG"""
+    return f"{os.path.splitext(os.path.basename(filename))[0] or 'receipt'}.jpg"
+
+
+def stitch_uploads(uploads: List[StreamedUpload], spool_dir: str) -> Tuple[StreamedUpload, List[int]]:
+    """
+    Stitch spooled photos of one receipt into a new spooled JPEG (hashed
+    like any upload) and remove the originals. Returns it with the page
+    heights.
+
+    Raises:
+        UploadRejected: 415 if a photo can't be decoded
+    """
+    contents = []
+    for upload in uploads:
+        with open(upload.path, "rb") as f:
+            contents.append(f.read())
+    try:
+        stitched, heights = stitch_pages(contents)
+    except (OSError, Image.DecompressionBombError):
+        raise UploadRejected(415, "Could not read one of the receipt photos")
+    for upload in uploads:
+        upload.cleanup()
+
+    fd, path = tempfile.mkstemp(dir=spool_dir, prefix=".incoming-")
+    with os.fdopen(fd, "wb") as f:
+        f.write(stitched)
+    return StreamedUpload(path, len(stitched), hashlib.sha256(stitched).hexdigest(), "image/jpeg"), heights
+
+
+def _item_name(item: Dict) -> str:
+    return re.sub(r"[^a-z0-9]", "", str(item.get("name", "")).lower())
+
+
+def _item_total(item: Dict) -> Optional[float]:
+    try:
+        return round(float(item.get("total")), 2)
+    except (TypeError, ValueError):
+        return None
+
+
+def same_line(a: Dict, b: Dict) -> bool:
+    """Whether two extracted items are the same receipt line read twice"""
+    if _item_total(a) != _item_total(b):
+        return False
+    name_a, name_b = _item_name(a), _item_name(b)
+    return name_a == name_b or SequenceMatcher(None, name_a, name_b).ratio() >= SAME_LINE_RATIO
+
+
+def overlap_length(previous: List[Dict], current: List[Dict]) -> int:
+    """Longest run of items ending `previous` that also starts `current`"""
+    for length in range(min(len(previous), len(current)), 0, -1):
+        if all(same_line(a, b) for a, b in zip(previous[-length:], current[:length])):
+            return length
+    return 0
+
+
+def merge_bands(bands: List[Dict], dedupe: bool = True) -> Dict:
+    """
+    One bill from the per-band extractions, in reading order. Items the
+    previous band ended with and this one starts with are kept once;
+    merchant/date come from the first band that has them and the totals
+    from the last.
+    """
+    merged: Dict = {"items": []}
+    previous: List[Dict] = []
+    for band in bands:
+        items = [item for item in band.get("items") or [] if isinstance(item, dict)]
+        skip = overlap_length(previous, items) if dedupe else 0
+        merged["items"].extend(items[skip:])
+        previous = items
+
+        for key, value in band.items():
+            if key in ("items", "error") or value in (None, "", [], {}):
+                continue
+            if key in TOTAL_FIELDS:
+                if value or key not in merged:  # a later 0 doesn't erase a printed amount
+                    merged[key] = value
+            elif key not in merged:
+                merged[key] = value
+    return merged
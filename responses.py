@@ -0,0 +1,14 @@
+"""
+FastAPI response classes for the API, built on json_codec.
+"""
+
+from fastapi.responses import JSONResponse
+
+from json_codec import dumps
+
+
+class ORJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson"""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
@@ -0,0 +1,96 @@
+"""
+Signed-URL redirect delivery of bill images.
+
+With IMAGE_DELIVERY_MODE=redirect, /bill/{bill_id}/view and /download answer
+with a 302 to a short-lived V4 signed URL, so the image bytes go straight
+from GCS to the browser instead of through the API. Signed URLs are cached
+in Redis per bill until shortly before they expire, so a repeat view costs
+one Redis GET and no database or GCS calls.
+
+Signing uses SIGNED_URL_KEY_FILE (a service account JSON key) when set,
+otherwise the storage client's own credentials; on Cloud Run those are
+metadata-server credentials, which sign through the IAM signBlob API. With
+STORAGE_EMULATOR_HOST set, URLs point at the emulator (fake-gcs-server does
+not verify signatures, so any service account key works there).
+"""
+
+import os
+from datetime import timedelta
+from typing import Optional
+
+import google.auth.transport.requests
+from google.auth.credentials import Signing
+from google.oauth2 import service_account
+
+from bill_images import get_blob, get_storage_client
+
+
+IMAGE_DELIVERY_MODE = os.getenv("IMAGE_DELIVERY_MODE", "proxy")  # proxy | redirect
+
+SIGNED_URL_TTL_SECONDS = int(os.getenv("SIGNED_URL_TTL_SECONDS", "900"))
+# Stop handing out a cached URL this long before it expires
+SIGNED_URL_REFRESH_MARGIN_SECONDS = int(os.getenv("SIGNED_URL_REFRESH_MARGIN_SECONDS", "60"))
+SIGNED_URL_KEY_FILE = os.getenv("SIGNED_URL_KEY_FILE")
+
+_key_credentials = None
+
+
+def redirect_mode() -> bool:
+    return IMAGE_DELIVERY_MODE == "redirect"
+
+
+def _signing_kwargs() -> dict:
+    """generate_signed_url() arguments for whichever credentials can sign"""
+    global _key_credentials
+    if SIGNED_URL_KEY_FILE:
+        if _key_credentials is None:
+            _key_credentials = service_account.Credentials.from_service_account_file(SIGNED_URL_KEY_FILE)
+        return {"credentials": _key_credentials}
+
+    credentials = get_storage_client()._credentials
+    if isinstance(credentials, Signing):
+        return {}
+
+    # Token-only credentials: let GCS sign through IAM on the service account's behalf
+    if not credentials.valid:
+        credentials.refresh(google.auth.transport.requests.Request())
+    return {
+        "service_account_email": credentials.service_account_email,
+        "access_token": credentials.token,
+    }
+
+
+def sign_image_url(bucket_name: str, blob_name: str, disposition: str = "inline") -> str:
+    """V4 signed GET URL for an image (blocking; run it on the GCS I/O pool)"""
+    filename = blob_name.split("/")[-1]
+    kwargs = _signing_kwargs()
+
+    emulator = os.getenv("STORAGE_EMULATOR_HOST")
+    if emulator:
+        kwargs["api_access_endpoint"] = emulator
+
+    return get_blob(bucket_name, blob_name).generate_signed_url(
+        version="v4",
+        method="GET",
+        expiration=timedelta(seconds=SIGNED_URL_TTL_SECONDS),
+        response_disposition=f'{disposition}; filename="{filename}"',
+        **kwargs,
+    )
+
+
+class SignedUrlCache:
+    """Redis cache of bill_id -> signed image URL"""
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+
+    def _key(self, bill_id: str, disposition: str) -> str:
+        return f"signed_url:{bill_id}:{disposition}"
+
+    def get(self, bill_id: str, disposition: str) -> Optional[str]:
+        return self.redis.get(self._key(bill_id, disposition))
+
+    def put(self, bill_id: str, disposition: str, url: str):
+        ttl = SIGNED_URL_TTL_SECONDS - SIGNED_URL_REFRESH_MARGIN_SECONDS
+        if ttl > 0:
+            self.redis.set(self._key(bill_id, disposition), url, ex=ttl)
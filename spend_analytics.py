@@ -0,0 +1,191 @@
+"""
+Pre-aggregated spend analytics.
+
+The /analytics endpoints read small per-user tables (spend_monthly,
+spend_merchants, spend_items, spend_groups, spend_people) instead of
+scanning a user's bills, so they cost the same whether a user has ten
+bills or ten thousand.
+
+The tables are maintained incrementally by the worker's bill write
+transaction: the previous version of each re-written bill is subtracted
+(retract), the new bill_data/bill_items/bill_shares rows are written, and
+the new version is added (apply). A "group" is the set of people on a
+split; its key is the md5 of their sorted, lower-cased names.
+
+Rebuild everything (after backfills, or if the tables ever drift):
+    python spend_analytics.py --rebuild
+    python spend_analytics.py --rebuild --user 42
+"""
+
+import argparse
+import time
+from typing import List, Optional
+
+import psycopg2
+from dotenv import load_dotenv
+
+SPEND_TABLES = ("spend_monthly", "spend_merchants", "spend_items", "spend_groups", "spend_people")
+
+# Receipt date when it could be parsed, upload date otherwise
+BILL_DAY = "COALESCE(b.bill_date, b.created_at::date)"
+BILL_MONTH = f"date_trunc('month', {BILL_DAY})::date"
+
+# Aggregated over one bill's bill_shares rows (alias s)
+GROUP_KEY = "md5(string_agg(DISTINCT lower(s.person), ',' ORDER BY lower(s.person)))"
+
+# {where} narrows the bill_data rows (alias b) being added or subtracted
+MONTHLY_SQL = f"""
+    INSERT INTO spend_monthly (user_id, month, bill_count, total)
+    SELECT b.user_id, {BILL_MONTH}, %(sign)s * count(*), %(sign)s * COALESCE(sum(b.total), 0)
+    FROM bill_data b
+    WHERE b.user_id IS NOT NULL AND {{where}}
+    GROUP BY 1, 2 ORDER BY 1, 2
+    ON CONFLICT (user_id, month) DO UPDATE
+    SET bill_count = spend_monthly.bill_count + EXCLUDED.bill_count,
+        total = spend_monthly.total + EXCLUDED.total
+"""
+
+MERCHANTS_SQL = """
+    INSERT INTO spend_merchants (user_id, merchant, bill_count, total)
+    SELECT b.user_id, COALESCE(b.merchant, ''), %(sign)s * count(*), %(sign)s * COALESCE(sum(b.total), 0)
+    FROM bill_data b
+    WHERE b.user_id IS NOT NULL AND {where}
+    GROUP BY 1, 2 ORDER BY 1, 2
+    ON CONFLICT (user_id, merchant) DO UPDATE
+    SET bill_count = spend_merchants.bill_count + EXCLUDED.bill_count,
+        total = spend_merchants.total + EXCLUDED.total
+"""
+
+ITEMS_SQL = """
+    INSERT INTO spend_items (user_id, name, times, quantity, total)
+    SELECT b.user_id, i.name, %(sign)s * count(*),
+           %(sign)s * COALESCE(sum(i.quantity), 0), %(sign)s * COALESCE(sum(i.total), 0)
+    FROM bill_data b JOIN bill_items i ON i.bill_id = b.bill_id
+    WHERE b.user_id IS NOT NULL AND i.name <> '' AND {where}
+    GROUP BY 1, 2 ORDER BY 1, 2
+    ON CONFLICT (user_id, name) DO UPDATE
+    SET times = spend_items.times + EXCLUDED.times,
+        quantity = spend_items.quantity + EXCLUDED.quantity,
+        total = spend_items.total + EXCLUDED.total
+"""
+
+# One row per split bill: who was on it and which group that makes
+BILL_GROUPS_CTE = f"""
+    WITH bill_groups AS (
+        SELECT b.user_id, b.bill_id, b.total, {BILL_MONTH} AS month,
+               {GROUP_KEY} AS group_key,
+               array_agg(DISTINCT s.person ORDER BY s.person) AS people
+        FROM bill_data b JOIN bill_shares s ON s.bill_id = b.bill_id
+        WHERE b.user_id IS NOT NULL AND s.person <> '' AND {{where}}
+        GROUP BY b.id
+    )
+"""
+
+GROUPS_SQL = BILL_GROUPS_CTE + """
+    INSERT INTO spend_groups (user_id, group_key, people, bill_count, total)
+    SELECT user_id, group_key, min(people), %(sign)s * count(*), %(sign)s * COALESCE(sum(total), 0)
+    FROM bill_groups
+    GROUP BY 1, 2 ORDER BY 1, 2
+    ON CONFLICT (user_id, group_key) DO UPDATE
+    SET bill_count = spend_groups.bill_count + EXCLUDED.bill_count,
+        total = spend_groups.total + EXCLUDED.total
+"""
+
+PEOPLE_SQL = BILL_GROUPS_CTE + """
+    INSERT INTO spend_people (user_id, group_key, person, month, bill_count, owed)
+    SELECT g.user_id, g.group_key, s.person, g.month,
+           %(sign)s * count(DISTINCT s.bill_id), %(sign)s * COALESCE(sum(s.total), 0)
+    FROM bill_groups g JOIN bill_shares s ON s.bill_id = g.bill_id
+    WHERE s.person <> ''
+    GROUP BY 1, 2, 3, 4 ORDER BY 1, 2, 3, 4
+    ON CONFLICT (user_id, group_key, person, month) DO UPDATE
+    SET bill_count = spend_people.bill_count + EXCLUDED.bill_count,
+        owed = spend_people.owed + EXCLUDED.owed
+"""
+
+AGGREGATE_SQL = (MONTHLY_SQL, MERCHANTS_SQL, ITEMS_SQL, GROUPS_SQL, PEOPLE_SQL)
+
+# Serializes writers of the same bill_id until commit, including ids with no row yet
+# (which FOR UPDATE couldn't lock); taken in a fixed order so batches can't deadlock
+LOCK_BILLS_SQL = """
+    SELECT pg_advisory_xact_lock(hashtextextended(bill_id, 0))
+    FROM (SELECT bill_id FROM unnest(%s::text[]) AS bill_id ORDER BY bill_id) AS ids
+"""
+
+BILL_USERS_SQL = "SELECT DISTINCT user_id FROM bill_data WHERE bill_id = ANY(%s) AND user_id IS NOT NULL"
+
+# Rows whose last bill was subtracted
+PRUNE_SQL = [
+    f"DELETE FROM {table} WHERE user_id = ANY(%s) AND {count} <= 0"
+    for table, count in (
+        ("spend_monthly", "bill_count"), ("spend_merchants", "bill_count"), ("spend_items", "times"),
+        ("spend_groups", "bill_count"), ("spend_people", "bill_count"),
+    )
+]
+
+
+def _aggregate(cur, where: str, params: dict, sign: int):
+    for sql in AGGREGATE_SQL:
+        cur.execute(sql.format(where=where), {**params, "sign": sign})
+
+
+def retract(cur, bill_ids: List[str]) -> List[int]:
+    """
+    Subtract the currently stored version of these bills (if any) from the
+    aggregates. Call before the bill_data upsert; returns the users touched.
+    Concurrent writes of the same bill wait here until this transaction
+    commits, so each one retracts the version the previous one applied.
+    """
+    cur.execute(LOCK_BILLS_SQL, (bill_ids,))
+    cur.execute(BILL_USERS_SQL, (bill_ids,))
+    user_ids = [row[0] for row in cur.fetchall()]
+    if user_ids:
+        _aggregate(cur, "b.bill_id = ANY(%(bill_ids)s)", {"bill_ids": bill_ids}, -1)
+    return user_ids
+
+
+def apply(cur, bill_ids: List[str], retracted_user_ids: Optional[List[int]] = None):
+    """Add the just-written version of these bills, then drop rows retract() emptied"""
+    _aggregate(cur, "b.bill_id = ANY(%(bill_ids)s)", {"bill_ids": bill_ids}, 1)
+    if retracted_user_ids:
+        for sql in PRUNE_SQL:
+            cur.execute(sql, (retracted_user_ids,))
+
+
+def rebuild(conn, user_ids: Optional[List[int]] = None):
+    """Recompute the aggregates from scratch (for all users or just some) in one transaction"""
+    with conn.cursor() as cur:
+        if user_ids:
+            for table in SPEND_TABLES:
+                cur.execute(f"DELETE FROM {table} WHERE user_id = ANY(%s)", (user_ids,))
+            _aggregate(cur, "b.user_id = ANY(%(user_ids)s)", {"user_ids": user_ids}, 1)
+        else:
+            # Blocks concurrent bill writes until the rebuild commits, so none are lost
+            cur.execute(f"TRUNCATE {', '.join(SPEND_TABLES)}")
+            _aggregate(cur, "TRUE", {}, 1)
+    conn.commit()
+
+
+def main():
+    # worker_db imports this module, so import it only when run as a script
+    from worker_db import sync_database_url
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rebuild", action="store_true", required=True)
+    parser.add_argument("--user", type=int, action="append", help="Only rebuild this user id (repeatable)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    conn = psycopg2.connect(sync_database_url())
+    try:
+        rebuild(conn, args.user)
+    finally:
+        conn.close()
+    scope = f"users {', '.join(map(str, args.user))}" if args.user else "all users"
+    print(f"✅ Rebuilt spend analytics for {scope} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Celery queue topology for the bill processing pipeline.
+
+Each pipeline stage has its own queue so cheap work (re-splits, database
+writes) never waits behind slow Gemini Vision extractions, and each queue
+can be consumed by a worker pool sized for its workload.
+"""
+
+import os
+import time
+from typing import Dict, Optional
+
+from kombu import Exchange, Queue
+
+from metrics import record_sample, sample_stats
+
+
+# ============================================================================
+# QUEUES & PRIORITIES
+# ============================================================================
+
+VISION_QUEUE = "vision"      # Gemini Vision extraction (I/O-bound, slow)
+SPLIT_QUEUE = "split"        # LangChain split agent (mostly CPU-light)
+DB_WRITE_QUEUE = "db_write"  # Persistence to Postgres (batched)
+
+QUEUE_NAMES = (VISION_QUEUE, SPLIT_QUEUE, DB_WRITE_QUEUE)
+
+# RabbitMQ priorities: higher number is served first
+MAX_PRIORITY = 10
+PRIORITY_INTERACTIVE = 9
+PRIORITY_BULK = 1
+
+PRIORITIES = {
+    "interactive": PRIORITY_INTERACTIVE,
+    "bulk": PRIORITY_BULK,
+}
+
+# Suggested worker concurrency per queue (see docker-compose.yml)
+QUEUE_CONCURRENCY = {
+    VISION_QUEUE: int(os.getenv("CELERY_VISION_CONCURRENCY", "50")),
+    SPLIT_QUEUE: int(os.getenv("CELERY_SPLIT_CONCURRENCY", "16")),
+    DB_WRITE_QUEUE: int(os.getenv("CELERY_DB_WRITE_CONCURRENCY", "32")),
+}
+
+# Completed-task counters are kept in fixed buckets over a sliding window
+THROUGHPUT_BUCKET_SECONDS = 10
+THROUGHPUT_WINDOW_SECONDS = int(os.getenv("QUEUE_THROUGHPUT_WINDOW_SECONDS", "300"))
+
+
+def resolve_priority(name: Optional[str]) -> int:
+    """Map a priority level name ('interactive' / 'bulk') to a RabbitMQ priority"""
+    return PRIORITIES.get((name or "interactive").lower(), PRIORITY_INTERACTIVE)
+
+
+def build_queues():
+    """Declare one priority-enabled queue per pipeline stage"""
+    return tuple(
+        Queue(
+            name,
+            Exchange(name, type="direct"),
+            routing_key=name,
+            queue_arguments={"x-max-priority": MAX_PRIORITY},
+        )
+        for name in QUEUE_NAMES
+    )
+
+
+def task_routes(module: str = "main") -> Dict[str, Dict[str, str]]:
+    """Route each pipeline task to the queue for its stage"""
+    return {
+        f"{module}.process_bill_async": {"queue": VISION_QUEUE, "routing_key": VISION_QUEUE},
+        f"{module}.split_bill_async": {"queue": SPLIT_QUEUE, "routing_key": SPLIT_QUEUE},
+        f"{module}.persist_bill_async": {"queue": DB_WRITE_QUEUE, "routing_key": DB_WRITE_QUEUE},
+    }
+
+
+def configure_queues(celery_app, module: str = "main"):
+    """Apply queue, routing and priority settings to a Celery app"""
+    celery_app.conf.update(
+        task_queues=build_queues(),
+        task_routes=task_routes(module),
+        task_default_queue=VISION_QUEUE,
+        task_default_priority=PRIORITY_INTERACTIVE,
+        task_queue_max_priority=MAX_PRIORITY,
+        # Priorities only work if workers don't hoard messages
+        worker_prefetch_multiplier=1,
+        task_acks_late=True,
+    )
+
+
+# ============================================================================
+# QUEUE METRICS
+# ============================================================================
+
+def stamp_enqueue_time(headers: Dict):
+    """Record when a task message was published (before_task_publish hook)"""
+    if headers is not None:
+        headers.setdefault("enqueued_at", time.time())
+
+
+def record_wait_time(redis_client, task):
+    """Record how long a task sat in its queue (task_prerun hook)"""
+    enqueued_at = getattr(task.request, "enqueued_at", None)
+    queue = task_queue_name(task)
+    if not enqueued_at or not queue:
+        return
+
+    waited = max(0.0, time.time() - float(enqueued_at))
+    record_sample(redis_client, f"queue_wait:{queue}", waited)
+
+
+def task_queue_name(task) -> Optional[str]:
+    """Queue a running task was delivered from, if it is a pipeline queue"""
+    delivery_info = task.request.delivery_info or {}
+    queue = delivery_info.get("routing_key")
+    return queue if queue in QUEUE_NAMES else None
+
+
+def record_completion(redis_client, task):
+    """Count a finished task towards its queue's throughput (task_postrun hook)"""
+    queue = task_queue_name(task)
+    if not queue:
+        return
+
+    bucket = int(time.time() // THROUGHPUT_BUCKET_SECONDS)
+    key = f"queue_done:{queue}:{bucket}"
+    pipe = redis_client.pipeline()
+    pipe.incr(key)
+    pipe.expire(key, THROUGHPUT_WINDOW_SECONDS + THROUGHPUT_BUCKET_SECONDS)
+    pipe.execute()
+
+
+def queue_throughput(redis_client, queue: str) -> float:
+    """Tasks completed per second on a queue over the recent window"""
+    now_bucket = int(time.time() // THROUGHPUT_BUCKET_SECONDS)
+    bucket_count = THROUGHPUT_WINDOW_SECONDS // THROUGHPUT_BUCKET_SECONDS
+    keys = [f"queue_done:{queue}:{now_bucket - i}" for i in range(bucket_count)]
+    done = sum(int(count) for count in redis_client.mget(keys) if count)
+    return done / THROUGHPUT_WINDOW_SECONDS
+
+
+def queue_depths(celery_app) -> Dict[str, Dict[str, Optional[int]]]:
+    """Read live message and consumer counts for each queue from the broker"""
+    depths = {}
+    with celery_app.connection_for_read() as conn:
+        for name in QUEUE_NAMES:
+            # A failed passive declare closes the channel, so use one per queue
+            channel = conn.channel()
+            try:
+                _, messages, consumers = channel.queue_declare(queue=name, passive=True)
+                depths[name] = {"depth": messages, "consumers": consumers}
+            except Exception:
+                depths[name] = {"depth": None, "consumers": None}
+            finally:
+                try:
+                    channel.close()
+                except Exception:
+                    pass
+    return depths
+
+
+def queue_wait_stats(redis_client, queue: str) -> Dict[str, Optional[float]]:
+    """Summarize recent queue wait samples for a queue"""
+    stats = sample_stats(redis_client, f"queue_wait:{queue}")
+    return {
+        "samples": stats["samples"],
+        "avg_wait_seconds": stats["avg"],
+        "p95_wait_seconds": stats["p95"],
+    }
+
+
+def queue_stats(celery_app, redis_client) -> Dict[str, Dict]:
+    """Depth, consumers, wait times, throughput and configured concurrency for every queue"""
+    try:
+        depths = queue_depths(celery_app)
+    except Exception as e:
+        print(f"⚠️ Could not read queue depths: {e}")
+        depths = {name: {"depth": None, "consumers": None} for name in QUEUE_NAMES}
+
+    return {
+        name: {
+            **depths[name],
+            **queue_wait_stats(redis_client, name),
+            "throughput_per_second": round(queue_throughput(redis_client, name), 3),
+            "concurrency": QUEUE_CONCURRENCY[name],
+        }
+        for name in QUEUE_NAMES
+    }
@@ -0,0 +1,135 @@
+"""
+Redis-backed registry of bill processing state.
+
+Every bill gets one compact Redis hash (bill_task:{bill_id}) holding its
+state, current pipeline stage, progress and a pointer to the stored result,
+so status lookups are a single HGETALL. Uploads are also indexed by an
+idempotency key derived from their content and instruction, so resubmitting
+the same upload attaches to the task already in flight instead of queueing
+a second one.
+"""
+
+import hashlib
+import time
+from typing import Dict, Optional
+
+
+# How long finished task records are kept around for status polling
+TASK_RECORD_TTL_SECONDS = 60 * 60 * 24
+
+# How long an upload stays deduplicated after it was first submitted
+IDEMPOTENCY_TTL_SECONDS = 60 * 60
+
+STATE_QUEUED = "queued"
+STATE_PROCESSING = "processing"
+STATE_COMPLETED = "completed"
+STATE_FAILED = "failed"
+
+
+def idempotency_key(content_hash: str, instruction: str, user_id: Optional[int] = None) -> str:
+    """
+    Derive an idempotency key from the upload's SHA-256 and the split instruction,
+    scoped to the uploading user (anonymous uploads share one scope)
+    """
+    digest = hashlib.sha256(content_hash.encode("ascii"))
+    digest.update(b"\0")
+    digest.update(instruction.strip().encode("utf-8"))
+    if user_id is not None:
+        digest.update(f"\0user:{user_id}".encode("ascii"))
+    return digest.hexdigest()
+
+
+class TaskRegistry:
+    """Tracks bill_id -> task state in Redis"""
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+
+    def _task_key(self, bill_id: str) -> str:
+        return f"bill_task:{bill_id}"
+
+    def _idempotency_key(self, key: str) -> str:
+        return f"idempotency:{key}"
+
+    # ---- submission ----------------------------------------------------------
+
+    def find_duplicate(self, key: str) -> Optional[str]:
+        """bill_id of an earlier submission with the same idempotency key, if any"""
+        return self.redis.get(self._idempotency_key(key))
+
+    def claim(self, key: str, bill_id: str) -> Optional[str]:
+        """
+        Register bill_id as the task for this idempotency key and mark it queued.
+        Returns None on success, or the bill_id that won a concurrent claim.
+        """
+        claimed = self.redis.set(self._idempotency_key(key), bill_id,
+                                 nx=True, ex=IDEMPOTENCY_TTL_SECONDS)
+        if not claimed:
+            return self.find_duplicate(key)
+
+        self._write(bill_id, {
+            "state": STATE_QUEUED,
+            "stage": "queued",
+            "progress": 0,
+            "message": "Bill queued for processing",
+            "idempotency_key": key,
+        })
+        return None
+
+    def forget(self, bill_id: str):
+        """Drop a task record and its idempotency key so the upload can be retried"""
+        key = self.redis.hget(self._task_key(bill_id), "idempotency_key")
+        pipe = self.redis.pipeline()
+        if key:
+            pipe.delete(self._idempotency_key(key))
+        pipe.delete(self._task_key(bill_id))
+        pipe.execute()
+
+    # ---- progress ------------------------------------------------------------
+
+    def update_stage(self, bill_id: str, stage: str, message: str, progress: int):
+        """Record the current pipeline stage (called alongside every progress message)"""
+        if stage == "completed":
+            state = STATE_COMPLETED
+        elif stage == "error":
+            state = STATE_FAILED
+        else:
+            state = STATE_PROCESSING
+
+        self._write(bill_id, {
+            "state": state,
+            "stage": stage,
+            "progress": progress,
+            "message": message,
+        })
+
+        # A failed upload may be resubmitted
+        if state == STATE_FAILED:
+            key = self.redis.hget(self._task_key(bill_id), "idempotency_key")
+            if key:
+                self.redis.delete(self._idempotency_key(key))
+
+    def set_result(self, bill_id: str, file_name: Optional[str]):
+        """Point the task record at the persisted bill"""
+        self._write(bill_id, {
+            "result": f"bill_data:{bill_id}",
+            "file_name": file_name or "",
+        })
+
+    def get(self, bill_id: str) -> Optional[Dict]:
+        """Current task record for a bill, or None if unknown/expired"""
+        record = self.redis.hgetall(self._task_key(bill_id))
+        if not record:
+            return None
+
+        record["progress"] = int(record.get("progress", 0))
+        record["updated_at"] = float(record.get("updated_at", 0))
+        record.pop("idempotency_key", None)
+        return record
+
+    def _write(self, bill_id: str, fields: Dict):
+        key = self._task_key(bill_id)
+        pipe = self.redis.pipeline()
+        pipe.hset(key, mapping={**fields, "updated_at": time.time()})
+        pipe.expire(key, TASK_RECORD_TTL_SECONDS)
+        pipe.execute()
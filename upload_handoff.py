@@ -0,0 +1,223 @@
+"""
+Handoff of uploaded bill images from the API to the Celery workers.
+
+The API spools the upload to disk (see upload_stream.py), hands the spool
+file to an UploadHandoff backend and passes only
+an opaque handle to the worker, which reads the bytes back directly. This
+removes the need for the API and the workers to share a filesystem:
+
+- local: files in UPLOADS_DIR (needs a shared volume, as before)
+- redis: bytes in Redis under a content-hash key with a TTL
+- gcs:   bytes uploaded straight to the bill bucket; that object is the
+         permanent copy, so the worker never uploads the image again
+
+Select the backend with UPLOAD_HANDOFF_BACKEND (default: local).
+"""
+
+import os
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from datetime import datetime
+from typing import Optional
+
+from redis import Redis
+from redis.exceptions import RedisError
+
+from task_registry import STATE_PROCESSING, STATE_QUEUED, TaskRegistry
+
+
+UPLOAD_HANDOFF_BACKEND = os.getenv("UPLOAD_HANDOFF_BACKEND", "local")
+UPLOADS_DIR = os.getenv("UPLOADS_DIR", "/tmp/uploads")
+
+# Unclaimed uploads expire after this long
+UPLOAD_TTL_SECONDS = int(os.getenv("UPLOAD_TTL_SECONDS", "3600"))
+
+# Local backend: total size allowed in UPLOADS_DIR before oldest files are evicted
+UPLOAD_DISK_QUOTA_BYTES = int(os.getenv("UPLOAD_DISK_QUOTA_MB", "1024")) * 1024 * 1024
+
+# Local backend: minimum seconds between opportunistic janitor runs
+JANITOR_INTERVAL_SECONDS = 60
+
+
+class UploadHandoff(ABC):
+    """Abstract base class for passing upload bytes from the API to workers"""
+
+    @abstractmethod
+    def put(self, bill_id: str, filename: str, source_path: str, content_hash: str) -> str:
+        """
+        Store a spooled upload and return the handle to give to the worker.
+        The backend takes ownership of source_path (moves or deletes it).
+        """
+        pass
+
+    @abstractmethod
+    def get(self, handle: str) -> bytes:
+        """Read the upload bytes for a handle"""
+        pass
+
+    def discard(self, handle: str):
+        """Release an upload once the worker is done with it"""
+        pass
+
+    def storage_uri(self, handle: str) -> Optional[str]:
+        """gs:// URI if the handle already is the permanent stored object"""
+        return None
+
+    def janitor(self) -> int:
+        """Expire unclaimed uploads; returns how many were removed"""
+        return 0
+
+
+class LocalDiskHandoff(UploadHandoff):
+    """Uploads as files in a directory shared by the API and the workers"""
+
+    def __init__(self, uploads_dir: str = UPLOADS_DIR, ttl_seconds: int = UPLOAD_TTL_SECONDS,
+                 quota_bytes: int = UPLOAD_DISK_QUOTA_BYTES, redis_client: Optional[Redis] = None):
+        self.uploads_dir = Path(uploads_dir)
+        self.uploads_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl_seconds = ttl_seconds
+        self.quota_bytes = quota_bytes
+        # Used to tell which uploads still belong to a queued or running bill
+        self.registry = TaskRegistry(redis_client) if redis_client is not None else None
+        self._last_janitor_run = 0.0
+
+    def put(self, bill_id: str, filename: str, source_path: str, content_hash: str) -> str:
+        if time.time() - self._last_janitor_run > JANITOR_INTERVAL_SECONDS:
+            self.janitor()
+
+        # Spool files live in the same directory, so this is a rename, not a copy
+        path = self.uploads_dir / f"{bill_id}_{os.path.basename(filename)}"
+        os.replace(source_path, path)
+        return f"local:{path}"
+
+    def get(self, handle: str) -> bytes:
+        return Path(handle[len("local:"):]).read_bytes()
+
+    def discard(self, handle: str):
+        Path(handle[len("local:"):]).unlink(missing_ok=True)
+
+    def _in_flight(self, path: Path) -> bool:
+        """Whether an upload's bill is still queued or processing (kept if Redis can't tell)"""
+        if self.registry is None:
+            return False
+        try:
+            record = self.registry.get(path.name.split("_", 1)[0])
+        except RedisError:
+            return True
+        return bool(record) and record["state"] in (STATE_QUEUED, STATE_PROCESSING)
+
+    def janitor(self) -> int:
+        """
+        Delete uploads older than the TTL, then the oldest ones until under
+        quota. Uploads whose bill is still queued or processing are never
+        deleted, however long the backlog; quota eviction also skips spool
+        files still being written.
+        """
+        self._last_janitor_run = time.time()
+        removed = 0
+        files = []
+        for path in self.uploads_dir.iterdir():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if not path.is_file():
+                continue
+            if time.time() - stat.st_mtime > self.ttl_seconds and not self._in_flight(path):
+                path.unlink(missing_ok=True)
+                removed += 1
+            else:
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.quota_bytes:
+                break
+            if path.name.startswith(".incoming-") or self._in_flight(path):
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+
+        if removed:
+            print(f"🧹 Upload janitor removed {removed} file(s) from {self.uploads_dir}")
+        return removed
+
+
+class RedisHandoff(UploadHandoff):
+    """
+    Uploads as Redis values keyed by content hash. Identical uploads share one
+    key, so the value is left to expire through its TTL instead of being
+    deleted when one bill finishes.
+    """
+
+    def __init__(self, redis_bytes_client: Redis, ttl_seconds: int = UPLOAD_TTL_SECONDS):
+        self.redis = redis_bytes_client
+        self.ttl_seconds = ttl_seconds
+
+    def put(self, bill_id: str, filename: str, source_path: str, content_hash: str) -> str:
+        key = f"upload:{content_hash}"
+        try:
+            # Identical content may already be waiting; just refresh its TTL
+            if not self.redis.expire(key, self.ttl_seconds):
+                with open(source_path, "rb") as f:
+                    self.redis.set(key, f.read(), ex=self.ttl_seconds)
+        finally:
+            os.remove(source_path)
+        return f"redis:{key}"
+
+    def get(self, handle: str) -> bytes:
+        content = self.redis.get(handle[len("redis:"):])
+        if content is None:
+            raise FileNotFoundError(f"Upload {handle} expired before it was processed")
+        return content
+
+
+class GCSHandoff(UploadHandoff):
+    """
+    Uploads go straight to the bill bucket; the worker reads them back from
+    there. Once extracted the object is the bill's stored image, so only
+    uploads that never got that far are discarded.
+    """
+
+    def __init__(self, storage_manager):
+        self.storage_manager = storage_manager
+
+    def put(self, bill_id: str, filename: str, source_path: str, content_hash: str) -> str:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        destination = f"bills/{timestamp}_{bill_id}_{os.path.basename(filename)}"
+        try:
+            # Streams the file from disk
+            gcs_uri = self.storage_manager.upload_file(source_path, destination)
+        finally:
+            os.remove(source_path)
+        if not gcs_uri:
+            raise RuntimeError("Upload to Google Cloud Storage failed")
+        return gcs_uri
+
+    def get(self, handle: str) -> bytes:
+        return self.storage_manager.download_bytes(handle)
+
+    def discard(self, handle: str):
+        self.storage_manager.delete(handle)
+
+    def storage_uri(self, handle: str) -> Optional[str]:
+        return handle
+
+
+def create_upload_handoff(system, backend: str = UPLOAD_HANDOFF_BACKEND) -> UploadHandoff:
+    """Build the configured handoff backend"""
+    redis_url = os.getenv("REDIS_URL", "redis://redis:6379/0")
+    if backend == "redis":
+        return RedisHandoff(Redis.from_url(redis_url))
+    if backend == "gcs":
+        if not system.storage_manager:
+            raise ValueError("UPLOAD_HANDOFF_BACKEND=gcs requires GCS to be configured")
+        return GCSHandoff(system.storage_manager)
+    return LocalDiskHandoff(redis_client=Redis.from_url(redis_url, decode_responses=True))
+
+
+if __name__ == "__main__":
+    # Run the local-disk janitor once, e.g. from cron
+    create_upload_handoff(None, backend="local").janitor()
@@ -0,0 +1,199 @@
+"""
+Streaming ingestion of uploaded bill images.
+
+Copies an upload to a spool file in fixed-size chunks instead of reading it
+into memory, computing its SHA-256 and enforcing the size limit on the fly.
+The image type is sniffed from the first bytes, so non-images are rejected
+before the rest of the body is copied.
+
+Starlette spools the whole multipart form before the endpoint runs, so the
+per-file checks above only happen after the body has been received.
+RequestSizeLimit bounds the request body itself: it answers 413 from the
+Content-Length header, or once a chunked body goes over, without letting
+Starlette read any further.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from typing import Optional, Sequence
+
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "20")) * 1024 * 1024
+
+# Allowance for multipart boundaries, headers and form fields around the files
+MULTIPART_OVERHEAD_BYTES = 1024 * 1024
+
+# Bytes needed to recognize every supported format
+SNIFF_BYTES = 32
+
+HEIF_BRANDS = (b"heic", b"heix", b"hevc", b"hevx", b"heim", b"heis", b"mif1", b"msf1")
+
+
+class UploadRejected(Exception):
+    """Upload refused while streaming; carries the HTTP status to return"""
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+class RequestSizeLimit:
+    """
+    ASGI middleware rejecting request bodies over max_bytes on the given
+    paths with 413, before the application reads them.
+
+    Nothing is raised through the application: past the limit the app is
+    told the client disconnected, and whatever it answers to that (FastAPI
+    makes it a 400 parse error) is replaced with the 413.
+    """
+    def __init__(self, app, max_bytes: int, paths: Sequence[str]):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = tuple(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get("headers") or [])
+        length = headers.get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > self.max_bytes:
+            return await self._reject(send)
+
+        received = 0
+        too_large = False
+        started = False  # the app's own response has begun
+        rejected = False  # the 413 went out in its place
+
+        async def limited_receive():
+            nonlocal received, too_large
+            if too_large:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    too_large = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def limited_send(message):
+            nonlocal started, rejected
+            if message["type"] == "http.response.start":
+                if too_large and not started:
+                    rejected = True
+                    return await self._reject(send)
+                started = True
+            elif rejected:
+                return
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, limited_send)
+        except Exception:
+            if not too_large or started or rejected:
+                raise
+            await self._reject(send)
+
+    async def _reject(self, send):
+        limit = f"{self.max_bytes / (1024 * 1024):g} MB"
+        body = json.dumps({"error": f"Request body exceeds the {limit} limit"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode()),
+                        (b"connection", b"close")],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Detect an image MIME type from the first bytes of a file"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:8] == b"ftyp" and head[8:12] in HEIF_BRANDS:
+        return "image/heic"
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        return "image/tiff"
+    if head[:2] == b"BM":
+        return "image/bmp"
+    return None
+
+
+class StreamedUpload:
+    """An upload spooled to disk, with its size, hash and sniffed type"""
+    def __init__(self, path: str, size: int, sha256: str, content_type: str):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.content_type = content_type
+
+    def cleanup(self):
+        """Remove the spool file unless it has already been moved/consumed"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+async def stream_upload(upload, spool_dir: str, max_bytes: int = MAX_UPLOAD_BYTES,
+                        chunk_size: int = UPLOAD_CHUNK_SIZE) -> StreamedUpload:
+    """
+    Copy an upload (anything with an async read(n), e.g. FastAPI's UploadFile)
+    to a spool file in spool_dir, chunk by chunk.
+
+    Raises:
+        UploadRejected: 415 if the content is not an image, 413 if it is too large,
+            400 if it is empty
+    """
+    os.makedirs(spool_dir, exist_ok=True)
+    spool = tempfile.NamedTemporaryFile(dir=spool_dir, prefix=".incoming-", delete=False)
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    content_type = None
+
+    try:
+        with spool:
+            while True:
+                chunk = await upload.read(chunk_size)
+                if not chunk:
+                    break
+
+                if content_type is None:
+                    head += chunk[:SNIFF_BYTES]
+                    if len(head) >= SNIFF_BYTES:
+                        content_type = sniff_image_type(head)
+                        if content_type is None:
+                            raise UploadRejected(415, "Uploaded file is not a supported image")
+
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadRejected(413, f"Upload exceeds the {max_bytes / (1024 * 1024):g} MB limit")
+
+                digest.update(chunk)
+                spool.write(chunk)
+
+        if size == 0:
+            raise UploadRejected(400, "Uploaded file is empty")
+        if content_type is None:
+            # Tiny file: sniff whatever we have
+            content_type = sniff_image_type(head)
+            if content_type is None:
+                raise UploadRejected(415, "Uploaded file is not a supported image")
+
+    except BaseException:
+        os.remove(spool.name)
+        raise
+
+    return StreamedUpload(spool.name, size, digest.hexdigest(), content_type)
@@ -0,0 +1,300 @@
+"""
+Database access for Celery workers.
+
+Each worker process keeps one psycopg2 connection pool (initialized on
+worker_process_init) instead of opening a fresh connection per bill, and
+bill rows are written through a BatchedBillWriter that coalesces results
+from concurrent tasks into a single multi-row upsert, flushed when the
+batch is full or the oldest row has waited long enough.
+"""
+
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import psycopg2
+from psycopg2.extras import Json, execute_values
+from psycopg2.pool import ThreadedConnectionPool
+
+import spend_analytics
+from bill_items import replace_normalized
+from bill_summary import summarize
+from json_codec import dumps_str
+from metrics import incr_rate, record_sample
+
+
+WORKER_DB_POOL_MIN = int(os.getenv("WORKER_DB_POOL_MIN", "1"))
+WORKER_DB_POOL_MAX = int(os.getenv("WORKER_DB_POOL_MAX", "4"))
+
+# Flush a batch when it reaches this many bills...
+DB_WRITE_BATCH_SIZE = int(os.getenv("DB_WRITE_BATCH_SIZE", "25"))
+# ...or when its oldest bill has waited this long (seconds)
+DB_WRITE_MAX_DELAY = float(os.getenv("DB_WRITE_MAX_DELAY", "0.25"))
+
+UPSERT_BILLS_SQL = """
+    INSERT INTO bill_data (bill_id, file_name, bill_json, content_hash, instruction, response_body,
+                           user_id, merchant, total, bill_date, item_count, search_text)
+    VALUES %s
+    ON CONFLICT (bill_id) DO UPDATE
+    SET file_name = EXCLUDED.file_name,
+        bill_json = EXCLUDED.bill_json,
+        response_body = EXCLUDED.response_body,
+        user_id = COALESCE(EXCLUDED.user_id, bill_data.user_id),
+        merchant = EXCLUDED.merchant,
+        total = EXCLUDED.total,
+        bill_date = EXCLUDED.bill_date,
+        item_count = EXCLUDED.item_count,
+        search_text = EXCLUDED.search_text,
+        content_hash = COALESCE(EXCLUDED.content_hash, bill_data.content_hash),
+        instruction = COALESCE(EXCLUDED.instruction, bill_data.instruction)
+"""
+
+
+def sync_database_url() -> str:
+    """DATABASE_URL in the form psycopg2 understands"""
+    return os.getenv("DATABASE_URL").replace('+asyncpg', '')
+
+
+# ============================================================================
+# CONNECTION POOL
+# ============================================================================
+
+class CountingConnectionPool(ThreadedConnectionPool):
+    """ThreadedConnectionPool that reports every new physical connection"""
+
+    def __init__(self, minconn: int, maxconn: int, *args, redis_client=None, **kwargs):
+        self.redis = redis_client
+        super().__init__(minconn, maxconn, *args, **kwargs)
+
+    def _connect(self, key=None):
+        conn = super()._connect(key)
+        if self.redis is not None:
+            try:
+                incr_rate(self.redis, "db_connections_opened")
+            except Exception:
+                pass
+        return conn
+
+    def run(self, fn):
+        """
+        Run fn(conn) on a pooled connection and commit. A connection that
+        turns out to be dead is discarded and the call retried once.
+        """
+        for attempt in range(2):
+            conn = self.getconn()
+            try:
+                result = fn(conn)
+                conn.commit()
+                self.putconn(conn)
+                return result
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                self.putconn(conn, close=True)
+                if attempt == 1:
+                    raise
+            except Exception:
+                conn.rollback()
+                self.putconn(conn)
+                raise
+
+
+# ============================================================================
+# BATCHED WRITES
+# ============================================================================
+
+class PendingWrite:
+    """One bill waiting for its batch to be flushed"""
+    def __init__(self, bill_id: str, file_name: str, bill_json: Dict,
+                 content_hash: Optional[str] = None, instruction: Optional[str] = None,
+                 response_body: Optional[str] = None, user_id: Optional[int] = None):
+        self.bill_id = bill_id
+        self.file_name = file_name
+        self.bill_json = bill_json
+        self.content_hash = content_hash
+        self.instruction = instruction
+        self.response_body = response_body
+        self.user_id = user_id
+        self.submitted_at = time.monotonic()
+        self.done = threading.Event()
+        self.error: Optional[Exception] = None
+
+
+class BatchedBillWriter:
+    """Coalesces bill upserts from concurrent tasks into multi-row statements"""
+
+    def __init__(self, pool: CountingConnectionPool, redis_client=None,
+                 batch_size: int = DB_WRITE_BATCH_SIZE, max_delay: float = DB_WRITE_MAX_DELAY):
+        self.pool = pool
+        self.redis = redis_client
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._pending: List[PendingWrite] = []
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._flusher = threading.Thread(target=self._run, name="bill-writer", daemon=True)
+        self._flusher.start()
+
+    def write(self, bill_id: str, file_name: str, bill_json: Dict,
+              content_hash: Optional[str] = None, instruction: Optional[str] = None,
+              response_body: Optional[str] = None, user_id: Optional[int] = None,
+              timeout: float = 60) -> float:
+        """
+        Queue a bill for the next batch and block until it is committed.
+        response_body is the pre-serialized GET /bill/{bill_id} body, if any.
+        Returns the write latency in seconds.
+        """
+        pending = PendingWrite(bill_id, file_name, bill_json, content_hash, instruction,
+                               response_body, user_id)
+        with self._cond:
+            self._pending.append(pending)
+            self._cond.notify()
+
+        if not pending.done.wait(timeout):
+            raise TimeoutError(f"Database write for bill {bill_id} timed out")
+        if pending.error:
+            raise pending.error
+
+        latency = time.monotonic() - pending.submitted_at
+        if self.redis is not None:
+            try:
+                record_sample(self.redis, "db_write_latency", latency)
+            except Exception:
+                pass
+        return latency
+
+    def flush(self):
+        """Write everything pending right now"""
+        with self._cond:
+            batch, self._pending = self._pending, []
+        self._write_batch(batch)
+
+    def close(self):
+        """Flush remaining bills and stop the flusher thread"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._flusher.join(timeout=5)
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+
+                # Wait for the batch to fill up, or for the oldest bill's deadline
+                deadline = self._pending[0].submitted_at + self.max_delay
+                while len(self._pending) < self.batch_size and not self._stopped:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                batch = self._pending[:self.batch_size]
+                self._pending = self._pending[self.batch_size:]
+
+            self._write_batch(batch)
+
+    def _write_batch(self, batch: List[PendingWrite]):
+        if not batch:
+            return
+
+        errors: Dict[str, Exception] = {}
+        try:
+            self._upsert(batch)
+        except Exception as e:
+            bill_ids = list(dict.fromkeys(pending.bill_id for pending in batch))
+            if len(bill_ids) == 1:
+                errors[bill_ids[0]] = e
+            else:
+                # One bad row fails the whole transaction: retry bill by bill so only it fails
+                print(f"⚠️  Batch of {len(bill_ids)} bills failed ({e}); retrying them one at a time")
+                for bill_id in bill_ids:
+                    try:
+                        self._upsert([pending for pending in batch if pending.bill_id == bill_id])
+                    except Exception as bill_error:
+                        errors[bill_id] = bill_error
+
+        for pending in batch:
+            pending.error = errors.get(pending.bill_id)
+            pending.done.set()
+
+    def _upsert(self, batch: List[PendingWrite]):
+        """Write a batch in one transaction"""
+        # A statement may not upsert the same key twice; the latest write wins
+        rows = {}
+        for pending in batch:
+            # History summary columns are derived here, once per write
+            summary = summarize(pending.bill_json)
+            rows[pending.bill_id] = (
+                pending.bill_id, pending.file_name, Json(pending.bill_json, dumps=dumps_str),
+                pending.content_hash, pending.instruction, pending.response_body,
+                pending.user_id, summary["merchant"], summary["total"],
+                summary["bill_date"], summary["item_count"], summary["search_text"],
+            )
+
+        latest = {pending.bill_id: pending.bill_json for pending in batch}
+
+        def upsert(conn):
+            with conn.cursor() as cur:
+                # Take re-written bills' previous version out of the spend aggregates...
+                retracted = spend_analytics.retract(cur, list(rows))
+                execute_values(cur, UPSERT_BILLS_SQL, list(rows.values()))
+                # Same transaction: items/shares never disagree with bill_json
+                replace_normalized(cur, latest.items())
+                # ...and add the new one, computed from the rows just written
+                spend_analytics.apply(cur, list(rows), retracted)
+
+        self.pool.run(upsert)
+
+
+# ============================================================================
+# PER-PROCESS STATE
+# ============================================================================
+
+_pool: Optional[CountingConnectionPool] = None
+_writer: Optional[BatchedBillWriter] = None
+_lock = threading.Lock()
+
+
+def init_worker_db(redis_client=None):
+    """Create this worker process's pool and batch writer (worker_process_init hook)"""
+    global _pool, _writer
+    with _lock:
+        if _pool is None:
+            _pool = CountingConnectionPool(
+                WORKER_DB_POOL_MIN, WORKER_DB_POOL_MAX, sync_database_url(),
+                redis_client=redis_client,
+            )
+            _writer = BatchedBillWriter(_pool, redis_client)
+            print(f"✅ Worker DB pool ready (max {WORKER_DB_POOL_MAX} connections)")
+
+
+def close_worker_db():
+    """Flush pending writes and close pooled connections (worker_process_shutdown hook)"""
+    global _pool, _writer
+    with _lock:
+        if _writer is not None:
+            _writer.close()
+        if _pool is not None:
+            _pool.closeall()
+        _pool = _writer = None
+
+
+def get_worker_pool(redis_client=None) -> CountingConnectionPool:
+    """
+    This process's connection pool. Created lazily for pools without child
+    processes (threads/gevent/solo), where worker_process_init never fires.
+    """
+    if _pool is None:
+        init_worker_db(redis_client)
+    return _pool
+
+
+def get_bill_writer(redis_client=None) -> BatchedBillWriter:
+    """This process's batched bill writer"""
+    if _writer is None:
+        init_worker_db(redis_client)
+    return _writer
@@ -0,0 +1,108 @@
+"""
+Worker warm start.
+
+Runs once per worker process before it takes tasks: initializes the model
+and storage clients, opens the Redis and database pools and optionally
+pushes a synthetic bill through a fake model. Only after that does the
+worker report itself ready, both in Redis (workers:ready) and through a
+file that container health checks can test for. A worker whose warm-up
+fails shuts down instead of taking tasks cold.
+"""
+
+import json
+import os
+import signal
+import socket
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from metrics import record_sample
+from worker_db import get_worker_pool
+
+
+WORKER_READY_FILE = os.getenv("WORKER_READY_FILE", "/tmp/worker_ready")
+WORKER_WARMUP_SYNTHETIC = os.getenv("WORKER_WARMUP_SYNTHETIC", "false").lower() in ("1", "true", "yes")
+
+_warmed: Optional[Dict] = None
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def is_prefork(worker) -> bool:
+    """Whether a WorkController runs tasks in forked child processes"""
+    pool_cls = getattr(worker, "pool_cls", None)
+    name = getattr(pool_cls, "__module__", None) or str(pool_cls or "prefork")
+    return "prefork" in name
+
+
+def warm_up_worker(system, redis_client, started_at: float) -> Optional[Dict]:
+    """
+    Warm up this process and mark it ready. Safe to call more than once.
+    Returns the warm-up report (the earlier one if it already ran), or None
+    if it failed.
+    """
+    global _warmed
+    if _warmed:
+        return _warmed
+
+    try:
+        timings = system.warm_up(synthetic=WORKER_WARMUP_SYNTHETIC)
+
+        start = time.time()
+        redis_client.ping()
+        timings["redis"] = time.time() - start
+
+        start = time.time()
+        get_worker_pool(redis_client).run(lambda conn: conn.cursor().execute("SELECT 1"))
+        timings["database"] = time.time() - start
+
+    except Exception as e:
+        print(f"❌ Worker warm-up failed, not reporting ready: {e}")
+        return None
+
+    cold_start = time.time() - started_at
+    report = {
+        "cold_start_seconds": round(cold_start, 3),
+        "steps": {step: round(seconds, 3) for step, seconds in timings.items()},
+        "ready_at": time.time(),
+    }
+
+    record_sample(redis_client, "worker_cold_start", cold_start)
+    redis_client.hset("workers:ready", worker_name(), json.dumps(report))
+    Path(WORKER_READY_FILE).write_text(json.dumps(report))
+
+    _warmed = report
+    print(f"✅ Worker warm in {cold_start:.2f}s: {report['steps']}")
+    return report
+
+
+def stop_cold_worker(child: bool = False):
+    """
+    Keep a worker whose warm-up failed from consuming tasks. A prefork
+    child asks the main process for a warm shutdown and exits before its
+    pool loop starts (so it isn't simply respawned); the main process
+    exits during startup.
+    """
+    if child:
+        os.kill(os.getppid(), signal.SIGTERM)
+        os._exit(1)
+    # Celery signal handlers swallow Exception, not SystemExit
+    raise SystemExit(1)
+
+
+def mark_not_ready(redis_client, remove_ready_file: bool = True):
+    """
+    Withdraw readiness when the process shuts down. The ready file is shared
+    by all prefork children, so only the main process removes it.
+    """
+    global _warmed
+    _warmed = None
+    try:
+        redis_client.hdel("workers:ready", worker_name())
+    except Exception:
+        pass
+    if remove_ready_file:
+        Path(WORKER_READY_FILE).unlink(missing_ok=True)